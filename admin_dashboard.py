@@ -1,12 +1,21 @@
 import streamlit as st
 import pandas as pd
+import plotly.express as px
+import io
+import os
 from datetime import datetime, date, timedelta
 from utils import (
     create_pie_chart, create_bar_chart, format_currency, 
     format_date, format_datetime, create_data_table,
     validate_email, validate_phone, get_flat_numbers, get_allotted_flat_numbers,
-    generate_unique_key, get_flat_display_options, get_available_flat_numbers
+    generate_unique_key, get_flat_display_options, get_available_flat_numbers, payment_idempotency_key
 )
+from database import VISITOR_MAX_STAY_HOURS, VISITOR_OVERSTAY_HOURS
+from realtime import POLL_SECONDS, get_relay
+
+COMPLAINTS_PAGE_SIZE = 25
+COMPLAINT_CATEGORIES = ["Maintenance", "Plumbing", "Electrical", "Security", "Noise", "Parking", "Cleanliness",
+                        "Elevator", "Water Supply", "Other"]
 
 class AdminDashboard:
     def __init__(self, db):
@@ -16,8 +25,16 @@ class AdminDashboard:
         st.title("🏠 Vishwakarma Apartment")
         st.caption("📍 Pune | Admin Dashboard")
         
-        # Get society statistics
-        stats = self.db.get_society_stats()
+        # Get society statistics; the chart breakdowns come from the analytics store when it is there
+        import analytics_store
+        try:
+            breakdowns = {**analytics_store.billing_summary(), **analytics_store.complaint_summary()}
+        except analytics_store.StoreUnavailable:
+            breakdowns = None
+        stats = self.db.get_society_stats(breakdowns=breakdowns is None)
+        if breakdowns:
+            stats['bill_stats'] = breakdowns['bill_stats']
+            stats['complaint_stats'] = breakdowns['complaint_stats']
         
         st.markdown("### 📊 Quick Overview")
         col1, col2, col3, col4, col5 = st.columns(5)
@@ -172,28 +189,17 @@ class AdminDashboard:
                     ownership_start_date = st.date_input("Ownership Start Date", value=date.today(), key="owner_start_date")
                     emergency_contact = st.text_input("Emergency Contact", key="owner_emergency_contact")
                 else:  # tenant
-                    # Get available owners - Simple query
+                    # Get available owners with their names
                     cursor = self.db.connection.cursor()
-                    cursor.execute("SELECT * FROM owners ORDER BY flat_number")
-                    owners_data = cursor.fetchall()
+                    cursor.execute("""
+                        SELECT o.owner_id, u.name, u.flat_number
+                        FROM owners o
+                        JOIN users u ON u.user_id = o.user_id
+                        ORDER BY o.flat_number
+                    """)
+                    owners = [{'owner_id': o[0], 'name': o[1], 'flat_number': o[2]} for o in cursor.fetchall()]
                     cursor.close()
                     
-                    # Convert to list
-                    owners = []
-                    for o in owners_data:
-                        # Get owner name
-                        cursor2 = self.db.connection.cursor()
-                        cursor2.execute("SELECT name, flat_number FROM users WHERE user_id = %s", (o[1],))
-                        user_data = cursor2.fetchone()
-                        cursor2.close()
-                        
-                        if user_data:
-                            owners.append({
-                                'owner_id': o[0],
-                                'name': user_data[0],
-                                'flat_number': user_data[1]
-                            })
-                    
                     owner_options = {f"{owner['name']} (Flat {owner['flat_number']})": owner['owner_id'] 
                                    for owner in owners}
                     
@@ -420,11 +426,11 @@ class AdminDashboard:
         # Check for session state tab selection
         default_tab_index = 0
         if hasattr(st.session_state, 'bill_tab') and st.session_state.bill_tab:
-            tab_mapping = {"Create Bills": 0, "View Bills": 1, "Payment Tracking": 2}
+            tab_mapping = {"Create Bills": 0, "View Bills": 1, "Payment Tracking": 2, "Recurring Billing": 3, "Meter Billing": 4, "Late Fees & Arrears": 5, "Bank Reconciliation": 6}
             default_tab_index = tab_mapping.get(st.session_state.bill_tab, 0)
             st.session_state.bill_tab = None
         
-        tab1, tab2, tab3 = st.tabs(["Create Bills", "View Bills", "Payment Tracking"])
+        tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["Create Bills", "View Bills", "Payment Tracking", "Recurring Billing", "Meter Billing", "Late Fees & Arrears", "Bank Reconciliation"])
         
         with tab1:
             self.create_bill_form()
@@ -432,6 +438,14 @@ class AdminDashboard:
             self.view_bills()
         with tab3:
             self.payment_tracking()
+        with tab4:
+            self.recurring_billing()
+        with tab5:
+            self.meter_billing()
+        with tab6:
+            self.late_fees_and_arrears()
+        with tab7:
+            self.bank_reconciliation()
     
     def create_bill_form(self):
         """Create new bill form"""
@@ -561,7 +575,7 @@ class AdminDashboard:
             status_filter = st.selectbox("Filter by Status", ["all", "pending", "paid", "overdue"], 
                                        index=["all", "pending", "paid", "overdue"].index(default_status), key="bill_status_filter")
         with col2:
-            bill_type_filter = st.selectbox("Filter by Type", ["all", "Maintenance", "Electricity", "Water", "Parking", "Security", "Other"], key="bill_type_filter")
+            bill_type_filter = st.selectbox("Filter by Type", ["all", "Maintenance", "Electricity", "Water", "Parking", "Security", "Late Fee", "Other"], key="bill_type_filter")
         with col3:
             flat_filter = st.text_input("Filter by Flat Number", key="bill_flat_filter")
         
@@ -650,14 +664,10 @@ class AdminDashboard:
                             
                             if st.button("Mark as Paid", key=unique_key):
                                 try:
-                                    cursor = self.db.connection.cursor()
-                                    cursor.execute("""
-                                        UPDATE bills 
-                                        SET payment_status = 'paid', payment_date = CURRENT_DATE, 
-                                            payment_method = 'Admin Override'
-                                        WHERE bill_id = %s
-                                    """, (bill['bill_id'],))
-                                    cursor.close()
+                                    # records the outstanding amount as one payment; a double-click is a no-op
+                                    self.db.pay_bill(bill['bill_id'], 'Admin Override',
+                                                     idempotency_key=payment_idempotency_key(bill),
+                                                     created_by=st.session_state.user['user_id'])
                                     st.success("Bill marked as paid!")
                                     st.rerun()
                                 except Exception as e:
@@ -684,9 +694,91 @@ class AdminDashboard:
         """Payment tracking and analytics"""
         st.subheader("📊 Payment Analytics")
         
+        import analytics_store
+        try:
+            stats = analytics_store.billing_summary()
+            as_of = analytics_store.last_synced()
+        except analytics_store.StoreUnavailable:
+            stats, as_of = self.live_billing_summary(), None
+        
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            st.metric("Total Bills", stats['total_bills'] or 0)
+            st.metric("Paid Bills", stats['paid_bills'] or 0)
+        
+        with col2:
+            st.metric("Pending Bills", stats['pending_bills'] or 0)
+            st.metric("Overdue Bills", stats['overdue_bills'] or 0)
+        
+        with col3:
+            st.metric("Total Amount", format_currency(stats['total_amount'] or 0))
+        
+        with col4:
+            st.metric("Collected Amount", format_currency(stats['collected_amount'] or 0))
+            collection_rate = (stats['collected_amount'] or 0) / (stats['total_amount'] or 1) * 100
+            st.metric("Collection Rate", f"{collection_rate:.1f}%")
+        
+        if as_of:
+            st.caption(f"From the analytics store, as of {format_datetime(as_of)}")
+        
+        self.collection_trends()
+        
+        import payments
+        event_stats = payments.get_payment_event_stats(self.db)
+        if event_stats:
+            waiting = event_stats.get('received', {}).get('count', 0)
+            st.caption(f"Gateway events: {waiting} waiting for the worker · "
+                       + " · ".join(f"{v['count']} {k} today" for k, v in event_stats.items() if k != 'received'))
+        
+        recent = payments.get_recent_payments(self.db)
+        if recent:
+            st.markdown("**Recent Payments**")
+            st.dataframe(pd.DataFrame([{
+                'Payment': p['payment_id'], 'Bill': p['bill_id'], 'Flat': p['flat_number'], 'Type': p['bill_type'],
+                'Amount': format_currency(p['amount']), 'Method': p['payment_method'],
+                'Gateway Ref': p['gateway_ref'] or '', 'Bill Status': p['payment_status'].title(),
+                'Received': format_datetime(p['created_at'])
+            } for p in recent]), use_container_width=True, hide_index=True)
+    
+    def collection_trends(self):
+        """Billed vs collected over time, from the collection_daily rollup"""
+        st.markdown("**📈 Collection Trends**")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            grain = st.radio("Period", ["month", "week"], horizontal=True, format_func=str.title, key="trend_grain")
+        with col2:
+            by = st.radio("Breakdown", ["none", "bill_type", "block"], horizontal=True,
+                          format_func=lambda b: {"none": "Total", "bill_type": "Bill Type", "block": "Block"}[b],
+                          key="trend_by")
+        with col3:
+            span = st.selectbox("Range", ["12 months", "36 months", "All history"], key="trend_span")
+        since = None
+        if span != "All history":
+            since = (date.today().replace(day=1) - timedelta(days=31 * (int(span.split()[0]) - 1))).replace(day=1)
+        
+        trends = self.db.get_collection_trends(grain, None if by == "none" else by, since)
+        if not trends:
+            st.info("No bills in this range")
+            return
+        df = pd.DataFrame([{
+            'Period': t['period'], 'Group': t['group'], 'Billed': float(t['billed']),
+            'Collected': float(t['collected']), 'Collection Rate %': t['collection_rate']
+        } for t in trends])
+        if by == "none":
+            fig = px.bar(df.melt(id_vars='Period', value_vars=['Billed', 'Collected'], var_name='Series', value_name='Amount'),
+                         x='Period', y='Amount', color='Series', barmode='group', title="Billed vs Collected")
+            st.plotly_chart(fig, use_container_width=True)
+            fig = px.line(df, x='Period', y='Collection Rate %', markers=True, title="Collection Rate")
+        else:
+            fig = px.line(df, x='Period', y='Collection Rate %', color='Group', markers=True,
+                          title=f"Collection Rate by {'Bill Type' if by == 'bill_type' else 'Block'}")
+        st.plotly_chart(fig, use_container_width=True)
+    
+    def live_billing_summary(self):
+        """Bill counts and totals straight from PostgreSQL, used when the analytics store is unavailable"""
         cursor = self.db.connection.cursor()
         
-        # Payment statistics - using simple queries
         cursor.execute("SELECT COUNT(*) FROM bills")
         total_bills = cursor.fetchone()[0]
         
@@ -702,10 +794,11 @@ class AdminDashboard:
         cursor.execute("SELECT SUM(amount) FROM bills")
         total_amount = cursor.fetchone()[0] or 0
         
-        cursor.execute("SELECT SUM(amount) FROM bills WHERE payment_status = 'paid'")
+        cursor.execute("SELECT SUM(amount_paid) FROM bills")
         collected_amount = cursor.fetchone()[0] or 0
         
-        stats = {
+        cursor.close()
+        return {
             'total_bills': total_bills,
             'paid_bills': paid_bills,
             'pending_bills': pending_bills,
@@ -713,26 +806,262 @@ class AdminDashboard:
             'total_amount': total_amount,
             'collected_amount': collected_amount
         }
+    
+    def recurring_billing(self):
+        """Billing plans and the monthly bill generator"""
+        import billing_engine
+        
+        st.subheader("🔁 Recurring Billing")
+        
+        plans = billing_engine.get_billing_plans(self.db)
+        if plans:
+            st.dataframe(pd.DataFrame([{
+                'Plan': p['plan_id'], 'Bill Type': p['bill_type'], 'Amount': format_currency(p['amount']),
+                'Applies To': 'All flats' if p['scope'] == 'all' else f"{p['scope'].title()} {p['scope_value']}",
+                'Due Day': p['due_day'], 'Description': p['description'] or ''
+            } for p in plans]), use_container_width=True, hide_index=True)
+            
+            plan_options = {f"#{p['plan_id']} {p['bill_type']} ({'all' if p['scope'] == 'all' else p['scope_value']})": p['plan_id'] for p in plans}
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                selected_plan = st.selectbox("Plan", list(plan_options.keys()), key="deactivate_plan_select")
+            with col2:
+                st.write("")
+                if st.button("Deactivate Plan", key="deactivate_plan_button"):
+                    billing_engine.set_billing_plan_active(self.db, plan_options[selected_plan], False)
+                    st.success("Plan deactivated")
+                    st.rerun()
+        else:
+            st.info("No billing plans yet. Tenant rent is billed automatically from the tenants table.")
         
-        col1, col2, col3, col4 = st.columns(4)
+        with st.expander("➕ Add Billing Plan"):
+            with st.form("billing_plan_form"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    bill_type = st.selectbox("Bill Type", ["Maintenance", "Parking", "Security", "Water", "Electricity", "Other"], key="plan_bill_type")
+                    amount = st.number_input("Monthly Amount", min_value=0.0, value=0.0, key="plan_amount",
+                                             help="0 on a flat plan exempts that flat")
+                    due_day = st.number_input("Due Day of Month", min_value=1, max_value=28, value=10, key="plan_due_day")
+                with col2:
+                    scope = st.selectbox("Applies To", ["all", "block", "flat"], key="plan_scope",
+                                         format_func=lambda s: {"all": "All flats", "block": "One block", "flat": "One flat"}[s])
+                    scope_value = st.text_input("Block letter or flat number", key="plan_scope_value").strip().upper()
+                    description = st.text_input("Description (Optional)", key="plan_description")
+                
+                if st.form_submit_button("Save Plan"):
+                    try:
+                        billing_engine.add_billing_plan(self.db, bill_type, amount, scope, scope_value, int(due_day),
+                                                        st.session_state.user['user_id'], description or None)
+                        st.success("✅ Billing plan saved")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"❌ Error saving plan: {e}")
         
+        st.divider()
+        st.markdown("**Generate Bills for a Month**")
+        col1, col2 = st.columns([1, 2])
         with col1:
-            st.metric("Total Bills", stats['total_bills'] or 0)
-            st.metric("Paid Bills", stats['paid_bills'] or 0)
+            period_day = st.date_input("Billing Month", value=date.today().replace(day=1), key="billing_period_input")
+            period = billing_engine.month_start(period_day)
         
+        preview = billing_engine.preview_period(self.db, period)
         with col2:
-            st.metric("Pending Bills", stats['pending_bills'] or 0)
-            st.metric("Overdue Bills", stats['overdue_bills'] or 0)
+            if preview:
+                st.write(f"Bills still to create for **{period.strftime('%B %Y')}**:")
+                for row in preview:
+                    st.write(f"• {row['bill_type']}: {row['bills']} bills, {format_currency(row['amount'])}")
+            else:
+                st.success(f"✅ All bills for {period.strftime('%B %Y')} have been generated")
+        
+        if preview and st.button("🚀 Generate Bills", key="generate_period_bills"):
+            try:
+                rows = billing_engine.generate_period(self.db, period, st.session_state.user['user_id'])
+                st.success(f"✅ Created {sum(r['bills'] for r in rows)} bills for {period.strftime('%B %Y')}")
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Error generating bills: {e}")
+        
+        runs = billing_engine.get_billing_runs(self.db)
+        if runs:
+            st.markdown("**Recent Runs**")
+            st.dataframe(pd.DataFrame([{
+                'Month': r['billing_period'].strftime('%B %Y'), 'Bills': r['bills_created'],
+                'Total': format_currency(r['total_amount']), 'Run At': format_datetime(r['run_at']),
+                'Run By': r['run_by'] or 'Worker'
+            } for r in runs]), use_container_width=True, hide_index=True)
+    
+    def meter_billing(self):
+        """Meter reading upload and metered electricity/water bills"""
+        import metering
+        
+        st.subheader("⚡ Meter Billing")
+        st.caption("Upload cumulative readings as CSV with columns flat_number, utility (electricity/water), "
+                   "reading_date, reading. Use COMMON or COMMON-<block> for common-area meters.")
+        
+        uploaded = st.file_uploader("Meter Readings CSV", type=["csv"], key="meter_readings_upload")
+        if uploaded is not None and st.button("📥 Import Readings", key="import_meter_readings"):
+            try:
+                loaded, rejected = metering.ingest_csv(self.db, uploaded)
+                st.success(f"✅ Imported {loaded} readings")
+                if len(rejected):
+                    st.warning(f"{len(rejected)} rows were rejected (unknown utility, bad date or reading)")
+                    st.dataframe(rejected.head(100), use_container_width=True, hide_index=True)
+            except Exception as e:
+                st.error(f"❌ Error importing readings: {e}")
         
-        with col3:
-            st.metric("Total Amount", format_currency(stats['total_amount'] or 0))
+        st.divider()
+        period_day = st.date_input("Billing Month", value=date.today().replace(day=1), key="meter_period_input")
+        period = metering.month_start(period_day)
+        charges, report = metering.preview_period(self.db, period)
         
-        with col4:
-            st.metric("Collected Amount", format_currency(stats['collected_amount'] or 0))
-            collection_rate = (stats['collected_amount'] or 0) / (stats['total_amount'] or 1) * 100
-            st.metric("Collection Rate", f"{collection_rate:.1f}%")
+        if charges.empty:
+            st.info(f"No billable meter readings for {period.strftime('%B %Y')}")
+        else:
+            summary = charges.groupby('bill_type').agg(Meters=('amount', 'size'), Units=('units', 'sum'),
+                                                       Amount=('amount', 'sum')).reset_index()
+            summary['Amount'] = summary['Amount'].apply(format_currency)
+            st.dataframe(summary.rename(columns={'bill_type': 'Bill Type'}), use_container_width=True, hide_index=True)
+        
+        if len(report):
+            st.warning(f"⚠️ {len(report)} meters are left out of billing until their readings are fixed")
+            st.dataframe(report.rename(columns={'flat_number': 'Flat', 'utility': 'Utility', 'issue': 'Issue'}),
+                         use_container_width=True, hide_index=True)
+        
+        if not charges.empty and st.button("🚀 Generate Metered Bills", key="generate_meter_bills"):
+            try:
+                created, _, _ = metering.bill_period(self.db, period, st.session_state.user['user_id'])
+                st.success(f"✅ Created {created} bills for {period.strftime('%B %Y')} "
+                           f"(meters billed before are skipped)")
+            except Exception as e:
+                st.error(f"❌ Error generating bills: {e}")
+    
+    def late_fees_and_arrears(self):
+        """Late-fee policies and the arrears aging report"""
+        import late_fees
+        
+        st.subheader("⏰ Late Fees")
+        policies = late_fees.get_late_fee_policies(self.db)
+        if policies:
+            st.dataframe(pd.DataFrame([{
+                'Policy': p['policy_id'], 'Bill Type': p['bill_type'] or 'All types',
+                'Flat Fee': format_currency(p['flat_fee']), 'Daily %': float(p['daily_rate_percent']),
+                'Grace Days': p['grace_days'],
+                'Cap': format_currency(p['max_fee']) if p['max_fee'] is not None else '',
+                'Cap % of Bill': float(p['max_percent']) if p['max_percent'] is not None else ''
+            } for p in policies]), use_container_width=True, hide_index=True)
+            
+            policy_options = {f"#{p['policy_id']} {p['bill_type'] or 'All types'}": p['policy_id'] for p in policies}
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                selected_policy = st.selectbox("Policy", list(policy_options.keys()), key="deactivate_policy_select")
+            with col2:
+                st.write("")
+                if st.button("Deactivate Policy", key="deactivate_policy_button"):
+                    late_fees.deactivate_late_fee_policy(self.db, policy_options[selected_policy])
+                    st.rerun()
+        else:
+            st.info("No late-fee policies yet. Unpaid bills are only marked overdue.")
         
-        cursor.close()
+        with st.expander("➕ Add Late-Fee Policy"):
+            with st.form("late_fee_policy_form"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    bill_type = st.selectbox("Bill Type", ["All types", "Maintenance", "Rent", "Electricity", "Water", "Parking", "Security", "Other"], key="policy_bill_type")
+                    flat_fee = st.number_input("Flat Fee", min_value=0.0, value=0.0, key="policy_flat_fee")
+                    daily_rate = st.number_input("Daily Rate (% of bill)", min_value=0.0, value=0.0, step=0.05, key="policy_daily_rate")
+                with col2:
+                    grace_days = st.number_input("Grace Days", min_value=0, value=0, key="policy_grace_days")
+                    max_fee = st.number_input("Maximum Fee (0 = no cap)", min_value=0.0, value=0.0, key="policy_max_fee")
+                    max_percent = st.number_input("Maximum % of Bill (0 = no cap)", min_value=0.0, value=0.0, key="policy_max_percent")
+                
+                if st.form_submit_button("Save Policy"):
+                    try:
+                        late_fees.add_late_fee_policy(self.db, None if bill_type == "All types" else bill_type,
+                                                      flat_fee, daily_rate, int(grace_days), max_fee or None,
+                                                      max_percent or None, st.session_state.user['user_id'])
+                        st.success("✅ Late-fee policy saved")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"❌ Error saving policy: {e}")
+        
+        if policies:
+            count, amount = late_fees.preview_late_fees(self.db)
+            if count:
+                st.write(f"{count} bills have late fees to apply or raise ({format_currency(amount)})")
+                if st.button("Apply Late Fees Now", key="apply_late_fees"):
+                    created, updated, _ = late_fees.apply_late_fees(self.db, created_by=st.session_state.user['user_id'])
+                    st.success(f"✅ {created} late fees created, {updated} raised")
+                    st.rerun()
+            else:
+                st.success("✅ Late fees are up to date")
+        
+        st.divider()
+        st.subheader("📅 Arrears Aging")
+        by = st.radio("Group by", ["block", "flat"], horizontal=True, key="aging_group_by")
+        rows = late_fees.arrears_aging(self.db, by=by)
+        if rows:
+            df = pd.DataFrame([{
+                by.title(): r[by], 'Current': float(r['current']), '0–30 days': float(r['days_0_30']),
+                '31–60 days': float(r['days_31_60']), '61–90 days': float(r['days_61_90']),
+                '90+ days': float(r['days_90_plus']), 'Total': float(r['total']), 'Bills': r['bills']
+            } for r in rows])
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Total Outstanding", format_currency(df['Total'].sum()))
+            with col2:
+                st.metric("Over 90 Days", format_currency(df['90+ days'].sum()))
+            with col3:
+                st.metric(f"{by.title()}s in Arrears", len(df))
+            st.dataframe(df, use_container_width=True, hide_index=True)
+        else:
+            st.success("✅ No outstanding bills")
+    
+    def bank_reconciliation(self):
+        """Match a bank statement to open bills and record the payments in one go"""
+        import reconciliation
+        
+        st.subheader("🏦 Bank Reconciliation")
+        st.write("Upload the bank statement as CSV. Credits are matched to open bills by bill reference, flat number and amount.")
+        statement = st.file_uploader("Bank Statement (CSV)", type=["csv"], key="bank_statement_upload")
+        if statement is None:
+            return
+        
+        try:
+            report = reconciliation.reconcile(self.db, io.BytesIO(statement.getvalue()))
+        except ValueError as e:
+            st.error(f"❌ {e}")
+            return
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Credit Lines", report['lines'])
+        with col2:
+            st.metric("Matched", len(report['matched']))
+        with col3:
+            st.metric("Ambiguous", len(report['ambiguous']))
+        with col4:
+            st.metric("Unmatched", len(report['unmatched']))
+        
+        def lines_frame(lines):
+            return pd.DataFrame([{
+                'Line': l['line'], 'Date': l['date'], 'Description': l['description'], 'Reference': l['reference'],
+                'Credit': float(l['credit']), 'Bills': ', '.join(f"#{a['bill_id']} {a['flat_number']} ({a['amount']})" for a in l['allocations']),
+                'Note': l['note']
+            } for l in lines])
+        
+        if report['matched']:
+            st.write("**Matched**")
+            st.dataframe(lines_frame(report['matched']), use_container_width=True, hide_index=True)
+            total = sum(a['amount'] for l in report['matched'] for a in l['allocations'])
+            if st.button(f"Record {len(report['matched'])} Payments ({format_currency(total)})", type="primary", key="apply_reconciliation"):
+                result = reconciliation.apply_matches(self.db, report, created_by=st.session_state.user['user_id'])
+                st.success(f"✅ {result['payments']} payments recorded ({format_currency(result['amount'])})")
+                if result['skipped']:
+                    st.info(f"{result['skipped']} were already recorded or are no longer due")
+        for status, title in (('ambiguous', "Ambiguous (check manually)"), ('unmatched', "Unmatched")):
+            if report[status]:
+                st.write(f"**{title}**")
+                st.dataframe(lines_frame(report[status]), use_container_width=True, hide_index=True)
     
     def complaint_management(self):
         """Complaint management interface"""
@@ -767,37 +1096,24 @@ class AdminDashboard:
         with col3:
             flat_filter = st.text_input("Filter by Flat", key="complaint_flat_filter")
         
-        # Get complaints - Simple query
-        cursor = self.db.connection.cursor()
-        cursor.execute("SELECT * FROM complaints ORDER BY created_at DESC")
-        complaints_data = cursor.fetchall()
-        
-        # Convert to list and apply filters
-        complaints = []
-        for c in complaints_data:
-            # Apply filters
-            if status_filter != "all" and c[7] != status_filter:
-                continue
-            if priority_filter != "all" and c[6] != priority_filter:
-                continue
-            if flat_filter and flat_filter not in c[2]:
-                continue
-            
-            complaints.append({
-                'complaint_id': c[0],
-                'user_id': c[1],
-                'flat_number': c[2],
-                'title': c[3],
-                'description': c[4],
-                'category': c[5],
-                'priority': c[6],
-                'status': c[7],
-                'created_at': c[8],
-                'resolved_at': c[9] if len(c) > 9 else None,
-                'admin_response': c[10] if len(c) > 10 else None,
-                'updated_at': c[8],
-                'user_name': 'User'
-            })
+        col1, col2, col3 = st.columns([3, 2, 1])
+        with col1:
+            search = st.text_input("Search", placeholder='e.g. water leak -parking, "lift stuck"', key="complaint_search")
+        with col2:
+            category_filter = st.selectbox("Filter by Category", ["all"] + COMPLAINT_CATEGORIES, key="complaint_category_filter")
+        with col3:
+            page = st.number_input("Page", min_value=1, value=1, key="complaint_page")
+        
+        complaints, has_more = self.db.search_complaints(
+            search,
+            status=None if status_filter == "all" else status_filter,
+            category=None if category_filter == "all" else category_filter,
+            priority=None if priority_filter == "all" else priority_filter,
+            flat_number=flat_filter.strip() or None,
+            limit=COMPLAINTS_PAGE_SIZE, offset=(page - 1) * COMPLAINTS_PAGE_SIZE
+        )
+        for complaint in complaints:
+            complaint['user_name'] = 'User'
         
         if complaints and len(complaints) > 0:
             for complaint in complaints:
@@ -805,6 +1121,8 @@ class AdminDashboard:
                     col1, col2 = st.columns([2, 1])
                     
                     with col1:
+                        if complaint['snippet']:
+                            st.markdown(f"**Match:** {complaint['title_highlight']} — {complaint['snippet']}")
                         st.write(f"**Complainant:** {complaint['user_name']}")
                         st.write(f"**Flat:** {complaint['flat_number']}")
                         st.write(f"**Category:** {complaint['category']}")
@@ -825,33 +1143,37 @@ class AdminDashboard:
                                             index=["open", "in_progress", "resolved", "closed"].index(current_status),
                                             key=f"st_{complaint['complaint_id']}")
                     if st.button("Update", key=f"upd_{complaint['complaint_id']}"):
-                        cursor.execute("UPDATE complaints SET status = %s WHERE complaint_id = %s", (new_status, complaint['complaint_id']))
+                        self.db.update_complaint(complaint['complaint_id'], status=new_status)
                         st.success("Updated!")
                         st.rerun()
                     
                     response = st.text_area("Response", value=complaint['admin_response'] or "", key=f"resp_{complaint['complaint_id']}")
                     if st.button("Save", key=f"sav_{complaint['complaint_id']}"):
-                        cursor.execute("UPDATE complaints SET admin_response = %s WHERE complaint_id = %s", (response, complaint['complaint_id']))
+                        self.db.update_complaint(complaint['complaint_id'], admin_response=response)
                         st.success("Saved!")
                         st.rerun()
                     
                     if st.button("🗑️ Delete", key=f"del_{complaint['complaint_id']}"):
                         self.db.delete_complaint(complaint['complaint_id'])
                         st.rerun()
+            if has_more:
+                st.caption(f"More complaints on page {page + 1}")
         else:
             st.info("No complaints found")
-        
-        cursor.close()
     
     def complaint_analytics(self):
         st.subheader("📊 Complaint Analytics")
-        cursor = self.db.connection.cursor()
-        
-        cursor.execute("SELECT status, COUNT(*) FROM complaints GROUP BY status")
-        status_stats = [{'status': r[0], 'count': r[1]} for r in cursor.fetchall()]
-        
-        cursor.execute("SELECT priority, COUNT(*) FROM complaints GROUP BY priority")
-        priority_stats = [{'priority': r[0], 'count': r[1]} for r in cursor.fetchall()]
+        import analytics_store
+        try:
+            summary = analytics_store.complaint_summary()
+            status_stats, priority_stats = summary['complaint_stats'], summary['priority_stats']
+        except analytics_store.StoreUnavailable:
+            cursor = self.db.connection.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM complaints GROUP BY status")
+            status_stats = [{'status': r[0], 'count': r[1]} for r in cursor.fetchall()]
+            cursor.execute("SELECT priority, COUNT(*) FROM complaints GROUP BY priority")
+            priority_stats = [{'priority': r[0], 'count': r[1]} for r in cursor.fetchall()]
+            cursor.close()
         
         col1, col2 = st.columns(2)
         if status_stats:
@@ -862,13 +1184,74 @@ class AdminDashboard:
             fig = create_bar_chart(priority_stats, 'priority', 'count', "By Priority")
             if fig:
                 col2.plotly_chart(fig, width='stretch')
-        cursor.close()
+        
+        self.complaint_sla()
+    
+    def complaint_sla(self):
+        """Response and resolution times against the SLA targets"""
+        import complaint_sla
+        
+        st.subheader("⏱️ Service Levels")
+        rows = complaint_sla.sla_report(self.db)
+        if rows:
+            responded = sum(r['responded'] for r in rows)
+            resolved = sum(r['resolved'] for r in rows)
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Response Breaches", sum(r['response_breaches'] for r in rows),
+                          help=f"of {responded} responded complaints")
+            with col2:
+                st.metric("Resolution Breaches", sum(r['resolve_breaches'] for r in rows),
+                          help=f"of {resolved} resolved complaints")
+            with col3:
+                st.metric("Open Past Target", sum(r['resolve_overdue'] for r in rows))
+            
+            def hours(value):
+                return round(value, 1) if value is not None else None
+            st.dataframe(pd.DataFrame([{
+                'Category': r['category'], 'Priority': r['priority'], 'Open': r['open'],
+                'Response P50 (h)': hours(r['response_p50_hours']), 'Response P90 (h)': hours(r['response_p90_hours']),
+                'Resolve P50 (h)': hours(r['resolve_p50_hours']), 'Resolve P90 (h)': hours(r['resolve_p90_hours']),
+                'Response Breaches': r['response_breaches'], 'Resolve Breaches': r['resolve_breaches'],
+                'Awaiting Response Past Target': r['response_overdue'], 'Open Past Target': r['resolve_overdue']
+            } for r in rows]), use_container_width=True, hide_index=True)
+        else:
+            st.info("No complaints yet")
+        
+        with st.expander("🎯 SLA Targets"):
+            targets = complaint_sla.get_targets(self.db)
+            with st.form("sla_targets_form"):
+                values = {}
+                for priority in complaint_sla.PRIORITIES:
+                    target = targets.get(priority, {'response_hours': 24, 'resolve_hours': 168})
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        response_hours = st.number_input(f"{priority.title()}: respond within (hours)", min_value=0.25,
+                                                         value=float(target['response_hours']), key=f"sla_response_{priority}")
+                    with col2:
+                        resolve_hours = st.number_input(f"{priority.title()}: resolve within (hours)", min_value=0.25,
+                                                        value=float(target['resolve_hours']), key=f"sla_resolve_{priority}")
+                    values[priority] = (response_hours, resolve_hours)
+                if st.form_submit_button("Save Targets"):
+                    complaint_sla.set_targets(self.db, values)
+                    st.success("✅ Targets saved and breaches recomputed")
+                    st.rerun()
+        
+        events = complaint_sla.get_recent_events(self.db)
+        if events:
+            st.markdown("**Recent Status Changes**")
+            st.dataframe(pd.DataFrame([{
+                'Complaint': e['complaint_id'], 'Flat': e['flat_number'], 'Title': e['title'],
+                'Event': e['event_type'].title(),
+                'Change': f"{e['from_status']} → {e['to_status']}" if e['event_type'] == 'status' else e['to_status'],
+                'When': format_datetime(e['created_at'])
+            } for e in events]), use_container_width=True, hide_index=True)
     
     def visitor_management(self):
         """Visitor management interface"""
         st.title("🚶 Visitor Management")
         
-        tab1, tab2, tab3 = st.tabs(["Log Visitor", "Current Visitors", "Visitor History"])
+        tab1, tab2, tab3, tab4 = st.tabs(["Log Visitor", "Current Visitors", "Visitor History", "Visitor Analytics"])
         
         with tab1:
             self.log_visitor_form()
@@ -876,6 +1259,8 @@ class AdminDashboard:
             self.current_visitors()
         with tab3:
             self.visitor_history()
+        with tab4:
+            self.visitor_analytics()
     
     def log_visitor_form(self):
         """Log new visitor form"""
@@ -894,6 +1279,10 @@ class AdminDashboard:
             flat_options = {}
             sorted_options = []
         
+        self.verify_guest_pass()
+        self.gate_approval_status()
+        self.frequent_visitor_lookup(sorted_options)
+        
         with st.form("log_visitor_form"):
             col1, col2 = st.columns(2)
             
@@ -1008,9 +1397,14 @@ class AdminDashboard:
                 else:
                     st.info("📸 Camera ready. Click the camera icon above to take a photo.")
             
-            submit = st.form_submit_button("Log Visitor", key="log_visitor_submit")
+            col1, col2 = st.columns(2)
+            with col1:
+                submit = st.form_submit_button("Log Visitor", key="log_visitor_submit")
+            with col2:
+                ask = st.form_submit_button("📲 Ask Flat to Approve", key="ask_approval_submit",
+                                            help="The flat's residents are asked on their screen; the entry is logged when they approve")
             
-            if submit:
+            if submit or ask:
                 if visitor_name and flat_number:
                     try:
                         # Process photo if uploaded or captured
@@ -1028,6 +1422,15 @@ class AdminDashboard:
                             visitor_photo_data = base64.b64encode(camera_photo.read()).decode()
                             photo_source = "camera"
                         
+                        if ask:
+                            approval_id = self.db.request_visitor_approval(
+                                flat_number, visitor_name, visitor_phone=visitor_phone, purpose=purpose,
+                                vehicle_number=vehicle_number, requested_by=st.session_state.user['user_id'],
+                                visitor_photo=visitor_photo_data)
+                            st.session_state.setdefault('gate_approvals', []).append(approval_id)
+                            st.info(f"📲 Asked Flat {flat_number} to approve {visitor_name}; see the status below.")
+                            return
+                        
                         # Use the new database function with photo support
                         visitor_id = self.db.log_visitor_with_photo(
                             flat_number=flat_number,
@@ -1054,24 +1457,149 @@ class AdminDashboard:
                 else:
                     st.error("Please enter visitor name and select flat number")
     
+    @st.fragment(run_every=POLL_SECONDS)
+    def gate_approval_status(self):
+        """Answers to this gate's approval requests, as realtime.Relay receives them"""
+        approval_ids = st.session_state.get('gate_approvals') or []
+        if not approval_ids:
+            return
+        relay = get_relay()
+        decided = {i: relay.decision(i) for i in approval_ids} if relay.connected else {}
+        # answers the relay missed (made while it reconnected, or older than its DECISION_TTL) come from the database
+        missing = [i for i in approval_ids if decided.get(i) is None]
+        if missing:
+            decided.update({a['approval_id']: a for a in self.db.get_visitor_approvals(approval_ids=missing, pending_only=False)
+                            if a['status'] != 'pending'})
+        
+        st.markdown("**📲 Waiting for Residents**")
+        for approval_id in list(approval_ids):
+            decision = decided.get(approval_id)
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                if decision is None:
+                    st.info(f"⏳ Request #{approval_id}: waiting for the flat to answer")
+                elif decision['status'] == 'approved':
+                    st.success(f"✅ Flat {decision['flat_number']} approved {decision['visitor_name']}; "
+                               f"entry logged (ID: {decision['visitor_id']})")
+                elif decision['status'] == 'denied':
+                    st.error(f"🚫 Flat {decision['flat_number']} denied entry to {decision['visitor_name']}")
+                else:
+                    st.warning(f"Request #{approval_id} was cancelled")
+            with col2:
+                if decision is None:
+                    if st.button("Cancel", key=f"cancel_approval_{approval_id}"):
+                        self.db.cancel_visitor_approval(approval_id)
+                elif st.button("Dismiss", key=f"dismiss_approval_{approval_id}"):
+                    approval_ids.remove(approval_id)
+                    st.rerun(scope="fragment")
+        stats = relay.stats()
+        if stats['push_median_ms'] is not None:
+            shown = f", on the resident's screen {stats['shown_median_ms']:.0f} ms" if stats['shown_median_ms'] is not None else ""
+            st.caption(f"Median push latency {stats['push_median_ms']:.0f} ms over {stats['events']} events{shown}")
+        elif not relay.connected:
+            st.caption("Live updates unavailable; checking the database every second")
+    
+    def verify_guest_pass(self):
+        """Admits a visitor with a resident's guest pass code (typed, or scanned by a keyboard-style QR reader)"""
+        with st.form("guest_pass_verify_form", clear_on_submit=True):
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                code = st.text_input("🎫 Guest Pass Code", placeholder="ABCD-EFGH", key="guest_pass_code")
+            with col2:
+                st.write("")
+                admit = st.form_submit_button("Verify & Admit", type="primary")
+        if admit and code.strip():
+            try:
+                guest_pass = self.db.use_visitor_pass(code, logged_by=st.session_state.user['user_id'])
+            except ValueError as e:
+                st.error(f"🚫 {e}")
+            else:
+                st.success(f"✅ {guest_pass['visitor_name']} admitted to Flat {guest_pass['flat_number']} "
+                           f"(ID: {guest_pass['visitor_id']}), entry {guest_pass['uses']} of {guest_pass['max_uses']}")
+                details = [guest_pass['purpose'], guest_pass['visitor_phone'], guest_pass['vehicle_number']]
+                if any(details):
+                    st.caption(" · ".join(d for d in details if d))
+    
+    def frequent_visitor_lookup(self, sorted_options):
+        """Phone-prefix lookup of known visitors: log them in one click, or fill the form below"""
+        from visitor_registry import get_registry
+        
+        st.markdown("**⚡ Frequent Visitor**")
+        typed = st.text_input("Phone number", key="visitor_lookup_phone", placeholder="Type 3+ digits, e.g. 98220",
+                              label_visibility="collapsed")
+        matches = get_registry(self.db).lookup(typed)
+        if typed and not matches:
+            st.caption("No known visitor with this number; fill in the form below.")
+        
+        def fill_form(profile):
+            st.session_state.visitor_name_input = profile['visitor_name']
+            st.session_state.visitor_phone_input = profile['visitor_phone'] or ""
+            st.session_state.visitor_purpose_input = profile['purpose'] or ""
+            st.session_state.visitor_vehicle_input = profile['vehicle_number'] or ""
+            flat_display = next((o for o in sorted_options if o.split(' - ')[0] == profile['flat_number']), None)
+            if flat_display:
+                st.session_state.visitor_flat_select = flat_display
+        
+        flats = self.db.get_allotted_flat_numbers() if matches else []
+        for profile in matches:
+            col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+            with col1:
+                st.write(f"**{profile['visitor_name']}** · {profile['visitor_phone'] or profile['phone_key']}"
+                         + (f" · 🚗 {profile['vehicle_number']}" if profile['vehicle_number'] else "")
+                         + (" · 📷" if profile['has_photo'] else ""))
+                st.caption(f"{profile['purpose'] or 'No purpose recorded'} · {profile['visits']} visits, "
+                           f"last to Flat {profile['flat_number']} on {format_datetime(profile['last_seen'])}")
+            with col2:
+                flat_number = st.selectbox(
+                    "Flat", flats, key=f"lookup_flat_{profile['phone_key']}", label_visibility="collapsed",
+                    index=flats.index(profile['flat_number']) if profile['flat_number'] in flats else 0)
+            with col3:
+                # no allotted flats means nothing to log the visitor to
+                if st.button("✅ Log", key=f"lookup_log_{profile['phone_key']}", type="primary", disabled=not flats):
+                    logged = self.db.log_known_visitor(profile['phone_key'], flat_number,
+                                                       logged_by=st.session_state.user['user_id'])
+                    if logged:
+                        st.success(f"✅ {logged[1]} logged to Flat {flat_number} (ID: {logged[0]}). "
+                                   f"🔔 Residents will be notified.")
+                    else:
+                        st.error("This visitor profile no longer exists")
+            with col4:
+                st.button("✏️ Fill", key=f"lookup_fill_{profile['phone_key']}", on_click=fill_form, args=(profile,))
+        if matches:
+            st.markdown("---")
+    
     def current_visitors(self):
         """View current visitors"""
         st.subheader("👥 Current Visitors")
         
+        overstay = self.db.get_visitor_overstay_summary()
+        if overstay['overstaying']:
+            st.warning(f"⚠️ {overstay['overstaying']} visitors have been inside for more than "
+                       f"{VISITOR_OVERSTAY_HOURS:g} hours. Check them out if they have left; anyone still 'in' after "
+                       f"{VISITOR_MAX_STAY_HOURS:g} hours is checked out automatically.")
+        if overstay['auto_checked_out']:
+            st.caption(f"{overstay['auto_checked_out']} visitors were checked out automatically in the last 7 days "
+                       f"(no exit was recorded for them).")
+        
         cursor = self.db.connection.cursor()
-        # Simple query for visitors who are currently 'in'
+        # Visitors who are currently 'in' together with a resident name of the flat
         cursor.execute("""
-            SELECT * FROM visitors
-            WHERE status = 'in'
-            ORDER BY entry_time DESC
-        """)
+            SELECT v.visitor_id, v.flat_number, v.visitor_name, v.visitor_phone, v.purpose, v.entry_time,
+                   v.exit_time, v.vehicle_number, v.logged_by, v.status, v.visitor_photo, r.name,
+                   v.entry_time < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+            FROM visitors v
+            LEFT JOIN LATERAL (
+                SELECT name FROM users
+                WHERE flat_number = v.flat_number AND role IN ('owner', 'tenant')
+                LIMIT 1
+            ) r ON TRUE
+            WHERE v.status = 'in'
+            ORDER BY v.entry_time DESC
+        """, (VISITOR_OVERSTAY_HOURS,))
         visitors_data = cursor.fetchall()
         
-        # Get flat owner names separately
         current_visitors = []
         for v in visitors_data:
-            cursor.execute("SELECT name FROM users WHERE flat_number = %s AND role IN ('owner', 'tenant') LIMIT 1", (v[1],))
-            owner_name_result = cursor.fetchone()
             current_visitors.append({
                 'visitor_id': v[0],
                 'flat_number': v[1],
@@ -1083,8 +1611,9 @@ class AdminDashboard:
                 'vehicle_number': v[7],
                 'logged_by': v[8],
                 'status': v[9],
-                'visitor_photo': v[10] if len(v) > 10 else None,
-                'flat_owner_name': owner_name_result[0] if owner_name_result else None
+                'visitor_photo': v[10],
+                'flat_owner_name': v[11],
+                'overstaying': v[12]
             })
         
         if current_visitors and len(current_visitors) > 0:
@@ -1094,7 +1623,8 @@ class AdminDashboard:
                 if visitor['flat_owner_name']:
                     flat_info += f" ({visitor['flat_owner_name']})"
                 
-                with st.expander(f"🟢 {visitor['visitor_name']} - {flat_info}"):
+                status_icon = "⚠️" if visitor['overstaying'] else "🟢"
+                with st.expander(f"{status_icon} {visitor['visitor_name']} - {flat_info} (in since {format_datetime(visitor['entry_time'])})"):
                     col1, col2, col3 = st.columns([2, 1, 1])
                     
                     with col1:
@@ -1129,17 +1659,13 @@ class AdminDashboard:
                         # Use index + visitor_id + entry_time hash for guaranteed unique keys
                         unique_key = f"current_{idx}_{visitor['visitor_id']}_{hash(str(visitor['entry_time']))}"
                         if st.button("Mark Exit", key=f"exit_{unique_key}"):
-                            cursor.execute("""
-                                UPDATE visitors 
-                                SET status = 'out', exit_time = CURRENT_TIMESTAMP
-                                WHERE visitor_id = %s
-                            """, (visitor['visitor_id'],))
+                            self.db.checkout_visitor(visitor['visitor_id'], visitor['entry_time'])
                             st.success("Visitor marked as exited!")
                             st.rerun()
                         # Delete visitor
                         if st.button("🗑️ Delete Visitor", key=f"delete_{unique_key}", type="secondary"):
                             try:
-                                self.db.delete_visitor(visitor['visitor_id'])
+                                self.db.delete_visitor(visitor['visitor_id'], visitor['entry_time'])
                                 st.success("Visitor record deleted")
                                 st.rerun()
                             except Exception as e:
@@ -1153,68 +1679,33 @@ class AdminDashboard:
         """View visitor history"""
         st.subheader("📜 Visitor History")
         
+        search = st.text_input("Search name, phone or vehicle", placeholder="e.g. ramesh, 98220, MH12 AB",
+                               key="visitor_history_search")
+        
         # Filter options
         col1, col2, col3 = st.columns(3)
         with col1:
             flat_filter = st.selectbox("Filter by Flat", ["All Flats"] + get_allotted_flat_numbers(), key="visitor_history_flat_filter")
         with col2:
-            date_filter = st.date_input("Filter by Date", value=None, key="visitor_history_date_filter")
+            # the last 90 days by default, so only those months' partitions are searched
+            date_filter = st.date_input("Filter by Date", value=(date.today() - timedelta(days=90), date.today()),
+                                        key="visitor_history_date_filter",
+                                        help="Pick one day, or a start and end date; clear it to search all history")
         with col3:
             status_filter = st.selectbox("Filter by Status", ["All", "in", "out"], key="visitor_history_status_filter")
         
-        cursor = self.db.connection.cursor()
-        
-        query = "SELECT * FROM visitors WHERE 1=1"
-        params = []
-        
-        # Handle flat filter
-        if flat_filter and flat_filter.strip() and flat_filter != "All Flats":
-            query += " AND flat_number = %s"
-            params.append(flat_filter.strip())
-        
-        # Handle status filter
-        if status_filter and status_filter != "All":
-            query += " AND status = %s"
-            params.append(status_filter)
+        # one date picked so far means that single day
+        dates = list(date_filter) if isinstance(date_filter, (list, tuple)) else [date_filter] if date_filter else []
         
-        # Handle date filter - more robust version
         try:
-            if (date_filter is not None and 
-                hasattr(date_filter, 'strftime') and  # Check if it's a date-like object
-                not pd.isnull(date_filter)):  # Check if it's not a pandas null
-                
-                query += " AND DATE(entry_time) = %s"
-                params.append(date_filter)
-        except (AttributeError, TypeError):
-            # If date_filter is not a proper date object, skip the filter
-            pass
-        
-        query += " ORDER BY entry_time DESC LIMIT 100"
-        
-        try:
-            cursor.execute(query, params)
-            visitors_data = cursor.fetchall()
-            
-            # Convert to dictionary format
-            visitors = []
-            for v in visitors_data:
-                # Get flat owner name
-                cursor.execute("SELECT name FROM users WHERE flat_number = %s AND role IN ('owner', 'tenant') LIMIT 1", (v[1],))
-                owner_name_result = cursor.fetchone()
-                visitors.append({
-                    'visitor_id': v[0],
-                    'flat_number': v[1],
-                    'visitor_name': v[2],
-                    'visitor_phone': v[3] if len(v) > 3 else None,
-                    'purpose': v[4] if len(v) > 4 else None,
-                    'entry_time': v[5] if len(v) > 5 else None,
-                    'exit_time': v[6] if len(v) > 6 else None,
-                    'vehicle_number': v[7] if len(v) > 7 else None,
-                    'logged_by': v[8] if len(v) > 8 else None,
-                    'status': v[9] if len(v) > 9 else 'in',
-                    'visitor_photo': v[10] if len(v) > 10 else None,
-                    'flat_owner_name': owner_name_result[0] if owner_name_result else None
-                })
+            visitors = self.db.search_visitors(
+                search,
+                flat_number=flat_filter if flat_filter != "All Flats" else None,
+                status=status_filter if status_filter != "All" else None,
+                start=dates[0] if dates else None,
+                end=dates[-1] if dates else None,
+                limit=100
+            )
             
             if visitors and len(visitors) > 0:
                 st.write(f"Found {len(visitors)} visitor records")
@@ -1244,6 +1735,9 @@ class AdminDashboard:
                             st.write(f"**⏰ Entry Time:** {format_datetime(visitor['entry_time'])}")
                             if visitor['exit_time']:
                                 st.write(f"**🚪 Exit Time:** {format_datetime(visitor['exit_time'])}")
+                            elif visitor['auto_checked_out_at']:
+                                st.write(f"**🚪 Exit Time:** not recorded (auto-checked out "
+                                         f"{format_datetime(visitor['auto_checked_out_at'])})")
                             st.write(f"**📊 Status:** {visitor['status'].title()}")
                         
                         with col2:
@@ -1270,20 +1764,14 @@ class AdminDashboard:
                             unique_key = f"history_{idx}_{visitor['visitor_id']}_{hash(str(visitor['entry_time']))}"
                             if visitor['status'] == 'in':
                                 if st.button("Mark Exit", key=f"exit_{unique_key}"):
-                                    cursor = self.db.connection.cursor()
-                                    cursor.execute("""
-                                        UPDATE visitors 
-                                        SET status = 'out', exit_time = CURRENT_TIMESTAMP
-                                        WHERE visitor_id = %s
-                                    """, (visitor['visitor_id'],))
-                                    cursor.close()
+                                    self.db.checkout_visitor(visitor['visitor_id'], visitor['entry_time'])
                                     st.success("Visitor marked as exited!")
                                     st.rerun()
                             
                             # Delete visitor record
                             if st.button("🗑️ Delete Record", key=f"delete_{unique_key}", type="secondary"):
                                 try:
-                                    self.db.delete_visitor(visitor['visitor_id'])
+                                    self.db.delete_visitor(visitor['visitor_id'], visitor['entry_time'])
                                     st.success("Visitor record deleted")
                                     st.rerun()
                                 except Exception as e:
@@ -1293,12 +1781,62 @@ class AdminDashboard:
         
         except Exception as e:
             st.error(f"Error fetching visitor history: {e}")
-        
-        finally:
-            cursor.close()
     
 
     
+    def visitor_analytics(self):
+        """Gate traffic by weekday and hour, dwell times and the busiest flats"""
+        import visitor_analytics
+        
+        st.subheader("📈 Visitor Analytics")
+        col1, col2 = st.columns(2)
+        with col1:
+            span = st.selectbox("Range", ["Last 90 days", "Last 12 months", "All history"], key="visitor_analytics_span")
+        since = {"Last 90 days": date.today() - timedelta(days=90),
+                 "Last 12 months": date.today() - timedelta(days=365)}.get(span)
+        blocks = visitor_analytics.block_summary(self.db, since)
+        with col2:
+            block = st.selectbox("Block", ["All"] + [b['block'] for b in blocks], key="visitor_analytics_block")
+        if not blocks:
+            st.info("No visitors in this range")
+            return
+        
+        shown = blocks if block == "All" else [b for b in blocks if b['block'] == block]
+        visits = sum(b['visits'] for b in shown)
+        checkouts = sum(b['checkouts'] for b in shown)
+        dwell_minutes = sum((b['avg_dwell_minutes'] or 0) * b['checkouts'] for b in shown)
+        cells = visitor_analytics.traffic_heatmap(self.db, since, None if block == "All" else block)
+        peak = max(cells.items(), key=lambda c: c[1]['visits'])[0] if cells else None
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Visits", f"{visits:,}")
+        with col2:
+            st.metric("Average Stay", f"{dwell_minutes / checkouts:.0f} min" if checkouts else "N/A")
+        with col3:
+            st.metric("Busiest Hour", f"{visitor_analytics.WEEKDAYS[peak[0]]} {peak[1]:02d}:00" if peak else "N/A")
+        
+        grid = [[cells.get((day, hour), {}).get('visits', 0) for hour in range(24)] for day in range(7)]
+        fig = px.imshow(grid, x=[f"{h:02d}" for h in range(24)], y=visitor_analytics.WEEKDAYS,
+                        labels={'x': "Hour", 'y': "Day", 'color': "Visits"}, aspect="auto",
+                        color_continuous_scale="Blues", title="Visits by Weekday and Hour")
+        st.plotly_chart(fig, use_container_width=True)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**By Block**")
+            st.dataframe(pd.DataFrame([{
+                'Block': b['block'], 'Visits': b['visits'], 'Visits/Day': round(b['visits'] / b['active_days'], 1),
+                'Avg Stay (min)': round(b['avg_dwell_minutes']) if b['avg_dwell_minutes'] is not None else None
+            } for b in blocks]), use_container_width=True, hide_index=True)
+        with col2:
+            st.markdown("**Most Visited Flats**")
+            flats = visitor_analytics.flat_frequency(self.db, since)
+            st.dataframe(pd.DataFrame([{
+                'Flat': f['flat_number'], 'Visits': f['visits'], 'Visits/Month': round(f['visits_per_month'], 1),
+                'Avg Stay (min)': round(f['avg_dwell_minutes']) if f['avg_dwell_minutes'] is not None else None
+            } for f in flats]), use_container_width=True, hide_index=True)
+    
     def notification_management(self):
         """Notification management interface"""
         st.title("📢 Notification Management")
@@ -1318,24 +1856,29 @@ class AdminDashboard:
             title = st.text_input("Notification Title", key="notification_title_input")
             message = st.text_area("Message", height=150, key="notification_message_input")
             priority = st.selectbox("Priority", ["low", "normal", "high"], key="notification_priority_select")
+            col1, col2 = st.columns(2)
+            with col1:
+                audience = st.selectbox("Send To", ["all", "role", "block", "flat"], key="notification_audience_select",
+                                        format_func=lambda a: {"all": "Everyone", "role": "One role", "block": "One block",
+                                                               "flat": "One flat"}[a])
+            with col2:
+                audience_value = st.text_input("Role, block letter or flat number", key="notification_audience_value",
+                                               help="owner, tenant or admin for a role").strip()
             
             submit = st.form_submit_button("Send Notification", key="send_notification_submit")
             
             if submit:
                 if title and message:
                     try:
-                        cursor = self.db.connection.cursor()
-                        cursor.execute("""
-                                                        INSERT INTO notifications (title, message, created_by, priority)
-                            VALUES (%s, %s, %s, %s)
-                            RETURNING notification_id
-                        """, (title, message, st.session_state.user['user_id'], priority))
-                        
-                        notification_id = cursor.fetchone()[0]
-                        cursor.close()
+                        # roles are stored lower case, blocks and flats upper case
+                        audience_value = audience_value.lower() if audience == 'role' else audience_value.upper()
+                        notification_id, recipients = self.db.create_notification(
+                            title, message, st.session_state.user['user_id'], priority, audience, audience_value)
                         
-                        st.success(f"Notification sent successfully! Notification ID: {notification_id}")
+                        st.success(f"Notification sent to {recipients} users! Notification ID: {notification_id}")
                         
+                    except ValueError as e:
+                        st.error(str(e))
                     except Exception as e:
                         st.error(f"Error sending notification: {e}")
                 else:
@@ -1346,27 +1889,30 @@ class AdminDashboard:
         st.subheader("📜 Notification History")
         
         cursor = self.db.connection.cursor()
-        cursor.execute("SELECT * FROM notifications ORDER BY created_at DESC")
+        # read counts come from the same query
+        cursor.execute("""
+            SELECT n.notification_id, n.title, n.message, n.created_by, n.created_at, n.type, n.priority,
+                   (SELECT COUNT(*) FROM notification_reads r WHERE r.notification_id = n.notification_id),
+                   n.audience, n.audience_value
+            FROM notifications n
+            ORDER BY n.created_at DESC
+        """)
         notifications_data = cursor.fetchall()
         
         # Convert to list
         notifications = []
         for n in notifications_data:
-            # get read count from notification_reads table
-            cursor.execute("SELECT COUNT(*) FROM notification_reads WHERE notification_id = %s", (n[0],))
-            read_count_result = cursor.fetchone()
-            read_count = read_count_result[0] if read_count_result else 0
-            
             notifications.append({
                 'notification_id': n[0],
                 'title': n[1],
                 'message': n[2],
                 'created_by': n[3],
                 'created_at': n[4],
-                'type': n[5] if len(n) > 5 else 'general',
-                'priority': n[6] if len(n) > 6 else 'normal',
+                'type': n[5] or 'general',
+                'priority': n[6] or 'normal',
                 'created_by_name': 'Admin',
-                'read_count': read_count
+                'read_count': n[7],
+                'audience': 'Everyone' if n[8] == 'all' else f"{n[8].title()} {n[9]}"
             })
         
         if notifications and len(notifications) > 0:
@@ -1374,6 +1920,7 @@ class AdminDashboard:
                 with st.expander(f"{notification['title']} - {format_datetime(notification['created_at'])}"):
                     st.write(f"**Message:** {notification['message']}")
                     st.write(f"**Priority:** {notification['priority'].title()}")
+                    st.write(f"**Sent to:** {notification['audience']}")
                     st.write(f"**Created by:** {notification['created_by_name']}")
                     st.write(f"**Read by:** {notification['read_count']} users")
                     col1, col2 = st.columns([3,1])
@@ -1459,7 +2006,13 @@ class AdminDashboard:
         st.subheader("🗳️ Active Polls")
         
         cursor = self.db.connection.cursor()
-        cursor.execute("SELECT * FROM polls WHERE is_active = TRUE ORDER BY created_at DESC")
+        cursor.execute("""
+            SELECT p.poll_id, p.title, p.description, p.created_by, p.created_at, p.end_date, p.is_active,
+                   (SELECT COUNT(*) FROM votes v WHERE v.poll_id = p.poll_id)
+            FROM polls p
+            WHERE p.is_active = TRUE
+            ORDER BY p.created_at DESC
+        """)
         polls_data = cursor.fetchall()
         
         # Convert to list
@@ -1472,9 +2025,10 @@ class AdminDashboard:
                 'created_by': p[3],
                 'created_at': p[4],
                 'end_date': p[5],
-                'is_active': p[6] if len(p) > 6 else True,
+                'is_active': p[6],
                 'status': 'active',
-                'created_by_name': 'Admin'
+                'created_by_name': 'Admin',
+                'vote_count': p[7]
             })
         
         if polls and len(polls) > 0:
@@ -1502,9 +2056,7 @@ class AdminDashboard:
                                 st.error(f"Error deleting poll: {e}")
                     
                     with col2:
-                        cursor.execute("SELECT COUNT(*) FROM votes WHERE poll_id = %s", (poll['poll_id'],))
-                        vote_count = cursor.fetchone()[0]
-                        st.write(f"**Total Votes:** {vote_count}")
+                        st.write(f"**Total Votes:** {poll['vote_count']}")
         else:
             st.info("No active polls")
         
@@ -1515,7 +2067,7 @@ class AdminDashboard:
         st.subheader("📊 Poll Results")
         
         cursor = self.db.connection.cursor()
-        cursor.execute("SELECT * FROM polls ORDER BY created_at DESC")
+        cursor.execute("SELECT poll_id, title, description, created_by, created_at, end_date, is_active FROM polls ORDER BY created_at DESC")
         polls_data = cursor.fetchall()
         
         # Convert to list
@@ -1528,10 +2080,13 @@ class AdminDashboard:
                 'created_by': p[3],
                 'created_at': p[4],
                 'end_date': p[5],
-                'is_active': p[6] if len(p) > 6 else True,
-                'status': 'active' if (p[6] if len(p) > 6 else True) else 'closed'
+                'is_active': p[6],
+                'status': 'active' if p[6] else 'closed'
             })
         
+        # Options of all polls in one query
+        options_by_poll = self.db.get_poll_options([poll['poll_id'] for poll in polls])
+        
         # FIXED: Check length instead of truthiness
         if polls and len(polls) > 0:
             for poll in polls:
@@ -1539,14 +2094,8 @@ class AdminDashboard:
                 st.write(f"**Status:** {poll['status'].title()}")
                 st.write(f"**End Date:** {format_date(poll['end_date'])}")
                 
-                cursor.execute("""
-                    SELECT option_text, vote_count 
-                    FROM poll_options 
-                    WHERE poll_id = %s
-                    ORDER BY vote_count DESC
-                """, (poll['poll_id'],))
-                
-                results = cursor.fetchall()
+                results = sorted(((o['option_text'], o['vote_count']) for o in options_by_poll.get(poll['poll_id'], [])),
+                             key=lambda r: r[1], reverse=True)
                 
                 if results and len(results) > 0:
                     total_votes = sum(r[1] for r in results)
@@ -1575,4 +2124,118 @@ class AdminDashboard:
         else:
             st.info("No polls found")
         
-        cursor.close()
\ No newline at end of file
+        cursor.close()
+
+    def background_jobs(self):
+        """Status of the background job queue (worker.py)"""
+        st.title("⚙️ Background Jobs")
+        
+        overview = self.db.get_job_overview()
+        by_type = overview['by_type']
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Queued", sum(t['queued'] for t in by_type))
+        with col2:
+            st.metric("Running", sum(t['running'] for t in by_type))
+        with col3:
+            st.metric("Done (7 days)", sum(t['done'] for t in by_type))
+        with col4:
+            st.metric("Failed", sum(t['failed'] for t in by_type))
+        
+        if by_type:
+            oldest = min((t['oldest_queued'] for t in by_type if t['oldest_queued']), default=None)
+            if oldest and datetime.now() - oldest > timedelta(minutes=5):
+                st.warning(f"⚠️ Jobs have been waiting since {format_datetime(oldest)}. Is `python worker.py` running?")
+            st.dataframe(pd.DataFrame([{
+                'Job Type': t['job_type'], 'Queued': t['queued'], 'Running': t['running'], 'Done': t['done'],
+                'Failed': t['failed'], 'Oldest Queued': format_datetime(t['oldest_queued']),
+                'Last Done': format_datetime(t['last_done'])
+            } for t in by_type]), use_container_width=True, hide_index=True)
+        else:
+            st.info("No jobs yet")
+        
+        if st.button("▶️ Run overdue sweep now", key="enqueue_overdue_sweep"):
+            if self.db.enqueue_job('overdue_sweep', dedupe_key='overdue_sweep'):
+                st.success("Overdue sweep queued")
+            else:
+                st.info("An overdue sweep is already queued")
+        
+        st.subheader("🕒 Schedules")
+        if overview['schedules']:
+            st.dataframe(pd.DataFrame([{
+                'Name': s['name'], 'Job Type': s['job_type'], 'Every (hours)': s['interval_seconds'] / 3600,
+                'Next Run': format_datetime(s['next_run_at']), 'Last Enqueued': format_datetime(s['last_enqueued_at']),
+                'Enabled': s['enabled']
+            } for s in overview['schedules']]), use_container_width=True, hide_index=True)
+        else:
+            st.info("Schedules are created when the worker starts")
+        
+        st.subheader("❌ Failed Jobs")
+        failed = self.db.get_recent_jobs(status='failed', limit=20)
+        if failed:
+            for job in failed:
+                with st.expander(f"#{job['job_id']} {job['job_type']} - {job['attempts']} attempts, {format_datetime(job['finished_at'])}"):
+                    st.json(job['payload'])
+                    st.code(job['last_error'] or "")
+                    if st.button("🔁 Retry", key=f"retry_job_{job['job_id']}"):
+                        if self.db.retry_job(job['job_id']):
+                            st.success("Job queued again")
+                            st.rerun()
+                        else:
+                            st.warning("Not requeued: the same job is already queued or running, or this one was retried already")
+        else:
+            st.success("No failed jobs")
+    
+    def data_exports(self):
+        """Download bills, payments, visitors or complaints as CSV or Parquet"""
+        import exports
+        import tempfile
+        
+        st.title("📤 Exports")
+        statuses = {
+            'bills': ["pending", "paid", "overdue"],
+            'payments': [],
+            'visitors': ["in", "out"],
+            'complaints': ["open", "in_progress", "resolved", "closed"],
+        }
+        
+        # outside the form, so the status choices follow the selected data
+        kind = st.selectbox("Data", list(exports.EXPORTS.keys()), key="export_kind")
+        with st.form("export_form"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                fmt = st.radio("Format", list(exports.FORMATS), horizontal=True, key="export_format")
+            with col2:
+                start = st.date_input("From", value=date.today() - timedelta(days=90), key="export_from")
+                end = st.date_input("To", value=date.today(), key="export_to")
+            with col3:
+                flat_number = st.text_input("Flat (optional)", key="export_flat")
+                status = st.selectbox("Status", ["all"] + statuses[kind], key="export_status")
+            
+            if st.form_submit_button("Prepare Export"):
+                # streamed to a temporary file, so the rows never sit in memory together
+                previous = st.session_state.get('export_file')
+                if previous and os.path.exists(previous['path']):
+                    os.remove(previous['path'])
+                handle, path = tempfile.mkstemp(suffix=f".{fmt}")
+                os.close(handle)
+                try:
+                    count = exports.export(self.db, kind, path, fmt, start=start, end=end,
+                                           flat_number=flat_number.strip().upper() or None,
+                                           status=None if status == "all" else status)
+                    st.session_state.export_file = {'path': path, 'count': count, 'fmt': fmt,
+                                                    'name': f"{kind}_{start:%Y%m%d}_{end:%Y%m%d}.{fmt}"}
+                except Exception as e:
+                    os.remove(path)
+                    st.session_state.export_file = None
+                    st.error(f"❌ Export failed: {e}")
+        
+        prepared = st.session_state.get('export_file')
+        if prepared and os.path.exists(prepared['path']):
+            st.success(f"✅ {prepared['count']} rows ready ({os.path.getsize(prepared['path']) / 1e6:.1f} MB)")
+            with open(prepared['path'], 'rb') as f:
+                st.download_button(f"⬇️ Download {prepared['name']}", f, file_name=prepared['name'],
+                                   mime="text/csv" if prepared['fmt'] == 'csv' else "application/octet-stream",
+                                   key="export_download")
+        st.caption("For scheduled dumps use `python exports.py <data> --from YYYY-MM-DD --to YYYY-MM-DD -o file.csv`.")
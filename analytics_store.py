@@ -0,0 +1,183 @@
+"""Local columnar copy of bills, payments, complaints and visitors for admin analytics.
+
+Aggregations over years of bills would otherwise scan the PostgreSQL tables
+that residents are writing to. sync() copies the rows changed since the last
+run into a DuckDB file instead, and the admin reports read from that file.
+"Changed" means updated_at (or created_at for the append-only payments) past
+the table's watermark. updated_at is kept by a trigger, see
+Database.create_tables. The worker runs the sync every 15 minutes:
+
+    python analytics_store.py            # incremental
+    python analytics_store.py --full     # recopy everything (also drops rows deleted upstream)
+
+The file is ANALYTICS_DB (default analytics.duckdb). DuckDB allows one
+writer per file, so a report opened during a sync raises StoreUnavailable.
+Callers then fall back to their live query.
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+
+import duckdb
+
+import exports
+
+FETCH_SIZE = 20000
+# transactions that started before the last sync can commit rows with an older updated_at
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+# table -> (key, watermark column, columns); a subset of the source columns, no free text or phone numbers
+TABLES = {
+    'bills': ('bill_id', 'updated_at', ['bill_id', 'flat_number', 'bill_type', 'amount', 'amount_paid', 'due_date',
+                                        'payment_status', 'billing_period', 'payment_method', 'created_at', 'paid_at',
+                                        'updated_at']),
+    'payments': ('payment_id', 'created_at', ['payment_id', 'bill_id', 'flat_number', 'amount', 'payment_method',
+                                              'created_at']),
+    'complaints': ('complaint_id', 'updated_at', ['complaint_id', 'flat_number', 'category', 'priority', 'status',
+                                                  'created_at', 'resolved_at', 'updated_at']),
+    'visitors': ('visitor_id', 'updated_at', ['visitor_id', 'flat_number', 'purpose', 'entry_time', 'exit_time',
+                                              'status', 'updated_at']),
+}
+DUCKDB_TYPES = {'int64': 'BIGINT', 'decimal128(10, 2)': 'DECIMAL(10,2)', 'date32[day]': 'DATE',
+                'timestamp[us]': 'TIMESTAMP', 'string': 'VARCHAR'}
+
+
+class StoreUnavailable(Exception):
+    pass
+
+
+def store_path():
+    return os.getenv('ANALYTICS_DB', 'analytics.duckdb')
+
+
+def create_tables(con):
+    for table, (key, _, columns) in TABLES.items():
+        definitions = ", ".join(f"{c} {DUCKDB_TYPES[str(exports.arrow_type(c))]}" for c in columns)
+        con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definitions}, PRIMARY KEY ({key}))")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS etl_state (
+            table_name VARCHAR PRIMARY KEY,
+            watermark TIMESTAMP,
+            row_count BIGINT,
+            synced_at TIMESTAMP
+        )
+    """)
+
+
+def sync_table(db, con, table, full=False, fetch_size=FETCH_SIZE):
+    """Upserts one table's changed rows in one DuckDB transaction; returns the rows copied"""
+    import pyarrow as pa
+
+    _, watermark_column, columns = TABLES[table]
+    row = con.execute("SELECT watermark FROM etl_state WHERE table_name = ?", [table]).fetchone()
+    watermark = None if full or row is None else row[0]
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    params = []
+    if watermark is not None:
+        query += f" WHERE {watermark_column} > %s"
+        params.append(watermark - WATERMARK_OVERLAP)
+
+    schema = pa.schema([(c, exports.arrow_type(c)) for c in columns])
+    stamp = columns.index(watermark_column)
+    copied = 0
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if full:
+            con.execute(f"DELETE FROM {table}")
+        for rows in exports.stream(db, query, params, fetch_size, name=f"analytics_{table}"):
+            batch = pa.Table.from_arrays(
+                [pa.array([r[i] for r in rows], type=f.type) for i, f in enumerate(schema)], schema=schema)
+            con.register('batch', batch)
+            con.execute(f"INSERT OR REPLACE INTO {table} SELECT * FROM batch")
+            con.unregister('batch')
+            newest = max((r[stamp] for r in rows if r[stamp] is not None), default=None)
+            if newest is not None and (watermark is None or newest > watermark):
+                watermark = newest
+            copied += len(rows)
+        con.execute(f"""
+            INSERT OR REPLACE INTO etl_state
+            SELECT ?, ?, (SELECT COUNT(*) FROM {table}), CURRENT_TIMESTAMP
+        """, [table, watermark])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return copied
+
+
+def sync(db, full=False, path=None):
+    """Brings every table up to date; returns {table: rows copied}"""
+    con = duckdb.connect(path or store_path())
+    try:
+        create_tables(con)
+        return {table: sync_table(db, con, table, full) for table in TABLES}
+    finally:
+        con.close()
+
+
+def query(sql, params=None, path=None):
+    """Runs a read-only query against the store; raises StoreUnavailable if it is missing or being written"""
+    path = path or store_path()
+    if not os.path.exists(path):
+        raise StoreUnavailable(f"{path} does not exist yet; run python analytics_store.py")
+    try:
+        con = duckdb.connect(path, read_only=True)
+    except duckdb.Error as e:
+        raise StoreUnavailable(str(e))
+    try:
+        return con.execute(sql, params or []).fetchall()
+    except duckdb.CatalogException as e:
+        raise StoreUnavailable(str(e))
+    finally:
+        con.close()
+
+
+def last_synced(path=None):
+    return query("SELECT MIN(synced_at) FROM etl_state", path=path)[0][0]
+
+
+def billing_summary(path=None):
+    rows = query("""
+        SELECT payment_status, COUNT(*), SUM(amount), SUM(amount_paid)
+        FROM bills GROUP BY payment_status ORDER BY payment_status
+    """, path=path)
+    counts = {r[0]: r[1] for r in rows}
+    return {
+        'total_bills': sum(counts.values()),
+        'paid_bills': counts.get('paid', 0),
+        'pending_bills': counts.get('pending', 0),
+        'overdue_bills': counts.get('overdue', 0),
+        'total_amount': sum(r[2] or 0 for r in rows),
+        'collected_amount': sum(r[3] or 0 for r in rows),
+        'bill_stats': [{'payment_status': r[0], 'count': r[1]} for r in rows],
+    }
+
+
+def complaint_summary(path=None):
+    by_status = query("SELECT status, COUNT(*) FROM complaints GROUP BY status ORDER BY status", path=path)
+    by_priority = query("SELECT priority, COUNT(*) FROM complaints GROUP BY priority ORDER BY priority", path=path)
+    return {
+        'complaint_stats': [{'status': r[0], 'count': r[1]} for r in by_status],
+        'priority_stats': [{'priority': r[0], 'count': r[1]} for r in by_priority],
+    }
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Copy changed rows into the DuckDB analytics store")
+    parser.add_argument("--full", action="store_true", help="recopy every table from scratch")
+    parser.add_argument("--path", help="store file (default $ANALYTICS_DB or analytics.duckdb)")
+    args = parser.parse_args(argv)
+
+    db = Database()
+    started = time.perf_counter()
+    copied = sync(db, args.full, args.path)
+    print(", ".join(f"{count} {table}" for table, count in copied.items())
+          + f" copied in {time.perf_counter() - started:.2f}s")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""Headless JSON API over the Database layer for gate kiosks and mobile clients.
+
+A small ASGI app (no web framework) so a client action costs one HTTP round
+trip and a couple of queries instead of a full Streamlit script rerun:
+
+    uvicorn api:app --port 8000 --workers 2
+
+Authentication: POST /api/login with {"username", "password"} returns a
+bearer token; send it as "Authorization: Bearer <token>". GET responses carry
+an ETag and answer 304 when If-None-Match matches.
+
+    POST /api/login
+    GET  /api/bills                      (admin: ?flat_number=A101)
+    POST /api/bills/<id>/pay             {"payment_method"}
+    POST /api/complaints                 {"title", "description", "category", "priority"}
+    GET  /api/notifications/unread-count
+    POST /api/polls/<id>/vote            {"option_id"}
+    POST /api/visitors                   {"flat_number", "visitor_name", ...}      (admin)
+    POST /api/visitors/<id>/checkout                                               (admin)
+    POST /api/payments/webhook           {"events": [...]}   (gateway, X-Gateway-Signature)
+
+Payments take an optional "amount" (partial payment) and an Idempotency-Key
+header (or "idempotency_key" field); retrying with the same key returns the
+first payment instead of paying twice.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from urllib.parse import parse_qs
+
+from psycopg2.pool import ThreadedConnectionPool
+
+import payments
+from database import Database
+
+POOL_MIN = int(os.getenv('API_POOL_MIN', '2'))
+POOL_MAX = int(os.getenv('API_POOL_MAX', '10'))
+MAX_BODY_BYTES = 10 * 1024 * 1024  # visitor photos arrive base64 encoded
+
+COMPLAINT_PRIORITIES = ('low', 'medium', 'high', 'urgent')
+SIGNED = 'signed'  # route roles value: authenticated by the gateway signature instead of a token
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class ConnectionPool:
+    """psycopg2 pool plus a semaphore so waiting requests queue instead of failing"""
+
+    def __init__(self, dsn, minconn, maxconn):
+        self.pool = ThreadedConnectionPool(minconn, maxconn, dsn)
+        self.slots = asyncio.Semaphore(maxconn)
+
+    @contextmanager
+    def database(self):
+        connection = self.pool.getconn()
+        connection.autocommit = True
+        try:
+            yield Database(connection)
+        finally:
+            self.pool.putconn(connection)
+
+    async def run(self, fn, *args):
+        """Runs fn(db, *args) on a worker thread with a pooled connection"""
+        def call():
+            with self.database() as db:
+                return fn(db, *args)
+
+        async with self.slots:
+            return await asyncio.to_thread(call)
+
+    def close(self):
+        self.pool.closeall()
+
+
+# --- handlers: plain functions run on a worker thread; (db, user, params, body) -> JSON-able result
+
+def login(db, user, params, body):
+    account = db.authenticate_user(body.get('username', ''), body.get('password', ''))
+    if not account:
+        raise ApiError(401, "Invalid username or password")
+    token = db.create_api_token(account['user_id'])
+    return {'token': token, 'user': {k: account[k] for k in ('user_id', 'username', 'role', 'flat_number', 'name')}}
+
+
+def list_bills(db, user, params, body):
+    flat_number = user['flat_number']
+    if user['role'] == 'admin':
+        flat_number = params.get('flat_number') or flat_number
+    return {'flat_number': flat_number, 'bills': db.get_user_bills(flat_number)}
+
+
+def pay_bill(db, user, params, body):
+    bill = db.get_bill(int(params['bill_id']))
+    if not bill or (user['role'] != 'admin' and bill['flat_number'] != user['flat_number']):
+        raise ApiError(404, "Bill not found")
+    amount = body.get('amount')
+    if amount is not None and float(amount) <= 0:
+        raise ApiError(400, "amount must be positive")
+    key = body.get('idempotency_key') or params.get('idempotency_key')
+    payment = db.pay_bill(bill['bill_id'], body.get('payment_method') or 'Online', amount,
+                          f"api:{user['user_id']}:{key}" if key else None, user['user_id'])
+    if payment is None:
+        raise ApiError(409, "Bill is already paid")
+    return {'payment': payment, 'bill': db.get_bill(bill['bill_id'])}
+
+
+def raise_complaint(db, user, params, body):
+    missing = [f for f in ('title', 'description', 'category') if not body.get(f)]
+    if missing:
+        raise ApiError(400, f"Missing fields: {', '.join(missing)}")
+    priority = body.get('priority', 'medium')
+    if priority not in COMPLAINT_PRIORITIES:
+        raise ApiError(400, f"priority must be one of {', '.join(COMPLAINT_PRIORITIES)}")
+    complaint_id = db.create_complaint(user['user_id'], user['flat_number'], body['title'], body['description'],
+                                       body['category'], priority)
+    return {'complaint_id': complaint_id}
+
+
+def unread_count(db, user, params, body):
+    return {'unread': db.get_unread_notification_count(user['user_id'])}
+
+
+def vote(db, user, params, body):
+    if 'option_id' not in body:
+        raise ApiError(400, "Missing fields: option_id")
+    if not db.cast_vote(int(params['poll_id']), int(body['option_id']), user['user_id']):
+        raise ApiError(409, "Already voted or option does not belong to this poll")
+    return {'voted': True}
+
+
+def log_visitor(db, user, params, body):
+    missing = [f for f in ('flat_number', 'visitor_name') if not body.get(f)]
+    if missing:
+        raise ApiError(400, f"Missing fields: {', '.join(missing)}")
+    visitor_id = db.log_visitor_with_photo(body['flat_number'], body['visitor_name'], body.get('visitor_phone'),
+                                           body.get('purpose'), body.get('vehicle_number'), user['user_id'],
+                                           body.get('visitor_photo'))
+    return {'visitor_id': visitor_id}
+
+
+def checkout_visitor(db, user, params, body):
+    # the visit's entry_time, when the client has it, narrows the update to that month's partition
+    exit_time = db.checkout_visitor(int(params['visitor_id']), body.get('entry_time'))
+    if exit_time is None:
+        raise ApiError(409, "Visitor not found or already checked out")
+    return {'visitor_id': int(params['visitor_id']), 'exit_time': exit_time}
+
+
+def payment_webhook(db, user, params, body):
+    events = body.get('events', [body])
+    if not isinstance(events, list):
+        raise ApiError(400, "events must be a list")
+    accepted, duplicates = payments.store_events(db, events)
+    if accepted:
+        db.enqueue_job('payment_events', dedupe_key='payment_events')
+    return {'accepted': accepted, 'duplicates': duplicates}
+
+
+# (method, path pattern, handler, roles allowed; None = no token needed)
+ROUTES = [
+    ("POST", r"/api/login", login, None),
+    ("GET", r"/api/bills", list_bills, ('admin', 'owner', 'tenant')),
+    ("POST", r"/api/bills/(?P<bill_id>\d+)/pay", pay_bill, ('admin', 'owner', 'tenant')),
+    ("POST", r"/api/complaints", raise_complaint, ('owner', 'tenant')),
+    ("GET", r"/api/notifications/unread-count", unread_count, ('admin', 'owner', 'tenant')),
+    ("POST", r"/api/polls/(?P<poll_id>\d+)/vote", vote, ('owner', 'tenant')),
+    ("POST", r"/api/visitors", log_visitor, ('admin',)),
+    ("POST", r"/api/visitors/(?P<visitor_id>\d+)/checkout", checkout_visitor, ('admin',)),
+    ("POST", r"/api/payments/webhook", payment_webhook, SIGNED),
+]
+ROUTES = [(method, re.compile(pattern + "$"), handler, roles) for method, pattern, handler, roles in ROUTES]
+
+
+def dispatch(db, handler, roles, token, params, body):
+    """One worker-thread hop per request: token check and handler share a pooled connection"""
+    user = None
+    if roles is not None and roles != SIGNED:
+        user = db.get_user_by_api_token(token) if token else None
+        if user is None:
+            raise ApiError(401, "Missing or invalid token")
+        if user['role'] not in roles:
+            raise ApiError(403, "Not allowed for this role")
+    return handler(db, user, params, body)
+
+
+class Api:
+    def __init__(self, dsn=None):
+        self.dsn = dsn
+        self.pool = None
+
+    def start(self):
+        if self.pool is None:
+            dsn = self.dsn or os.getenv('DATABASE_URL')
+            # make sure the tables (incl. api_tokens) exist before serving
+            Database().close_connection()
+            self.pool = ConnectionPool(dsn, POOL_MIN, POOL_MAX)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.to_thread(self.start)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.pool:
+                    self.pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        try:
+            if self.pool is None:
+                await asyncio.to_thread(self.start)
+            status, result = 200, await self.handle(scope, headers, receive)
+        except ApiError as e:
+            status, result = e.status, {'error': e.message}
+        except (ValueError, KeyError) as e:
+            status, result = 400, {'error': f"Bad request: {e}"}
+
+        body = json.dumps(result, default=to_json, separators=(',', ':')).encode('utf-8')
+        response_headers = [(b'content-type', b'application/json')]
+        if scope['method'] == 'GET' and status == 200:
+            etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+            response_headers += [(b'etag', etag.encode()), (b'cache-control', b'private, no-cache')]
+            if etag in [t.strip() for t in headers.get('if-none-match', '').split(',')]:
+                status, body = 304, b''
+        response_headers.append((b'content-length', str(len(body)).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def handle(self, scope, headers, receive):
+        path = scope['path'].rstrip('/') or '/'
+        if path == '/api/health':
+            return {'status': 'ok'}
+
+        allowed = False
+        for method, pattern, handler, roles in ROUTES:
+            match = pattern.match(path)
+            if not match:
+                continue
+            allowed = True
+            if method == scope['method']:
+                break
+        else:
+            raise ApiError(405 if allowed else 404, "Method not allowed" if allowed else "Not found")
+
+        params = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        params.update(match.groupdict())
+        body = {}
+        if scope['method'] == 'POST':
+            raw = await read_body(receive)
+            try:
+                body = json.loads(raw) if raw else {}
+            except json.JSONDecodeError:
+                raise ApiError(400, "Body must be JSON")
+            if not isinstance(body, dict):
+                raise ApiError(400, "Body must be a JSON object")
+            if roles == SIGNED:
+                if not payments.webhook_secret():
+                    raise ApiError(503, "Webhooks are disabled until PAYMENT_WEBHOOK_SECRET is set")
+                if not payments.verify_signature(raw, headers.get('x-gateway-signature')):
+                    raise ApiError(401, "Invalid signature")
+        if headers.get('idempotency-key'):
+            params['idempotency_key'] = headers['idempotency-key']
+
+        authorization = headers.get('authorization', '')
+        token = authorization[7:].strip() if authorization.lower().startswith('bearer ') else None
+        return await self.pool.run(dispatch, handler, roles, token, params, body)
+
+
+async def read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise ApiError(413, "Request body too large")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+app = Api()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("api:app", host=os.getenv('API_HOST', '127.0.0.1'), port=int(os.getenv('API_PORT', '8000')))
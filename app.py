@@ -6,7 +6,7 @@ from auth import AuthManager
 from admin_dashboard import AdminDashboard
 from owner_dashboard import OwnerDashboard
 from tenant_dashboard import TenantDashboard
-from utils import create_sidebar_navigation, display_notification_badge
+from utils import create_sidebar_navigation, display_notification_badge, visitor_approval_banner
 
 
 # Page configuration
@@ -72,8 +72,9 @@ def main():
             if not auth_manager.password_change_form():
                 return
         
-        unread = db.get_unread_notifications(user['user_id'])
-        display_notification_badge(len(unread))
+        display_notification_badge(db.get_unread_notification_count(user['user_id']))
+        if user['role'] in ('owner', 'tenant') and user.get('flat_number'):
+            visitor_approval_banner(db, user)
         
         selected = create_sidebar_navigation(user['role'], auth_manager)
         
@@ -119,6 +120,12 @@ def handle_admin_navigation(admin_dashboard, selected, auth_manager):
     elif selected == "🗳️ Polls":
         admin_dashboard.poll_management()
     
+    elif selected == "⚙️ Background Jobs":
+        admin_dashboard.background_jobs()
+    
+    elif selected == "📤 Exports":
+        admin_dashboard.data_exports()
+    
     elif selected == "👤 Profile":
         auth_manager.profile_management()
 
@@ -0,0 +1,177 @@
+"""Reproducible benchmark suite for the Database layer and dashboard loaders.
+
+Run it against a database filled by data_generator.py:
+
+    python benchmark.py                       # writes benchmark_results/<commit>.json
+    python benchmark.py --compare benchmark_results/<older>.json
+
+Each benchmark is timed --repeat times after one warm-up call and the
+min/median/p95/max timings are saved as JSON for comparison across commits.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+from database import Database
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class BenchmarkContext:
+    """Picks deterministic sample rows so every run measures the same work"""
+
+    def __init__(self, db):
+        self.db = db
+        cursor = db.connection.cursor()
+        # the busiest flat is the worst case for per-flat pages
+        cursor.execute("SELECT flat_number FROM bills GROUP BY flat_number ORDER BY COUNT(*) DESC, flat_number LIMIT 1")
+        row = cursor.fetchone()
+        self.flat_number = row[0] if row else None
+        cursor.execute("SELECT user_id FROM users WHERE role = 'owner' ORDER BY user_id LIMIT 1")
+        row = cursor.fetchone()
+        self.owner_user_id = row[0] if row else None
+        cursor.execute("SELECT user_id FROM users WHERE role = 'tenant' ORDER BY user_id LIMIT 1")
+        row = cursor.fetchone()
+        self.tenant_user_id = row[0] if row else None
+        cursor.execute("SELECT flat_number FROM visitors GROUP BY flat_number ORDER BY COUNT(*) DESC, flat_number LIMIT 1")
+        row = cursor.fetchone()
+        self.visitor_flat = row[0] if row else self.flat_number
+        cursor.close()
+
+    def dataset_summary(self):
+        cursor = self.db.connection.cursor()
+        summary = {}
+        for table in ["users", "bills", "visitors", "complaints", "notifications", "notification_reads",
+                      "polls", "votes"]:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            summary[table] = cursor.fetchone()[0]
+        cursor.execute("SHOW server_version")
+        summary['postgres'] = cursor.fetchone()[0]
+        cursor.close()
+        return summary
+
+
+def build_benchmarks(ctx):
+    """(name, callable) pairs; the dashboard modules are imported lazily because they pull in streamlit"""
+    import utils
+    from owner_dashboard import OwnerDashboard
+    from tenant_dashboard import TenantDashboard
+
+    db = ctx.db
+    owner_page = OwnerDashboard(db)
+    tenant_page = TenantDashboard(db)
+
+    return [
+        ("Database.get_society_stats", lambda: db.get_society_stats()),
+        ("Database.get_user_bills", lambda: db.get_user_bills(ctx.flat_number)),
+        ("Database.get_user_complaints", lambda: db.get_user_complaints(ctx.owner_user_id)),
+        ("Database.get_unread_notifications", lambda: db.get_unread_notifications(ctx.owner_user_id)),
+        ("Database.get_visitors_for_flat", lambda: db.get_visitors_for_flat(ctx.visitor_flat, limit=20)),
+        ("Database.get_all_visitors", lambda: db.get_all_visitors(limit=50)),
+        ("Database.get_all_visitors[in]", lambda: db.get_all_visitors(status_filter='in', limit=50)),
+        ("utils.get_available_flat_numbers", utils.get_available_flat_numbers),
+        ("utils.get_allotted_flat_numbers", utils.get_allotted_flat_numbers),
+        ("utils.get_flats_with_occupants", utils.get_flats_with_occupants),
+        ("utils.get_flat_display_options", utils.get_flat_display_options),
+        ("OwnerDashboard.get_recent_bills", lambda: owner_page.get_recent_bills(ctx.flat_number)),
+        ("OwnerDashboard.get_recent_complaints", lambda: owner_page.get_recent_complaints(ctx.owner_user_id)),
+        ("TenantDashboard.get_tenant_info", lambda: tenant_page.get_tenant_info(ctx.tenant_user_id)),
+    ]
+
+
+def run_benchmark(fn, repeat):
+    fn()  # warm-up: connection setup, plan caching, page cache
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return {
+        'runs': repeat,
+        'min_ms': round(min(timings) * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline['meta']['commit']} ({baseline_path}):")
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if not old or 'median_ms' not in old or 'median_ms' not in result:
+            continue
+        ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+        marker = "  slower" if ratio > 1.1 else ("  faster" if ratio < 0.9 else "")
+        print(f"  {name:<42} {old['median_ms']:>10.2f} -> {result['median_ms']:>10.2f} ms  x{ratio:.2f}{marker}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Database methods and dashboard loaders")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="run benchmarks whose name contains this text")
+    parser.add_argument("--output", help="result file (default: benchmark_results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    db = Database()
+    ctx = BenchmarkContext(db)
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'repeat': args.repeat,
+            'dataset': ctx.dataset_summary(),
+        },
+        'results': {},
+    }
+
+    for name, fn in build_benchmarks(ctx):
+        if args.only and args.only not in name:
+            continue
+        try:
+            result = run_benchmark(fn, args.repeat)
+        except Exception as e:
+            result = {'error': str(e)}
+        report['results'][name] = result
+        if 'error' in result:
+            print(f"{name:<42} ERROR {result['error']}")
+        else:
+            print(f"{name:<42} median {result['median_ms']:>10.2f} ms   p95 {result['p95_ms']:>10.2f} ms")
+
+    output = args.output or os.path.join("benchmark_results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Recurring billing: billing plans and a period-keyed monthly bill generator.
+
+A billing plan charges a bill type to every flat, to one block (first letter
+of the flat number) or to a single flat. For each flat and bill type the most
+specific active plan wins, so a flat plan with amount 0 exempts that flat.
+Tenants' rent_amount is billed as 'Rent' for every month their lease covers.
+
+All charges of a period are computed in one INSERT ... SELECT and written in
+one transaction. Bills carry their billing_period and (flat_number, bill_type,
+billing_period) is unique, so re-running a period only adds what is missing
+(e.g. a plan or tenant added later) and never bills twice.
+
+    python billing_engine.py --period 2025-07            # generate July 2025
+    python billing_engine.py --period 2025-07 --preview  # show what would be created
+"""
+import argparse
+import time
+from datetime import date
+
+RENT_BILL_TYPE = "Rent"
+RENT_DUE_DAY = 5
+
+# charges of one period; parameters: period (first day of the month), rent_due_day
+PERIOD_CHARGES = """
+    WITH period AS (
+        SELECT %(period)s::date AS start_date,
+               (%(period)s::date + INTERVAL '1 month' - INTERVAL '1 day')::date AS end_date
+    ),
+    flats AS (
+        SELECT flat_number FROM owners
+        UNION
+        SELECT flat_number FROM tenants
+    ),
+    plan_charges AS (
+        SELECT DISTINCT ON (f.flat_number, p.bill_type)
+               f.flat_number, p.bill_type, p.amount, p.due_day
+        FROM flats f
+        JOIN billing_plans p ON p.is_active AND (
+                p.scope = 'all'
+             OR (p.scope = 'block' AND p.scope_value = LEFT(f.flat_number, 1))
+             OR (p.scope = 'flat' AND p.scope_value = f.flat_number))
+        ORDER BY f.flat_number, p.bill_type,
+                 CASE p.scope WHEN 'flat' THEN 0 WHEN 'block' THEN 1 ELSE 2 END, p.plan_id DESC
+    ),
+    rent_charges AS (
+        SELECT t.flat_number, %(rent_type)s AS bill_type, SUM(t.rent_amount) AS amount,
+               %(rent_due_day)s AS due_day
+        FROM tenants t, period
+        WHERE t.rent_amount > 0
+          AND (t.lease_start_date IS NULL OR t.lease_start_date <= period.end_date)
+          AND (t.lease_end_date IS NULL OR t.lease_end_date >= period.start_date)
+        GROUP BY t.flat_number
+    ),
+    charges AS (
+        SELECT flat_number, bill_type, amount, due_day FROM plan_charges WHERE amount > 0
+        UNION ALL
+        SELECT flat_number, bill_type, amount, due_day FROM rent_charges
+    )
+"""
+
+
+def month_start(value):
+    """'2025-07', '2025-07-15' or a date -> first day of that month"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value if len(value) > 7 else f"{value}-01")
+    return value.replace(day=1)
+
+
+def preview_period(db, period, rent_due_day=RENT_DUE_DAY):
+    """Bills that generate_period would create now, grouped by bill type"""
+    cursor = db.connection.cursor()
+    cursor.execute(PERIOD_CHARGES + """
+        SELECT c.bill_type, COUNT(*), SUM(c.amount)
+        FROM charges c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM bills b
+            WHERE b.flat_number = c.flat_number AND b.bill_type = c.bill_type
+              AND b.billing_period = %(period)s
+        )
+        GROUP BY c.bill_type ORDER BY c.bill_type
+    """, {'period': month_start(period), 'rent_type': RENT_BILL_TYPE, 'rent_due_day': rent_due_day})
+    rows = [{'bill_type': r[0], 'bills': r[1], 'amount': r[2]} for r in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+
+def generate_period(db, period, created_by, rent_due_day=RENT_DUE_DAY):
+    """Creates the missing bills of a period in one transaction; returns per bill type totals"""
+    period = month_start(period)
+    params = {'period': period, 'rent_type': RENT_BILL_TYPE, 'rent_due_day': rent_due_day,
+              'created_by': created_by}
+    with db.transaction():
+        cursor = db.connection.cursor()
+        cursor.execute(PERIOD_CHARGES + """,
+        inserted AS (
+            INSERT INTO bills (flat_number, bill_type, amount, due_date, created_by, billing_period)
+            SELECT flat_number, bill_type, amount, %(period)s::date + (due_day - 1), %(created_by)s, %(period)s
+            FROM charges
+            ON CONFLICT (flat_number, bill_type, billing_period) WHERE billing_period IS NOT NULL DO NOTHING
+            RETURNING bill_type, amount
+        )
+        SELECT bill_type, COUNT(*), COALESCE(SUM(amount), 0) FROM inserted GROUP BY bill_type ORDER BY bill_type
+        """, params)
+        rows = [{'bill_type': r[0], 'bills': r[1], 'amount': r[2]} for r in cursor.fetchall()]
+        if rows:
+            cursor.execute("""
+                INSERT INTO billing_runs (billing_period, bills_created, total_amount, created_by)
+                VALUES (%s, %s, %s, %s)
+            """, (period, sum(r['bills'] for r in rows), sum(r['amount'] for r in rows), created_by))
+        cursor.close()
+    return rows
+
+
+def get_billing_plans(db, include_inactive=False):
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT plan_id, bill_type, amount, scope, scope_value, due_day, description, is_active, created_at
+        FROM billing_plans
+        WHERE is_active OR %s
+        ORDER BY bill_type, scope, scope_value
+    """, (include_inactive,))
+    plans = [{'plan_id': r[0], 'bill_type': r[1], 'amount': r[2], 'scope': r[3], 'scope_value': r[4],
+              'due_day': r[5], 'description': r[6], 'is_active': r[7], 'created_at': r[8]}
+             for r in cursor.fetchall()]
+    cursor.close()
+    return plans
+
+
+def add_billing_plan(db, bill_type, amount, scope, scope_value, due_day, created_by, description=None):
+    if scope == 'all':
+        scope_value = None
+    elif not scope_value:
+        raise ValueError(f"A {scope} plan needs a {scope} value")
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        INSERT INTO billing_plans (bill_type, amount, scope, scope_value, due_day, description, created_by)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING plan_id
+    """, (bill_type, amount, scope, scope_value, due_day, description, created_by))
+    plan_id = cursor.fetchone()[0]
+    cursor.close()
+    return plan_id
+
+
+def set_billing_plan_active(db, plan_id, is_active):
+    cursor = db.connection.cursor()
+    cursor.execute("UPDATE billing_plans SET is_active = %s WHERE plan_id = %s", (is_active, plan_id))
+    cursor.close()
+
+
+def get_billing_runs(db, limit=12):
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT r.billing_period, r.bills_created, r.total_amount, r.run_at, u.name
+        FROM billing_runs r LEFT JOIN users u ON u.user_id = r.created_by
+        ORDER BY r.run_id DESC LIMIT %s
+    """, (limit,))
+    runs = [{'billing_period': r[0], 'bills_created': r[1], 'total_amount': r[2], 'run_at': r[3], 'run_by': r[4]}
+            for r in cursor.fetchall()]
+    cursor.close()
+    return runs
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Generate the recurring bills of a month")
+    parser.add_argument("--period", default=date.today().strftime("%Y-%m"), help="YYYY-MM (default: this month)")
+    parser.add_argument("--created-by", type=int, default=1, help="user_id recorded on the bills")
+    parser.add_argument("--rent-due-day", type=int, default=RENT_DUE_DAY)
+    parser.add_argument("--preview", action="store_true", help="only show what would be created")
+    args = parser.parse_args(argv)
+
+    db = Database()
+    started = time.perf_counter()
+    if args.preview:
+        rows = preview_period(db, args.period, args.rent_due_day)
+    else:
+        rows = generate_period(db, args.period, args.created_by, args.rent_due_day)
+    elapsed = time.perf_counter() - started
+    for row in rows:
+        print(f"  {row['bill_type']:<15} {row['bills']:>8} bills  {float(row['amount']):>14,.2f}")
+    print(f"{'Would create' if args.preview else 'Created'} {sum(r['bills'] for r in rows)} bills "
+          f"for {month_start(args.period):%B %Y} in {elapsed:.2f}s")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
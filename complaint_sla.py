@@ -0,0 +1,147 @@
+"""Complaint SLA report: response and resolution times per category and priority.
+
+The triggers in database.py do the work as complaints change. Each
+transition goes to complaint_events. resolved_at is set when a complaint
+reaches resolved/closed. complaint_sla_buckets counts every complaint's
+time to first response (the first status change or admin response) and
+time to resolution, in buckets of a quarter power of two minutes. The
+report therefore reads a few hundred bucket rows however many complaints
+there are. Percentiles are interpolated within a bucket (about 19% wide).
+
+Breaches are measured against complaint_sla_targets (hours per priority).
+Changing a target recomputes the buckets. Complaints still waiting past
+their target are counted live from the unresolved rows of complaint_sla.
+"""
+import argparse
+
+PERCENTILES = (50, 90)
+PRIORITIES = ['urgent', 'high', 'medium', 'low']
+
+
+def bucket_bounds(bucket):
+    """(lower, upper) minutes of a complaint_sla_bucket()"""
+    return 2 ** (bucket / 4) - 1, 2 ** ((bucket + 1) / 4) - 1
+
+
+def percentile(buckets, pct):
+    """Minutes at pct from [(bucket, count)] sorted by bucket"""
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+    rank = total * pct / 100
+    seen = 0
+    for bucket, count in buckets:
+        if count and seen + count >= rank:
+            lower, upper = bucket_bounds(bucket)
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return bucket_bounds(buckets[-1][0])[1]
+
+
+def get_targets(db):
+    cursor = db.connection.cursor()
+    cursor.execute("SELECT priority, response_hours, resolve_hours FROM complaint_sla_targets")
+    targets = {r[0]: {'response_hours': r[1], 'resolve_hours': r[2]} for r in cursor.fetchall()}
+    cursor.close()
+    return targets
+
+
+def set_targets(db, targets):
+    """targets: {priority: (response_hours, resolve_hours)}; recomputes breaches for every complaint"""
+    cursor = db.connection.cursor()
+    with db.transaction():
+        for priority, (response_hours, resolve_hours) in targets.items():
+            cursor.execute("""
+                INSERT INTO complaint_sla_targets (priority, response_hours, resolve_hours) VALUES (%s, %s, %s)
+                ON CONFLICT (priority) DO UPDATE SET
+                    response_hours = EXCLUDED.response_hours, resolve_hours = EXCLUDED.resolve_hours
+            """, (priority, response_hours, resolve_hours))
+        db.rebuild_complaint_sla()
+    cursor.close()
+
+
+def sla_report(db):
+    """One row per category and priority with percentiles (hours), breaches and overdue open complaints"""
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT category, priority, metric, bucket, SUM(complaints), SUM(complaints) FILTER (WHERE breached)
+        FROM complaint_sla_buckets
+        GROUP BY 1, 2, 3, 4
+        HAVING SUM(complaints) > 0
+        ORDER BY 1, 2, 3, 4
+    """)
+    groups = {}
+    for category, priority, metric, bucket, count, breached in cursor.fetchall():
+        group = groups.setdefault((category, priority), {'response': [], 'resolve': [],
+                                                         'response_breaches': 0, 'resolve_breaches': 0})
+        group[metric].append((bucket, count))
+        group[f"{metric}_breaches"] += breached or 0
+
+    # still waiting, compared with the target as of now
+    cursor.execute("""
+        SELECT s.category, s.priority,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE s.first_response_at IS NULL
+                                AND s.created_at < CURRENT_TIMESTAMP - t.response_hours * INTERVAL '1 hour'),
+               COUNT(*) FILTER (WHERE s.created_at < CURRENT_TIMESTAMP - t.resolve_hours * INTERVAL '1 hour')
+        FROM complaint_sla s
+        JOIN complaint_sla_targets t ON t.priority = s.priority
+        WHERE s.resolved_at IS NULL
+        GROUP BY 1, 2
+    """)
+    waiting = {(r[0], r[1]): r[2:] for r in cursor.fetchall()}
+    cursor.close()
+
+    rows = []
+    for key in sorted(set(groups) | set(waiting),
+                      key=lambda k: (k[0], PRIORITIES.index(k[1]) if k[1] in PRIORITIES else len(PRIORITIES))):
+        group = groups.get(key, {'response': [], 'resolve': [], 'response_breaches': 0, 'resolve_breaches': 0})
+        open_count, response_overdue, resolve_overdue = waiting.get(key, (0, 0, 0))
+        row = {'category': key[0], 'priority': key[1], 'open': open_count,
+               'responded': sum(c for _, c in group['response']), 'resolved': sum(c for _, c in group['resolve']),
+               'response_breaches': group['response_breaches'], 'resolve_breaches': group['resolve_breaches'],
+               'response_overdue': response_overdue, 'resolve_overdue': resolve_overdue}
+        for metric in ('response', 'resolve'):
+            for pct in PERCENTILES:
+                minutes = percentile(group[metric], pct)
+                row[f"{metric}_p{pct}_hours"] = None if minutes is None else minutes / 60
+        rows.append(row)
+    return rows
+
+
+def get_recent_events(db, limit=20):
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT e.event_id, e.complaint_id, c.flat_number, c.title, e.event_type, e.from_status, e.to_status,
+               e.created_at
+        FROM complaint_events e JOIN complaints c ON c.complaint_id = e.complaint_id
+        ORDER BY e.event_id DESC LIMIT %s
+    """, (limit,))
+    events = [{'event_id': r[0], 'complaint_id': r[1], 'flat_number': r[2], 'title': r[3], 'event_type': r[4],
+               'from_status': r[5], 'to_status': r[6], 'created_at': r[7]} for r in cursor.fetchall()]
+    cursor.close()
+    return events
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Complaint SLA report")
+    parser.add_argument("--rebuild", action="store_true", help="recompute complaint_sla from the complaints first")
+    args = parser.parse_args(argv)
+
+    db = Database()
+    if args.rebuild:
+        db.rebuild_complaint_sla()
+    print(f"{'category':<16} {'priority':<8} {'resp p50':>9} {'resp p90':>9} {'res p50':>9} {'res p90':>9} "
+          f"{'breaches':>9} {'overdue':>8}")
+    for r in sla_report(db):
+        hours = [r[k] for k in ('response_p50_hours', 'response_p90_hours', 'resolve_p50_hours', 'resolve_p90_hours')]
+        print(f"{r['category'][:16]:<16} {r['priority']:<8} "
+              + " ".join(f"{h:>8.1f}h" if h is not None else f"{'-':>9}" for h in hours)
+              + f" {r['response_breaches'] + r['resolve_breaches']:>9} {r['resolve_overdue']:>8}")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
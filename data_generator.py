@@ -0,0 +1,345 @@
+"""Synthetic society data generator.
+
+Fills a local PostgreSQL database with a large, reproducible society
+(flats, owners, tenants, monthly bills, visitors, complaints, notifications
+with read receipts, polls with votes) using COPY, so the app and the
+benchmarks can be exercised at realistic scale.
+
+Usage:
+    python data_generator.py --reset --flats 10000 --years 5 --visitors 2000000
+
+All generated residents log in with the password given by --password
+(default: password123). Use the same --seed to get the same data again.
+"""
+import argparse
+import base64
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import bcrypt
+
+from database import Database
+
+
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Vihaan", "Arjun", "Sai", "Reyansh", "Krishna", "Ishaan", "Rohan",
+               "Ananya", "Diya", "Priya", "Kavya", "Isha", "Meera", "Pooja", "Sneha", "Riya", "Neha",
+               "Rahul", "Amit", "Suresh", "Rajesh", "Vikas", "Sunita", "Anita", "Deepika", "Shweta", "Manoj"]
+LAST_NAMES = ["Sharma", "Patel", "Shukla", "Kumar", "Singh", "Gupta", "Jain", "Mehta", "Agarwal", "Yadav",
+              "Verma", "Joshi", "Mishra", "Pandey", "Roy", "Thakur", "Bansal", "Goyal", "Saxena", "Gade"]
+PURPOSES = ["Delivery", "Guest", "Maid", "Driver", "Plumber", "Electrician", "Courier", "Cab pickup", "Family visit"]
+COMPLAINT_CATEGORIES = ["Maintenance", "Plumbing", "Electrical", "Security", "Noise", "Parking",
+                        "Cleanliness", "Elevator", "Water Supply", "Other"]
+BILL_AMOUNTS = {"Maintenance": (2500, 6000), "Electricity": (800, 4500), "Water": (300, 1200),
+                "Parking": (500, 1500), "Security": (800, 2000), "Other": (200, 3000)}
+PAYMENT_METHODS = ["Online Banking", "UPI", "Credit Card", "Debit Card", "Cash"]
+
+# tables in dependency order, used for --reset and sequence sync
+TABLES = [
+    ("votes", "vote_id"), ("poll_options", "option_id"), ("polls", "poll_id"),
+    ("notification_reads", "read_id"), ("notifications", "notification_id"),
+    ("visitors", "visitor_id"), ("complaints", "complaint_id"), ("bills", "bill_id"),
+    ("tenants", "tenant_id"), ("owners", "owner_id"), ("users", "user_id"),
+]
+# filled by triggers or by payments against the tables above
+DERIVED_TABLES = ["ledger_entries", "flat_balances", "collection_daily", "payments", "payment_events",
+                  "complaint_events", "complaint_sla", "complaint_sla_buckets", "visitor_hourly",
+                  "visitor_flat_monthly", "visitor_profiles"]
+
+
+class CopySource:
+    """File-like object that streams rows to COPY ... FROM STDIN in text format"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ""
+        self.count = 0
+
+    @staticmethod
+    def format_value(value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        text = str(value)
+        return (text.replace("\\", "\\\\").replace("\t", "\\t")
+                .replace("\n", "\\n").replace("\r", "\\r"))
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                break
+            self.buffer += "\t".join(self.format_value(v) for v in row) + "\n"
+            self.count += 1
+        if size < 0:
+            data, self.buffer = self.buffer, ""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    readline = read
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY an iterable of tuples into table and return the row count"""
+    source = CopySource(rows)
+    started = time.perf_counter()
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", source, size=1 << 16)
+    print(f"  {table:<20} {source.count:>10,} rows in {time.perf_counter() - started:6.1f}s")
+    return source.count
+
+
+def add_months(day, months):
+    """First-of-month arithmetic without external date libraries"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def generate_flat_numbers(count, floors=20, units=20):
+    """Flat numbers in the app's <block><floor><unit:02d> format, e.g. A101"""
+    flats = []
+    for block_index in range(26):
+        block = chr(ord('A') + block_index)
+        for floor in range(1, floors + 1):
+            for unit in range(1, units + 1):
+                flats.append(f"{block}{floor}{unit:02d}")
+                if len(flats) == count:
+                    return flats
+    raise ValueError(f"Cannot fit {count} flats in 26 blocks of {floors}x{units}")
+
+
+class SocietyGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.end = datetime.combine(args.end_date, datetime.min.time())
+        self.start = self.end - timedelta(days=365 * args.years)
+        self.flats = generate_flat_numbers(args.flats)
+        self.owner_ids = []     # (user_id, owner_id, flat)
+        self.tenant_ids = []    # (user_id, flat)
+        self.resident_ids = []
+        self.flat_by_user = {}
+        # one hash for everyone; bcrypt per user would dominate generation time
+        self.password_hash = bcrypt.hashpw(args.password.encode('utf-8'), bcrypt.gensalt(rounds=10)).decode('utf-8')
+        self.photos = [base64.b64encode(bytes(self.rng.getrandbits(8) for _ in range(args.photo_bytes))).decode()
+                       for _ in range(8)]
+
+    def random_time(self, start=None, end=None):
+        start = start or self.start
+        end = end or self.end
+        span = int((end - start).total_seconds())
+        return start + timedelta(seconds=self.rng.randrange(max(span, 1)))
+
+    def person_name(self):
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def phone(self):
+        return f"{self.rng.choice('6789')}{self.rng.randrange(10 ** 9):09d}"
+
+    def users(self):
+        yield (1, "admin", bcrypt.hashpw(b"admin123", bcrypt.gensalt(rounds=10)).decode('utf-8'), "admin", "ADMIN",
+               "System Administrator", "admin@societysync.com", None, self.start, True, "admin123")
+        user_id = 1
+        owner_id = 0
+        for flat in self.flats:
+            user_id += 1
+            owner_id += 1
+            self.owner_ids.append((user_id, owner_id, flat))
+            self.resident_ids.append(user_id)
+            self.flat_by_user[user_id] = flat
+            yield (user_id, f"owner_{flat.lower()}", self.password_hash, "owner", flat, self.person_name(),
+                   f"owner.{flat.lower()}@example.com", self.phone(), self.random_time(), True, None)
+            if self.rng.random() < self.args.tenant_ratio:
+                user_id += 1
+                self.tenant_ids.append((user_id, flat))
+                self.resident_ids.append(user_id)
+                self.flat_by_user[user_id] = flat
+                yield (user_id, f"tenant_{flat.lower()}", self.password_hash, "tenant", flat, self.person_name(),
+                       f"tenant.{flat.lower()}@example.com", self.phone(), self.random_time(), True, None)
+
+    def owners(self):
+        for user_id, owner_id, flat in self.owner_ids:
+            yield (owner_id, user_id, flat, self.random_time().date(), self.phone())
+
+    def tenants(self):
+        owner_by_flat = {flat: owner_id for _, owner_id, flat in self.owner_ids}
+        for user_id, flat in self.tenant_ids:
+            lease_start = self.random_time(self.end - timedelta(days=700)).date()
+            yield (user_id, owner_by_flat[flat], flat, self.rng.randrange(12, 60) * 1000,
+                   lease_start, lease_start + timedelta(days=365 * self.rng.choice([1, 2, 3])),
+                   self.rng.randrange(2, 6) * 25000)
+
+    def bills(self):
+        bill_types = [t.strip() for t in self.args.bill_types.split(",") if t.strip()]
+        today = self.end.date()
+        months = self.args.years * 12
+        for month in range(months, -1, -1):
+            period = add_months(today.replace(day=1), -month)
+            due = add_months(period, 1).replace(day=10)
+            for flat in self.flats:
+                for bill_type in bill_types:
+                    low, high = BILL_AMOUNTS.get(bill_type, (500, 3000))
+                    amount = f"{self.rng.uniform(low, high):.2f}"
+                    if due >= today:
+                        status, paid_on, method = "pending", None, None
+                    elif self.rng.random() < self.args.overdue_ratio:
+                        status, paid_on, method = "overdue", None, None
+                    else:
+                        paid_on = due - timedelta(days=self.rng.randrange(-15, 20))
+                        status, method = "paid", self.rng.choice(PAYMENT_METHODS)
+                    yield (flat, bill_type, amount, due, status, paid_on, method, period, 1,
+                           amount if status == "paid" else "0")
+
+    def visitors(self):
+        for _ in range(self.args.visitors):
+            entry = self.random_time()
+            flat = self.rng.choice(self.flats)
+            still_inside = entry > self.end - timedelta(hours=6) and self.rng.random() < 0.5
+            exit_time = None if still_inside else entry + timedelta(minutes=self.rng.randrange(5, 600))
+            photo = self.rng.choice(self.photos) if self.rng.random() < self.args.photo_ratio else None
+            vehicle = (f"MH{self.rng.randrange(1, 50):02d} {chr(65 + self.rng.randrange(26))}{chr(65 + self.rng.randrange(26))} "
+                       f"{self.rng.randrange(10000):04d}") if self.rng.random() < 0.3 else None
+            yield (flat, self.person_name(), self.phone(), self.rng.choice(PURPOSES), entry, exit_time,
+                   vehicle, 1, "in" if still_inside else "out", photo)
+
+    def complaints(self):
+        for _ in range(self.args.complaints):
+            user_id = self.rng.choice(self.resident_ids)
+            created = self.random_time()
+            status = self.rng.choices(["open", "in_progress", "resolved", "closed"], [1, 1, 4, 2])[0]
+            resolved = created + timedelta(hours=self.rng.randrange(1, 400)) if status in ("resolved", "closed") else None
+            category = self.rng.choice(COMPLAINT_CATEGORIES)
+            yield (user_id, self.flat_by_user[user_id], f"{category} issue",
+                   f"Synthetic {category.lower()} complaint raised for testing.", category,
+                   self.rng.choice(["low", "medium", "high", "urgent"]), status,
+                   "Resolved by maintenance team" if resolved else None, created, resolved or created, resolved)
+
+    def notifications(self):
+        for notification_id in range(1, self.args.notifications + 1):
+            yield (notification_id, f"Notice #{notification_id}", "Synthetic society announcement.", 1,
+                   self.random_time(), self.rng.choice(["low", "normal", "high"]))
+
+    def notification_reads(self):
+        readers = max(1, int(len(self.resident_ids) * self.args.read_ratio))
+        for notification_id in range(1, self.args.notifications + 1):
+            for user_id in self.rng.sample(self.resident_ids, readers):
+                yield (notification_id, user_id, self.end)
+
+    def polls(self):
+        for poll_id in range(1, self.args.polls + 1):
+            created = self.random_time()
+            status = "active" if poll_id > self.args.polls - 3 else "closed"
+            yield (poll_id, f"Society poll #{poll_id}", "Synthetic poll.", 1, created,
+                   (created + timedelta(days=14)).date(), status, status == "active")
+
+    def poll_options(self):
+        self.options_by_poll = {}
+        option_id = 0
+        for poll_id in range(1, self.args.polls + 1):
+            self.options_by_poll[poll_id] = []
+            for n in range(self.rng.randrange(2, 6)):
+                option_id += 1
+                self.options_by_poll[poll_id].append(option_id)
+                yield (option_id, poll_id, f"Option {n + 1}", 0)
+
+    def votes(self):
+        voters = max(1, int(len(self.resident_ids) * self.args.vote_ratio))
+        for poll_id, option_ids in self.options_by_poll.items():
+            for user_id in self.rng.sample(self.resident_ids, voters):
+                yield (poll_id, self.rng.choice(option_ids), user_id, self.end)
+
+    def run(self, cursor):
+        copy_rows(cursor, "users", ["user_id", "username", "password_hash", "role", "flat_number", "name", "email",
+                                    "phone", "created_at", "password_changed", "initial_password"], self.users())
+        copy_rows(cursor, "owners", ["owner_id", "user_id", "flat_number", "ownership_start_date",
+                                     "emergency_contact"], self.owners())
+        copy_rows(cursor, "tenants", ["user_id", "owner_id", "flat_number", "rent_amount", "lease_start_date",
+                                      "lease_end_date", "security_deposit"], self.tenants())
+        copy_rows(cursor, "bills", ["flat_number", "bill_type", "amount", "due_date", "payment_status",
+                                    "payment_date", "payment_method", "created_at", "created_by", "amount_paid"],
+                  self.bills())
+        copy_rows(cursor, "visitors", ["flat_number", "visitor_name", "visitor_phone", "purpose", "entry_time",
+                                       "exit_time", "vehicle_number", "logged_by", "status", "visitor_photo"],
+                  self.visitors())
+        copy_rows(cursor, "complaints", ["user_id", "flat_number", "title", "description", "category", "priority",
+                                         "status", "admin_response", "created_at", "updated_at", "resolved_at"],
+                  self.complaints())
+        copy_rows(cursor, "notifications", ["notification_id", "title", "message", "created_by", "created_at",
+                                            "priority"], self.notifications())
+        copy_rows(cursor, "notification_reads", ["notification_id", "user_id", "read_at"], self.notification_reads())
+        copy_rows(cursor, "polls", ["poll_id", "title", "description", "created_by", "created_at", "end_date",
+                                    "status", "is_active"], self.polls())
+        copy_rows(cursor, "poll_options", ["option_id", "poll_id", "option_text", "vote_count"], self.poll_options())
+        copy_rows(cursor, "votes", ["poll_id", "option_id", "user_id", "voted_at"], self.votes())
+
+        # keep the denormalised vote counters consistent with the votes table
+        cursor.execute("""
+            UPDATE poll_options po SET vote_count = v.total
+            FROM (SELECT option_id, COUNT(*) AS total FROM votes GROUP BY option_id) v
+            WHERE po.option_id = v.option_id
+        """)
+
+
+def sync_sequences(cursor):
+    """Move every SERIAL sequence past the ids written by COPY"""
+    for table, column in TABLES:
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                       f"COALESCE((SELECT MAX({column}) FROM {table}), 0) + 1, false)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic society into PostgreSQL ($DATABASE_URL)")
+    parser.add_argument("--reset", action="store_true", help="truncate all society tables first")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--flats", type=int, default=10000)
+    parser.add_argument("--tenant-ratio", type=float, default=0.3, help="share of flats that also have a tenant")
+    parser.add_argument("--years", type=int, default=5, help="years of monthly bills and history")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date.today(),
+                        help="last day of generated history (fix it for reproducible datasets)")
+    parser.add_argument("--bill-types", default="Maintenance,Electricity,Water")
+    parser.add_argument("--overdue-ratio", type=float, default=0.05)
+    parser.add_argument("--visitors", type=int, default=2000000)
+    parser.add_argument("--photo-ratio", type=float, default=0.05, help="share of visitors with a photo")
+    parser.add_argument("--photo-bytes", type=int, default=6000, help="raw size of each synthetic photo")
+    parser.add_argument("--complaints", type=int, default=50000)
+    parser.add_argument("--notifications", type=int, default=500)
+    parser.add_argument("--read-ratio", type=float, default=0.5, help="share of residents reading each notification")
+    parser.add_argument("--polls", type=int, default=40)
+    parser.add_argument("--vote-ratio", type=float, default=0.4)
+    parser.add_argument("--password", default="password123", help="login password for generated residents")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.getenv('DATABASE_URL'):
+        raise SystemExit("DATABASE_URL is not set")
+
+    db = Database()
+    cursor = db.connection.cursor()
+
+    if args.reset:
+        cursor.execute(f"TRUNCATE {', '.join([t for t, _ in TABLES] + DERIVED_TABLES)} RESTART IDENTITY CASCADE")
+    else:
+        cursor.execute("SELECT COUNT(*) FROM users")
+        if cursor.fetchone()[0] > 0:
+            raise SystemExit("Database already has users; re-run with --reset to replace them")
+
+    # every generated month gets its own visitors partition instead of landing in visitors_default
+    db.ensure_visitor_partitions(start=args.end_date - timedelta(days=365 * args.years))
+
+    started = time.perf_counter()
+    print(f"Generating {args.flats:,} flats, {args.years} years of bills, {args.visitors:,} visitors (seed {args.seed})")
+    SocietyGenerator(args).run(cursor)
+    sync_sequences(cursor)
+    cursor.execute("ANALYZE")
+    cursor.close()
+    db.close_connection()
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,446 @@
 import psycopg2
+import psycopg2.extras
 import os
 import bcrypt
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import secrets
 import string
+import hashlib
+import re
+import argparse
+from contextlib import contextmanager
+
+# Keeps ledger_entries and flat_balances in step with bills. A bill adds a charge, a rise in its
+# amount_paid a payment (negative), and later edits add adjustments; ledger inserts move the balance.
+# pending/overdue totals are the outstanding part of those bills, paid_amount all money received.
+STATUS_TOTALS_UPSERT = """
+        INSERT INTO flat_balances (flat_number, pending_amount, overdue_amount, paid_amount, bill_count)
+        SELECT * FROM (
+            SELECT flat_number,
+                   COALESCE(SUM(sign * (amount - amount_paid)) FILTER (WHERE payment_status = 'pending'), 0) AS pending,
+                   COALESCE(SUM(sign * (amount - amount_paid)) FILTER (WHERE payment_status = 'overdue'), 0) AS overdue,
+                   COALESCE(SUM(sign * amount_paid), 0) AS paid,
+                   SUM(sign) AS bills
+            FROM ({changes}) ch
+            GROUP BY flat_number
+        ) totals
+        WHERE (pending, overdue, paid, bills) <> (0, 0, 0, 0)
+        ORDER BY flat_number
+        ON CONFLICT (flat_number) DO UPDATE SET
+            pending_amount = flat_balances.pending_amount + EXCLUDED.pending_amount,
+            overdue_amount = flat_balances.overdue_amount + EXCLUDED.overdue_amount,
+            paid_amount = flat_balances.paid_amount + EXCLUDED.paid_amount,
+            bill_count = flat_balances.bill_count + EXCLUDED.bill_count,
+            updated_at = CURRENT_TIMESTAMP;
+"""
+
+LEDGER_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION bills_ledger_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO ledger_entries (flat_number, entry_type, amount, bill_id, description)
+        SELECT flat_number, 'charge', amount, bill_id, bill_type FROM new_bills
+        UNION ALL
+        SELECT flat_number, 'payment', -amount_paid, bill_id, bill_type || ' paid'
+        FROM new_bills WHERE amount_paid <> 0;
+        """ + STATUS_TOTALS_UPSERT.format(
+            changes="SELECT flat_number, payment_status, amount, amount_paid, 1 AS sign FROM new_bills") + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION bills_ledger_update() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO ledger_entries (flat_number, entry_type, amount, bill_id, description)
+        SELECT e.flat_number, e.entry_type, e.amount, c.bill_id, c.bill_type || e.note
+        FROM (
+            SELECT o.flat_number AS old_flat, n.flat_number AS new_flat, n.bill_id, n.bill_type,
+                   o.amount AS old_amount, n.amount AS new_amount,
+                   o.amount_paid AS old_paid, n.amount_paid AS new_paid
+            FROM old_bills o JOIN new_bills n ON n.bill_id = o.bill_id
+        ) c
+        CROSS JOIN LATERAL (VALUES
+            -- moved to another flat: the outstanding part leaves one flat and reaches the other
+            (c.old_flat <> c.new_flat, c.old_flat, 'adjustment', c.old_paid - c.old_amount,
+             ' moved to flat ' || c.new_flat),
+            (c.old_flat <> c.new_flat, c.new_flat, 'adjustment', c.new_amount - c.new_paid,
+             ' moved from flat ' || c.old_flat),
+            (c.old_flat = c.new_flat, c.new_flat, 'adjustment', c.new_amount - c.old_amount, ' amount changed'),
+            (c.old_flat = c.new_flat, c.new_flat,
+             CASE WHEN c.new_paid > c.old_paid THEN 'payment' ELSE 'adjustment' END, c.old_paid - c.new_paid,
+             CASE WHEN c.new_paid > c.old_paid THEN ' paid' ELSE ' payment reversed' END)
+        ) AS e(applies, flat_number, entry_type, amount, note)
+        WHERE e.applies AND e.amount <> 0;
+        """ + STATUS_TOTALS_UPSERT.format(
+            changes="SELECT flat_number, payment_status, amount, amount_paid, -1 AS sign FROM old_bills "
+                    "UNION ALL SELECT flat_number, payment_status, amount, amount_paid, 1 FROM new_bills") + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION bills_ledger_delete() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO ledger_entries (flat_number, entry_type, amount, bill_id, description)
+        SELECT flat_number, 'adjustment', amount_paid - amount, bill_id, bill_type || ' deleted'
+        FROM old_bills WHERE amount <> amount_paid;
+        """ + STATUS_TOTALS_UPSERT.format(
+            changes="SELECT flat_number, payment_status, amount, amount_paid, -1 AS sign FROM old_bills") + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION ledger_balance_sync() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO flat_balances (flat_number, balance)
+        SELECT flat_number, SUM(amount) FROM new_entries GROUP BY flat_number ORDER BY flat_number
+        ON CONFLICT (flat_number) DO UPDATE SET
+            balance = flat_balances.balance + EXCLUDED.balance, updated_at = CURRENT_TIMESTAMP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+# Keeps collection_daily in step with bills: a bill's amount counts as billed on its due date and a
+# rise in its amount_paid as collected on its payment date, per bill type and block.
+COLLECTIONS_UPSERT = """
+        INSERT INTO collection_daily (day, bill_type, block, billed, bill_count, collected)
+        SELECT * FROM (
+            SELECT day, bill_type, block, SUM(billed), SUM(bills), SUM(collected)
+            FROM ({changes}) ch (day, bill_type, block, billed, bills, collected)
+            GROUP BY day, bill_type, block
+        ) totals (day, bill_type, block, billed, bills, collected)
+        WHERE (billed, bills, collected) <> (0, 0, 0)
+        ORDER BY day, bill_type, block
+        ON CONFLICT (day, bill_type, block) DO UPDATE SET
+            billed = collection_daily.billed + EXCLUDED.billed,
+            bill_count = collection_daily.bill_count + EXCLUDED.bill_count,
+            collected = collection_daily.collected + EXCLUDED.collected;
+"""
+
+# (day, bill_type, block, billed, bills, collected) rows for a transition table, signed
+BILLED_ROWS = "SELECT due_date, bill_type, LEFT(flat_number, 1), {sign} * amount, {sign}, 0 FROM {table}"
+COLLECTED_ROWS = ("SELECT COALESCE(payment_date, paid_at::date, due_date), bill_type, LEFT(flat_number, 1), 0, 0, "
+                  "{sign} * amount_paid FROM {table} WHERE amount_paid <> 0")
+
+COLLECTION_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION bills_collections_insert() RETURNS trigger AS $$
+    BEGIN
+        """ + COLLECTIONS_UPSERT.format(changes=BILLED_ROWS.format(sign=1, table="new_bills") + " UNION ALL "
+                                        + COLLECTED_ROWS.format(sign=1, table="new_bills")) + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION bills_collections_update() RETURNS trigger AS $$
+    BEGIN
+        -- billed moves with the bill; a payment counts on the day it was recorded, earlier ones stay put
+        """ + COLLECTIONS_UPSERT.format(changes=BILLED_ROWS.format(sign=-1, table="old_bills") + " UNION ALL "
+                                        + BILLED_ROWS.format(sign=1, table="new_bills") + """ UNION ALL
+            SELECT COALESCE(n.payment_date, CURRENT_DATE), n.bill_type, LEFT(n.flat_number, 1), 0, 0,
+                   n.amount_paid - o.amount_paid
+            FROM old_bills o JOIN new_bills n ON n.bill_id = o.bill_id
+            WHERE n.amount_paid <> o.amount_paid""") + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION bills_collections_delete() RETURNS trigger AS $$
+    BEGIN
+        """ + COLLECTIONS_UPSERT.format(changes=BILLED_ROWS.format(sign=-1, table="old_bills") + " UNION ALL "
+                                        + COLLECTED_ROWS.format(sign=-1, table="old_bills")) + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+# Complaint history and SLA tracking. resolved_at is stamped when a complaint reaches resolved/closed
+# and cleared when it is reopened; every transition is written to complaint_events, and complaint_sla
+# holds each complaint's response/resolution minutes. complaint_sla_buckets counts those minutes in
+# quarter-power-of-two buckets per category and priority, so percentiles never sort the complaints.
+COMPLAINT_SLA_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION complaints_resolved_at() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.status IN ('resolved', 'closed') THEN
+            IF TG_OP = 'INSERT' OR OLD.status NOT IN ('resolved', 'closed') THEN
+                NEW.resolved_at := COALESCE(NEW.resolved_at, CURRENT_TIMESTAMP);
+            END IF;
+        ELSE
+            NEW.resolved_at := NULL;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION complaint_sla_bucket(minutes NUMERIC) RETURNS SMALLINT AS $$
+        SELECT FLOOR(4 * LOG(2, GREATEST(minutes, 0) + 1))::SMALLINT
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION complaint_sla_count(s complaint_sla, delta INTEGER) RETURNS void AS $$
+    BEGIN
+        IF s.complaint_id IS NULL THEN
+            RETURN;
+        END IF;
+        INSERT INTO complaint_sla_buckets (category, priority, metric, bucket, breached, complaints)
+        SELECT s.category, s.priority, m.metric, complaint_sla_bucket(m.minutes), m.breached, delta
+        FROM (VALUES ('response', s.response_minutes, s.response_breached),
+                     ('resolve', s.resolve_minutes, s.resolve_breached)) AS m (metric, minutes, breached)
+        WHERE m.minutes IS NOT NULL
+        ON CONFLICT (category, priority, metric, bucket, breached) DO UPDATE SET
+            complaints = complaint_sla_buckets.complaints + EXCLUDED.complaints;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION complaints_sla_track() RETURNS trigger AS $$
+    DECLARE
+        old_sla complaint_sla%ROWTYPE;
+        new_sla complaint_sla%ROWTYPE;
+        target complaint_sla_targets%ROWTYPE;
+        responded BOOLEAN;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM complaint_sla WHERE complaint_id = OLD.complaint_id RETURNING * INTO old_sla;
+            PERFORM complaint_sla_count(old_sla, -1);
+            RETURN NULL;
+        END IF;
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO complaint_events (complaint_id, event_type, to_status, created_at)
+            VALUES (NEW.complaint_id, 'created', NEW.status, COALESCE(NEW.created_at, CURRENT_TIMESTAMP));
+        ELSE
+            IF (NEW.status, COALESCE(NEW.admin_response, ''), NEW.category, NEW.priority, NEW.resolved_at, NEW.created_at)
+               IS NOT DISTINCT FROM
+               (OLD.status, COALESCE(OLD.admin_response, ''), OLD.category, OLD.priority, OLD.resolved_at, OLD.created_at) THEN
+                RETURN NULL;
+            END IF;
+            IF NEW.status IS DISTINCT FROM OLD.status THEN
+                INSERT INTO complaint_events (complaint_id, event_type, from_status, to_status)
+                VALUES (NEW.complaint_id, 'status', OLD.status, NEW.status);
+            END IF;
+            IF COALESCE(NEW.admin_response, '') NOT IN ('', COALESCE(OLD.admin_response, '')) THEN
+                INSERT INTO complaint_events (complaint_id, event_type, from_status, to_status)
+                VALUES (NEW.complaint_id, 'response', NEW.status, NEW.status);
+            END IF;
+        END IF;
+        responded := NEW.status <> 'open' OR COALESCE(NEW.admin_response, '') <> '';
+
+        SELECT * INTO old_sla FROM complaint_sla WHERE complaint_id = NEW.complaint_id FOR UPDATE;
+        SELECT * INTO target FROM complaint_sla_targets WHERE priority = NEW.priority;
+        new_sla.complaint_id := NEW.complaint_id;
+        new_sla.category := NEW.category;
+        new_sla.priority := NEW.priority;
+        new_sla.created_at := COALESCE(NEW.created_at, CURRENT_TIMESTAMP);
+        new_sla.first_response_at := CASE
+            WHEN old_sla.first_response_at IS NOT NULL THEN old_sla.first_response_at
+            WHEN NOT responded THEN NULL
+            -- rows loaded with their history (data_generator.py): the earliest recorded change
+            WHEN TG_OP = 'INSERT' THEN COALESCE(LEAST(NEW.updated_at, NEW.resolved_at), new_sla.created_at)
+            ELSE CURRENT_TIMESTAMP
+        END;
+        new_sla.resolved_at := NEW.resolved_at;
+        new_sla.response_minutes := EXTRACT(EPOCH FROM new_sla.first_response_at - new_sla.created_at) / 60;
+        new_sla.resolve_minutes := EXTRACT(EPOCH FROM new_sla.resolved_at - new_sla.created_at) / 60;
+        new_sla.response_breached := COALESCE(new_sla.response_minutes > target.response_hours * 60, FALSE);
+        new_sla.resolve_breached := COALESCE(new_sla.resolve_minutes > target.resolve_hours * 60, FALSE);
+
+        INSERT INTO complaint_sla VALUES (new_sla.*)
+        ON CONFLICT (complaint_id) DO UPDATE SET
+            category = EXCLUDED.category, priority = EXCLUDED.priority, created_at = EXCLUDED.created_at,
+            first_response_at = EXCLUDED.first_response_at, resolved_at = EXCLUDED.resolved_at,
+            response_minutes = EXCLUDED.response_minutes, resolve_minutes = EXCLUDED.resolve_minutes,
+            response_breached = EXCLUDED.response_breached, resolve_breached = EXCLUDED.resolve_breached;
+        PERFORM complaint_sla_count(old_sla, -1);
+        PERFORM complaint_sla_count(new_sla, 1);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+# Keeps the visitor rollups in step with visitors: a visit counts in its entry hour (per block) and
+# entry month (per flat), and once checked out adds a checkout and its dwell time there too.
+VISITOR_ROLLUP_UPSERT = """
+        INSERT INTO visitor_hourly (hour, block, visits, checkouts, dwell_seconds)
+        SELECT * FROM (
+            SELECT date_trunc('hour', entry_time), LEFT(flat_number, 1),
+                   SUM(visits), SUM(checkouts), SUM(dwell)
+            FROM ({changes}) ch
+            GROUP BY 1, 2
+        ) totals (hour, block, visits, checkouts, dwell)
+        WHERE (visits, checkouts, dwell) <> (0, 0, 0)
+        ORDER BY 1, 2
+        ON CONFLICT (hour, block) DO UPDATE SET
+            visits = visitor_hourly.visits + EXCLUDED.visits,
+            checkouts = visitor_hourly.checkouts + EXCLUDED.checkouts,
+            dwell_seconds = visitor_hourly.dwell_seconds + EXCLUDED.dwell_seconds;
+        INSERT INTO visitor_flat_monthly (month, flat_number, visits, checkouts, dwell_seconds)
+        SELECT * FROM (
+            SELECT date_trunc('month', entry_time)::date, flat_number, SUM(visits), SUM(checkouts), SUM(dwell)
+            FROM ({changes}) ch
+            GROUP BY 1, 2
+        ) totals (month, flat_number, visits, checkouts, dwell)
+        WHERE (visits, checkouts, dwell) <> (0, 0, 0)
+        ORDER BY 1, 2
+        ON CONFLICT (month, flat_number) DO UPDATE SET
+            visits = visitor_flat_monthly.visits + EXCLUDED.visits,
+            checkouts = visitor_flat_monthly.checkouts + EXCLUDED.checkouts,
+            dwell_seconds = visitor_flat_monthly.dwell_seconds + EXCLUDED.dwell_seconds;
+"""
+
+# visitors still 'in' after VISITOR_OVERSTAY_HOURS are flagged to the admin; the worker checks out those
+# past VISITOR_MAX_STAY_HOURS (Database.auto_checkout_visitors_batch)
+VISITOR_OVERSTAY_HOURS = float(os.getenv('VISITOR_OVERSTAY_HOURS', '4'))
+VISITOR_MAX_STAY_HOURS = float(os.getenv('VISITOR_MAX_STAY_HOURS', '12'))
+
+# notifications n addressed to user u: everyone, u's role, u's block (first letter of the flat) or u's flat.
+# Every branch is an index condition on idx_notifications_audience, so a user only reads their own rows,
+# and a broadcast to the whole society is still a single notifications row.
+NOTIFICATION_AUDIENCE = """(n.audience = 'all'
+             OR (n.audience = 'role' AND n.audience_value = u.role)
+             OR (n.audience = 'block' AND n.audience_value = LEFT(u.flat_number, 1))
+             OR (n.audience = 'flat' AND n.audience_value = u.flat_number))"""
+
+# visitors is range-partitioned by month of entry_time (visitors_YYYY_MM, plus visitors_default for rows
+# outside them), so history queries bounded by entry_time only read the months they cover. The primary
+# key has to include entry_time; visitor_id still comes from one sequence. Needs PostgreSQL 13+ for the
+# row-level trg_visitors_touch trigger on a partitioned table.
+VISITORS_TABLE = """
+    CREATE SEQUENCE IF NOT EXISTS visitors_visitor_id_seq AS integer;
+    CREATE TABLE IF NOT EXISTS visitors (
+        visitor_id INTEGER NOT NULL DEFAULT nextval('visitors_visitor_id_seq'),
+        flat_number VARCHAR(10) NOT NULL,
+        visitor_name VARCHAR(100) NOT NULL,
+        visitor_phone VARCHAR(15),
+        purpose VARCHAR(200),
+        entry_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        exit_time TIMESTAMP,
+        vehicle_number VARCHAR(20),
+        logged_by INTEGER REFERENCES users(user_id),
+        status VARCHAR(20) DEFAULT 'in' CHECK (status IN ('in', 'out')),
+        visitor_photo TEXT,
+        client_ref VARCHAR(64),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        auto_checked_out_at TIMESTAMP,
+        PRIMARY KEY (visitor_id, entry_time)
+    ) PARTITION BY RANGE (entry_time)
+"""
+# months created ahead of time, so inserts never wait on a new partition
+VISITOR_PARTITION_MONTHS_AHEAD = 3
+
+
+def visitor_match(visitor_id, entry_time=None):
+    # WHERE clause and parameters for one visit; with its entry_time only that month's partition is read
+    if entry_time is None:
+        return "visitor_id = %s", [visitor_id]
+    return "visitor_id = %s AND entry_time = %s", [visitor_id, entry_time]
+
+
+# indexed expressions for search_visitors; queries must repeat them exactly for the indexes to apply
+VISITOR_PHONE_KEY = "regexp_replace(COALESCE(visitor_phone, ''), '[^0-9]', '', 'g')"
+VISITOR_PLATE_KEY = "upper(regexp_replace(COALESCE(vehicle_number, ''), '[^A-Za-z0-9]', '', 'g'))"
+
+# (entry_time, flat_number, visits, checkouts, dwell) rows for a transition table, signed
+VISIT_ROWS = ("SELECT entry_time, flat_number, {sign} AS visits, "
+              "{sign} * (exit_time IS NOT NULL)::int AS checkouts, "
+              "{sign} * COALESCE(GREATEST(EXTRACT(EPOCH FROM exit_time - entry_time), 0), 0)::bigint AS dwell "
+              "FROM {table} WHERE entry_time IS NOT NULL")
+
+VISITOR_ROLLUP_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION visitors_rollup_insert() RETURNS trigger AS $$
+    BEGIN
+        """ + VISITOR_ROLLUP_UPSERT.format(changes=VISIT_ROWS.format(sign=1, table="new_visitors")) + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION visitors_rollup_update() RETURNS trigger AS $$
+    BEGIN
+        """ + VISITOR_ROLLUP_UPSERT.format(changes=VISIT_ROWS.format(sign=-1, table="old_visitors") + " UNION ALL "
+                                           + VISIT_ROWS.format(sign=1, table="new_visitors")) + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION visitors_rollup_delete() RETURNS trigger AS $$
+    BEGIN
+        """ + VISITOR_ROLLUP_UPSERT.format(changes=VISIT_ROWS.format(sign=-1, table="old_visitors")) + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# frequent visitors by phone (visitor_registry.py): the last 10 digits, same as visitor_registry.phone_key
+VISITOR_PROFILE_KEY = "right(regexp_replace(COALESCE({phone}, ''), '[^0-9]', '', 'g'), 10)"
+
+# newest details per phone win; an older entry (e.g. a late kiosk upload) only adds to the count
+VISITOR_PROFILE_UPSERT = """
+        INSERT INTO visitor_profiles AS p (phone_key, visitor_name, visitor_phone, purpose, vehicle_number,
+                                           flat_number, visitor_photo, photo_visitor_id, visits, last_seen)
+        SELECT DISTINCT ON (phone_key) phone_key, visitor_name, visitor_phone, NULLIF(purpose, ''),
+               NULLIF(vehicle_number, ''), flat_number, visitor_photo,
+               CASE WHEN visitor_photo IS NOT NULL THEN visitor_id END,
+               COUNT(*) OVER (PARTITION BY phone_key), entry_time
+        FROM (SELECT v.*, {key} AS phone_key FROM {table} v) v
+        WHERE length(phone_key) >= 6
+        ORDER BY phone_key, entry_time DESC, visitor_id DESC
+        ON CONFLICT (phone_key) DO UPDATE SET
+            visitor_name = CASE WHEN EXCLUDED.last_seen >= p.last_seen THEN EXCLUDED.visitor_name ELSE p.visitor_name END,
+            visitor_phone = CASE WHEN EXCLUDED.last_seen >= p.last_seen THEN EXCLUDED.visitor_phone ELSE p.visitor_phone END,
+            flat_number = CASE WHEN EXCLUDED.last_seen >= p.last_seen THEN EXCLUDED.flat_number ELSE p.flat_number END,
+            purpose = COALESCE(EXCLUDED.purpose, p.purpose),
+            vehicle_number = COALESCE(EXCLUDED.vehicle_number, p.vehicle_number),
+            visitor_photo = COALESCE(EXCLUDED.visitor_photo, p.visitor_photo),
+            photo_visitor_id = COALESCE(EXCLUDED.photo_visitor_id, p.photo_visitor_id),
+            visits = p.visits + EXCLUDED.visits,
+            last_seen = GREATEST(p.last_seen, EXCLUDED.last_seen),
+            updated_at = CURRENT_TIMESTAMP;
+"""
+
+VISITOR_PROFILE_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION visitors_profile_upsert() RETURNS trigger AS $$
+    BEGIN
+        """ + VISITOR_PROFILE_UPSERT.format(key=VISITOR_PROFILE_KEY.format(phone="v.visitor_phone"), table="new_visitors") + """
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# visitor approval requests and decisions are pushed to realtime.py; sent_at is for its latency figures
+VISITOR_APPROVAL_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION visitor_approvals_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('visitor_approvals', json_build_object(
+            'approval_id', NEW.approval_id, 'flat_number', NEW.flat_number, 'status', NEW.status,
+            'visitor_name', NEW.visitor_name, 'purpose', NEW.purpose, 'visitor_id', NEW.visitor_id,
+            'requested_at', NEW.requested_at, 'sent_at', EXTRACT(EPOCH FROM clock_timestamp())
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# guest pass codes: no 0/O, 1/I/L look-alikes; 31^8 codes, shown as ABCD-EFGH
+PASS_CODE_ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+PASS_CODE_LENGTH = 8
 
 
 class Database:
-    def __init__(self):
-        self.connection = None
-        self.connect()
+    # database URLs whose tables were already checked by this process
+    _schema_ready = set()
+
+    def __init__(self, connection=None):
+        # an existing (e.g. pooled) connection can be wrapped instead of opening a new one
+        self.connection = connection
+        if connection is None:
+            self.connect()
     
     def connect(self):
         db_url = os.getenv('DATABASE_URL')
         self.connection = psycopg2.connect(db_url)
         self.connection.autocommit = True
-        self.create_tables()
+        # utils helpers open a Database per call, so only run the DDL once per process
+        if db_url not in Database._schema_ready:
+            self.create_tables()
+            Database._schema_ready.add(db_url)
     
     def create_tables(self):
         cursor = self.connection.cursor()
@@ -90,21 +515,10 @@ class Database:
             )
         """)
         
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS visitors (
-                visitor_id SERIAL PRIMARY KEY,
-                flat_number VARCHAR(10) NOT NULL,
-                visitor_name VARCHAR(100) NOT NULL,
-                visitor_phone VARCHAR(15),
-                purpose VARCHAR(200),
-                entry_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                exit_time TIMESTAMP,
-                vehicle_number VARCHAR(20),
-                logged_by INTEGER REFERENCES users(user_id),
-                status VARCHAR(20) DEFAULT 'in' CHECK (status IN ('in', 'out')),
-                visitor_photo TEXT
-            )
-        """)
+        # new installs get visitors partitioned by month (visitor_partitions.py converts older ones)
+        cursor.execute(VISITORS_TABLE)
+        cursor.execute("ALTER SEQUENCE visitors_visitor_id_seq OWNED BY visitors.visitor_id")
+        self.ensure_visitor_partitions()
         
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS notifications (
@@ -148,17 +562,687 @@ class Database:
             )
         """)
         
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS votes (
+                vote_id SERIAL PRIMARY KEY,
+                poll_id INTEGER REFERENCES polls(poll_id) ON DELETE CASCADE,
+                option_id INTEGER REFERENCES poll_options(option_id) ON DELETE CASCADE,
+                user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+                voted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(poll_id, user_id)
+            )
+        """)
+
         # adding visitor photo column
         try:
             cursor.execute("""
-                ALTER TABLE visitors 
+                ALTER TABLE visitors
                 ADD COLUMN IF NOT EXISTS visitor_photo TEXT
             """)
         except Exception as e:
             print(f"Note: visitor_photo column might already exist: {e}")
-        
+
+        # columns the app reads that only exist in societysync_schema.sql (or only here)
+        cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_picture TEXT")
+        cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_login TIMESTAMP")
+        cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS password_changed BOOLEAN DEFAULT FALSE")
+        cursor.execute("ALTER TABLE bills ADD COLUMN IF NOT EXISTS payment_date DATE")
+        cursor.execute("ALTER TABLE bills ADD COLUMN IF NOT EXISTS payment_method VARCHAR(50)")
+        cursor.execute("ALTER TABLE bills ADD COLUMN IF NOT EXISTS paid_at TIMESTAMP")
+        cursor.execute("ALTER TABLE complaints ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+        cursor.execute("ALTER TABLE notifications ADD COLUMN IF NOT EXISTS priority VARCHAR(20) DEFAULT 'normal'")
+        cursor.execute("ALTER TABLE notifications ADD COLUMN IF NOT EXISTS type VARCHAR(50) DEFAULT 'general'")
+        cursor.execute("ALTER TABLE polls ADD COLUMN IF NOT EXISTS status VARCHAR(20) DEFAULT 'active'")
+        cursor.execute("ALTER TABLE polls ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE")
+        cursor.execute("ALTER TABLE poll_options ADD COLUMN IF NOT EXISTS vote_count INTEGER DEFAULT 0")
+
+        # who a notification is for: everyone, a role, a block or a flat (NOTIFICATION_AUDIENCE)
+        cursor.execute("""
+            ALTER TABLE notifications ADD COLUMN IF NOT EXISTS audience VARCHAR(10) NOT NULL DEFAULT 'all'
+            CHECK (audience IN ('all', 'role', 'block', 'flat'))
+        """)
+        cursor.execute("ALTER TABLE notifications ADD COLUMN IF NOT EXISTS audience_value VARCHAR(20)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_notifications_audience ON notifications(audience, audience_value, created_at DESC)")
+
+        # offline kiosks (kiosk.py) tag their entries so re-sent uploads are ignored
+        cursor.execute("ALTER TABLE visitors ADD COLUMN IF NOT EXISTS client_ref VARCHAR(64)")
+        # a unique index on a partitioned table has to include entry_time; a re-sent entry carries the
+        # same entry_time from the kiosk journal, so this catches repeats just the same
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_visitors_client_ref_entry ON visitors(client_ref, entry_time)")
+        cursor.execute("DROP INDEX IF EXISTS idx_visitors_client_ref")
+
+        # background job queue (worker.py); dedupe_key keeps one live job per key
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id BIGSERIAL PRIMARY KEY,
+                job_type VARCHAR(50) NOT NULL,
+                payload JSONB NOT NULL DEFAULT '{}',
+                status VARCHAR(20) DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+                run_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 5,
+                dedupe_key VARCHAR(200),
+                last_error TEXT,
+                locked_by VARCHAR(100),
+                locked_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(run_at) WHERE status = 'queued'")
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key)
+            WHERE status IN ('queued', 'running')
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                name VARCHAR(100) PRIMARY KEY,
+                job_type VARCHAR(50) NOT NULL,
+                payload JSONB NOT NULL DEFAULT '{}',
+                interval_seconds INTEGER NOT NULL,
+                next_run_at TIMESTAMP NOT NULL,
+                last_enqueued_at TIMESTAMP,
+                enabled BOOLEAN DEFAULT TRUE
+            )
+        """)
+        cursor.execute("ALTER TABLE tenants ADD COLUMN IF NOT EXISTS lease_notice_sent_for DATE")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bills_pending_due ON bills(due_date) WHERE payment_status = 'pending'")
+
+        # recurring billing (billing_engine.py): most specific active plan wins per flat and bill type
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS billing_plans (
+                plan_id SERIAL PRIMARY KEY,
+                bill_type VARCHAR(50) NOT NULL,
+                amount DECIMAL(10,2) NOT NULL CHECK (amount >= 0),
+                scope VARCHAR(10) NOT NULL DEFAULT 'all' CHECK (scope IN ('all', 'block', 'flat')),
+                scope_value VARCHAR(10),
+                due_day SMALLINT NOT NULL DEFAULT 10 CHECK (due_day BETWEEN 1 AND 28),
+                description TEXT,
+                is_active BOOLEAN DEFAULT TRUE,
+                created_by INTEGER REFERENCES users(user_id),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("ALTER TABLE bills ADD COLUMN IF NOT EXISTS billing_period DATE")
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_period
+            ON bills(flat_number, bill_type, billing_period) WHERE billing_period IS NOT NULL
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS billing_runs (
+                run_id SERIAL PRIMARY KEY,
+                billing_period DATE NOT NULL,
+                bills_created INTEGER NOT NULL,
+                total_amount DECIMAL(14,2) NOT NULL,
+                created_by INTEGER REFERENCES users(user_id),
+                run_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # late fees (late_fees.py): one 'Late Fee' bill per unpaid bill, linked by parent_bill_id
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS late_fee_policies (
+                policy_id SERIAL PRIMARY KEY,
+                bill_type VARCHAR(50),
+                flat_fee DECIMAL(10,2) NOT NULL DEFAULT 0 CHECK (flat_fee >= 0),
+                daily_rate_percent DECIMAL(6,3) NOT NULL DEFAULT 0 CHECK (daily_rate_percent >= 0),
+                grace_days SMALLINT NOT NULL DEFAULT 0 CHECK (grace_days >= 0),
+                max_fee DECIMAL(10,2),
+                max_percent DECIMAL(6,2),
+                is_active BOOLEAN DEFAULT TRUE,
+                created_by INTEGER REFERENCES users(user_id),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("ALTER TABLE bills ADD COLUMN IF NOT EXISTS parent_bill_id INTEGER REFERENCES bills(bill_id) ON DELETE CASCADE")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_late_fee ON bills(parent_bill_id) WHERE parent_bill_id IS NOT NULL")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bills_unpaid ON bills(flat_number, due_date) WHERE payment_status <> 'paid'")
+
+        # cumulative meter readings (metering.py); COMMON / COMMON-<block> are common-area meters
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS meter_readings (
+                reading_id BIGSERIAL PRIMARY KEY,
+                flat_number VARCHAR(10) NOT NULL,
+                utility VARCHAR(20) NOT NULL CHECK (utility IN ('electricity', 'water')),
+                reading_date DATE NOT NULL,
+                reading DECIMAL(12,2) NOT NULL CHECK (reading >= 0),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (flat_number, utility, reading_date)
+            )
+        """)
+
+        # payments (payments.py): partial payments add up in bills.amount_paid; the idempotency key
+        # makes a retried or double-clicked payment a no-op
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns WHERE table_name = 'bills' AND column_name = 'amount_paid'
+        """)
+        if not cursor.fetchone():
+            cursor.execute("ALTER TABLE bills ADD COLUMN IF NOT EXISTS amount_paid DECIMAL(10,2) NOT NULL DEFAULT 0")
+            cursor.execute("UPDATE bills SET amount_paid = amount WHERE payment_status = 'paid'")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS payments (
+                payment_id BIGSERIAL PRIMARY KEY,
+                bill_id INTEGER REFERENCES bills(bill_id) ON DELETE CASCADE,
+                flat_number VARCHAR(10) NOT NULL,
+                amount DECIMAL(10,2) NOT NULL CHECK (amount > 0),
+                payment_method VARCHAR(50),
+                idempotency_key VARCHAR(100) NOT NULL UNIQUE,
+                gateway_ref VARCHAR(100),
+                created_by INTEGER REFERENCES users(user_id),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_bill ON payments(bill_id)")
+        # gateway callbacks are stored as received and applied in batches by the worker
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS payment_events (
+                event_seq BIGSERIAL PRIMARY KEY,
+                event_id VARCHAR(100) NOT NULL UNIQUE,
+                payload JSONB NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'received' CHECK (status IN ('received', 'applied', 'ignored', 'rejected')),
+                error TEXT,
+                received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                processed_at TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_payment_events_received ON payment_events(event_seq) WHERE status = 'received'")
+
+        # per-flat ledger and balances (charges, payments, adjustments), maintained by triggers on bills
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_entries (
+                entry_id BIGSERIAL PRIMARY KEY,
+                flat_number VARCHAR(10) NOT NULL,
+                entry_type VARCHAR(20) NOT NULL CHECK (entry_type IN ('charge', 'payment', 'adjustment')),
+                amount DECIMAL(12,2) NOT NULL,
+                bill_id INTEGER,
+                description VARCHAR(200),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ledger_flat ON ledger_entries(flat_number, entry_id DESC)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS flat_balances (
+                flat_number VARCHAR(10) PRIMARY KEY,
+                balance DECIMAL(14,2) NOT NULL DEFAULT 0,
+                pending_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+                overdue_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+                paid_amount DECIMAL(14,2) NOT NULL DEFAULT 0,
+                bill_count INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bills_flat_created ON bills(flat_number, created_at DESC, bill_id DESC)")
+        self.install_ledger_triggers(cursor)
+
+        # daily billed/collected per bill type and block, for the collection trends in payment_tracking
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS collection_daily (
+                day DATE NOT NULL,
+                bill_type VARCHAR(50) NOT NULL,
+                block VARCHAR(10) NOT NULL,
+                billed DECIMAL(14,2) NOT NULL DEFAULT 0,
+                bill_count INTEGER NOT NULL DEFAULT 0,
+                collected DECIMAL(14,2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, bill_type, block)
+            )
+        """)
+        self.install_collection_triggers(cursor)
+
+        # complaint status history and SLA tracking (complaint_sla.py reads these)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS complaint_events (
+                event_id BIGSERIAL PRIMARY KEY,
+                complaint_id INTEGER NOT NULL REFERENCES complaints(complaint_id) ON DELETE CASCADE,
+                event_type VARCHAR(20) NOT NULL CHECK (event_type IN ('created', 'status', 'response')),
+                from_status VARCHAR(20),
+                to_status VARCHAR(20),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_complaint_events_complaint ON complaint_events(complaint_id, event_id)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS complaint_sla_targets (
+                priority VARCHAR(20) PRIMARY KEY,
+                response_hours DECIMAL(8,2) NOT NULL CHECK (response_hours > 0),
+                resolve_hours DECIMAL(8,2) NOT NULL CHECK (resolve_hours > 0)
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO complaint_sla_targets (priority, response_hours, resolve_hours) VALUES
+                ('urgent', 1, 24), ('high', 4, 72), ('medium', 24, 168), ('low', 48, 336)
+            ON CONFLICT (priority) DO NOTHING
+        """)
+        # no foreign key: the delete trigger needs the row to take it out of the buckets
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS complaint_sla (
+                complaint_id INTEGER PRIMARY KEY,
+                category VARCHAR(50) NOT NULL,
+                priority VARCHAR(20) NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                first_response_at TIMESTAMP,
+                resolved_at TIMESTAMP,
+                response_minutes DECIMAL(12,2),
+                resolve_minutes DECIMAL(12,2),
+                response_breached BOOLEAN,
+                resolve_breached BOOLEAN
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS complaint_sla_buckets (
+                category VARCHAR(50) NOT NULL,
+                priority VARCHAR(20) NOT NULL,
+                metric VARCHAR(10) NOT NULL CHECK (metric IN ('response', 'resolve')),
+                bucket SMALLINT NOT NULL,
+                breached BOOLEAN NOT NULL,
+                complaints INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (category, priority, metric, bucket, breached)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_complaint_sla_open ON complaint_sla(created_at) WHERE resolved_at IS NULL")
+        self.install_complaint_sla_triggers(cursor)
+
+        # visitor traffic rollups (visitor_analytics.py): per hour and block, and per month and flat
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS visitor_hourly (
+                hour TIMESTAMP NOT NULL,
+                block VARCHAR(10) NOT NULL,
+                visits INTEGER NOT NULL DEFAULT 0,
+                checkouts INTEGER NOT NULL DEFAULT 0,
+                dwell_seconds BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, block)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS visitor_flat_monthly (
+                month DATE NOT NULL,
+                flat_number VARCHAR(10) NOT NULL,
+                visits INTEGER NOT NULL DEFAULT 0,
+                checkouts INTEGER NOT NULL DEFAULT 0,
+                dwell_seconds BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, flat_number)
+            )
+        """)
+        self.install_visitor_rollup_triggers(cursor)
+
+        # frequent visitors, one row per phone number; kept by a trigger on visitors
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS visitor_profiles (
+                phone_key VARCHAR(10) PRIMARY KEY,
+                visitor_name VARCHAR(100) NOT NULL,
+                visitor_phone VARCHAR(15),
+                purpose VARCHAR(200),
+                vehicle_number VARCHAR(20),
+                flat_number VARCHAR(10),
+                visitor_photo TEXT,
+                photo_visitor_id INTEGER,
+                visits INTEGER NOT NULL DEFAULT 0,
+                last_seen TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitor_profiles_updated ON visitor_profiles(updated_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitor_profiles_photo ON visitor_profiles(photo_visitor_id)")
+        self.install_visitor_profile_trigger(cursor)
+
+        # gate -> resident approval requests (realtime.py pushes them as they are made and decided)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS visitor_approvals (
+                approval_id SERIAL PRIMARY KEY,
+                flat_number VARCHAR(10) NOT NULL,
+                visitor_name VARCHAR(100) NOT NULL,
+                visitor_phone VARCHAR(15),
+                purpose VARCHAR(200),
+                vehicle_number VARCHAR(20),
+                visitor_photo TEXT,
+                requested_by INTEGER REFERENCES users(user_id),
+                requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status VARCHAR(20) DEFAULT 'pending' CHECK (status IN ('pending', 'approved', 'denied', 'cancelled')),
+                decided_by INTEGER REFERENCES users(user_id),
+                decided_at TIMESTAMP,
+                visitor_id INTEGER
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitor_approvals_pending ON visitor_approvals(flat_number) WHERE status = 'pending'")
+        self.install_visitor_approval_trigger(cursor)
+
+        # guest passes residents create for their visitors; only the sha256 of a code is stored
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS visitor_passes (
+                pass_id SERIAL PRIMARY KEY,
+                code_hash CHAR(64) NOT NULL UNIQUE,
+                flat_number VARCHAR(10) NOT NULL,
+                created_by INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+                visitor_name VARCHAR(100) NOT NULL,
+                visitor_phone VARCHAR(15),
+                purpose VARCHAR(200),
+                vehicle_number VARCHAR(20),
+                valid_from TIMESTAMP NOT NULL,
+                valid_until TIMESTAMP NOT NULL,
+                max_uses INTEGER NOT NULL DEFAULT 1,
+                uses INTEGER NOT NULL DEFAULT 0,
+                revoked_at TIMESTAMP,
+                last_used_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                CHECK (valid_until > valid_from AND max_uses > 0)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitor_passes_flat ON visitor_passes(flat_number, valid_until DESC)")
+
+        # complaint full-text search (search_complaints); PostgreSQL keeps the generated column in step
+        cursor.execute("""
+            ALTER TABLE complaints ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', COALESCE(title, '')), 'A') ||
+                setweight(to_tsvector('english', COALESCE(description, '')), 'B') ||
+                setweight(to_tsvector('english', COALESCE(admin_response, '')), 'C')
+            ) STORED
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_complaints_search ON complaints USING GIN (search_vector)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_complaints_created ON complaints(created_at DESC, complaint_id DESC)")
+
+        # fuzzy gate lookups (search_visitors): trigram indexes on the name, and on the phone digits and
+        # the plate without spaces or dashes, so "MH12 AB" finds "MH-12-AB-1234"
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitors_name_trgm ON visitors USING GIN (lower(visitor_name) gin_trgm_ops)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_visitors_phone_trgm ON visitors USING GIN ({VISITOR_PHONE_KEY} gin_trgm_ops)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_visitors_vehicle_trgm ON visitors USING GIN ({VISITOR_PLATE_KEY} gin_trgm_ops)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitors_entry ON visitors(entry_time DESC)")
+        # visitors on the premises; the auto-checkout sweep keeps this index a few hundred rows at most
+        cursor.execute("ALTER TABLE visitors ADD COLUMN IF NOT EXISTS auto_checked_out_at TIMESTAMP")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitors_in ON visitors(entry_time) WHERE status = 'in'")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitors_in_id ON visitors(visitor_id) WHERE status = 'in'")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitors_auto_checkout ON visitors(auto_checked_out_at) WHERE auto_checked_out_at IS NOT NULL")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitors_flat_entry ON visitors(flat_number, entry_time DESC)")
+
+        # bearer tokens of the JSON API (api.py); only the sha256 of a token is stored
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS api_tokens (
+                token_hash CHAR(64) PRIMARY KEY,
+                user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP,
+                expires_at TIMESTAMP
+            )
+        """)
+
+        # analytics_store.py copies the rows changed since its last run, found by updated_at
+        cursor.execute("ALTER TABLE bills ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+        cursor.execute("ALTER TABLE visitors ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                NEW.updated_at := CURRENT_TIMESTAMP;
+                RETURN NEW;
+            END $$
+        """)
+        for table in ('bills', 'visitors', 'complaints'):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated ON {table}(updated_at)")
+            self.create_triggers(cursor, table, f"trg_{table}_touch", f"""
+                CREATE TRIGGER trg_{table}_touch BEFORE UPDATE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+            """)
+
         cursor.close()
     
+    def create_triggers(self, cursor, table, trigger, ddl, rebuilds=None):
+        # the catalog check takes no lock, so a process start with the triggers in place never waits for
+        # writers; only a missing trigger locks the table and checks again. Returns True when created.
+        # The tables a new trigger maintains (rebuilds) are filled by rebuild_derived, not here.
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s", (trigger,))
+        if cursor.fetchone():
+            return False
+        with self.transaction():
+            cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s", (trigger,))
+            if cursor.fetchone():
+                return False
+            cursor.execute(ddl)
+        if rebuilds:
+            print(f"Created {trigger}; run `python database.py --rebuild` to fill {rebuilds} from the existing rows")
+        return True
+
+    def install_ledger_triggers(self, cursor):
+        # statement-level triggers with transition tables, so a bulk billing run is one upsert per statement
+        cursor.execute(LEDGER_FUNCTIONS)
+        self.create_triggers(cursor, 'bills', 'trg_bills_ledger_insert', """
+            CREATE TRIGGER trg_bills_ledger_insert AFTER INSERT ON bills
+            REFERENCING NEW TABLE AS new_bills FOR EACH STATEMENT EXECUTE FUNCTION bills_ledger_insert();
+            CREATE TRIGGER trg_bills_ledger_update AFTER UPDATE ON bills
+            REFERENCING OLD TABLE AS old_bills NEW TABLE AS new_bills FOR EACH STATEMENT EXECUTE FUNCTION bills_ledger_update();
+            CREATE TRIGGER trg_bills_ledger_delete AFTER DELETE ON bills
+            REFERENCING OLD TABLE AS old_bills FOR EACH STATEMENT EXECUTE FUNCTION bills_ledger_delete();
+            CREATE TRIGGER trg_ledger_balance AFTER INSERT ON ledger_entries
+            REFERENCING NEW TABLE AS new_entries FOR EACH STATEMENT EXECUTE FUNCTION ledger_balance_sync();
+        """, rebuilds="ledger_entries and flat_balances")
+
+    def install_collection_triggers(self, cursor):
+        cursor.execute(COLLECTION_FUNCTIONS)
+        self.create_triggers(cursor, 'bills', 'trg_bills_collections_insert', """
+            CREATE TRIGGER trg_bills_collections_insert AFTER INSERT ON bills
+            REFERENCING NEW TABLE AS new_bills FOR EACH STATEMENT EXECUTE FUNCTION bills_collections_insert();
+            CREATE TRIGGER trg_bills_collections_update AFTER UPDATE ON bills
+            REFERENCING OLD TABLE AS old_bills NEW TABLE AS new_bills FOR EACH STATEMENT EXECUTE FUNCTION bills_collections_update();
+            CREATE TRIGGER trg_bills_collections_delete AFTER DELETE ON bills
+            REFERENCING OLD TABLE AS old_bills FOR EACH STATEMENT EXECUTE FUNCTION bills_collections_delete();
+        """, rebuilds="collection_daily")
+
+    def install_visitor_rollup_triggers(self, cursor):
+        cursor.execute(VISITOR_ROLLUP_FUNCTIONS)
+        self.create_triggers(cursor, 'visitors', 'trg_visitors_rollup_insert', """
+            CREATE TRIGGER trg_visitors_rollup_insert AFTER INSERT ON visitors
+            REFERENCING NEW TABLE AS new_visitors FOR EACH STATEMENT EXECUTE FUNCTION visitors_rollup_insert();
+            CREATE TRIGGER trg_visitors_rollup_update AFTER UPDATE ON visitors
+            REFERENCING OLD TABLE AS old_visitors NEW TABLE AS new_visitors FOR EACH STATEMENT EXECUTE FUNCTION visitors_rollup_update();
+            CREATE TRIGGER trg_visitors_rollup_delete AFTER DELETE ON visitors
+            REFERENCING OLD TABLE AS old_visitors FOR EACH STATEMENT EXECUTE FUNCTION visitors_rollup_delete();
+        """, rebuilds="visitor_hourly and visitor_flat_monthly")
+
+    def rebuild_visitor_rollups(self):
+        # recreates visitor_hourly and visitor_flat_monthly from the visitors table; months detached by
+        # retention (visitor_partitions.py) are not in it any more and drop out of the rollups
+        cursor = self.connection.cursor()
+        with self.transaction():
+            cursor.execute("TRUNCATE visitor_hourly, visitor_flat_monthly")
+            cursor.execute(VISITOR_ROLLUP_UPSERT.format(changes=VISIT_ROWS.format(sign=1, table="visitors")))
+        cursor.close()
+
+    def install_visitor_approval_trigger(self, cursor):
+        cursor.execute(VISITOR_APPROVAL_FUNCTIONS)
+        self.create_triggers(cursor, 'visitor_approvals', 'trg_visitor_approvals_notify', """
+            CREATE TRIGGER trg_visitor_approvals_notify AFTER INSERT OR UPDATE OF status ON visitor_approvals
+            FOR EACH ROW EXECUTE FUNCTION visitor_approvals_notify();
+        """)
+
+    def install_visitor_profile_trigger(self, cursor):
+        cursor.execute(VISITOR_PROFILE_FUNCTIONS)
+        self.create_triggers(cursor, 'visitors', 'trg_visitors_profile', """
+            CREATE TRIGGER trg_visitors_profile AFTER INSERT ON visitors
+            REFERENCING NEW TABLE AS new_visitors FOR EACH STATEMENT EXECUTE FUNCTION visitors_profile_upsert();
+        """, rebuilds="visitor_profiles")
+
+    def rebuild_visitor_profiles(self):
+        # recreates visitor_profiles from the visitors table (attached months only)
+        cursor = self.connection.cursor()
+        with self.transaction():
+            cursor.execute("TRUNCATE visitor_profiles")
+            cursor.execute(VISITOR_PROFILE_UPSERT.format(key=VISITOR_PROFILE_KEY.format(phone="v.visitor_phone"), table="visitors"))
+        cursor.close()
+
+    def visitors_partitioned(self):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = 'visitors'::regclass")
+        partitioned = cursor.fetchone()[0]
+        cursor.close()
+        return partitioned
+
+    def ensure_visitor_partitions(self, start=None, months_ahead=VISITOR_PARTITION_MONTHS_AHEAD):
+        # creates the missing monthly partitions from start (default this month) to months_ahead months on.
+        # Each month is filled outside visitors and then attached, which only takes a SHARE UPDATE EXCLUSIVE
+        # lock on visitors; rows of that month already in visitors_default move across first. Statement
+        # triggers on visitors don't see the move, so the rollups stay as they are. Returns the new names.
+        if not self.visitors_partitioned():
+            return []
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'visitors'::regclass
+        """)
+        existing = {r[0] for r in cursor.fetchall()}
+        if 'visitors_default' not in existing:
+            cursor.execute("CREATE TABLE IF NOT EXISTS visitors_default PARTITION OF visitors DEFAULT")
+        this_month = date.today().replace(day=1)
+        month = (start or this_month).replace(day=1)
+        last = date(this_month.year + (this_month.month + months_ahead - 1) // 12,
+                    (this_month.month + months_ahead - 1) % 12 + 1, 1)
+        created = []
+        while month <= last:
+            following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+            name = f"visitors_{month:%Y_%m}"
+            if name not in existing:
+                with self.transaction():
+                    cursor.execute(f"CREATE TABLE {name} (LIKE visitors INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+                    cursor.execute(f"""
+                        WITH moved AS (
+                            DELETE FROM visitors_default WHERE entry_time >= %s AND entry_time < %s RETURNING *
+                        )
+                        INSERT INTO {name} SELECT * FROM moved
+                    """, (month, following))
+                    cursor.execute(f"ALTER TABLE visitors ATTACH PARTITION {name} "
+                                   f"FOR VALUES FROM ('{month}') TO ('{following}')")
+                created.append(name)
+            month = following
+        cursor.close()
+        return created
+
+    def install_complaint_sla_triggers(self, cursor):
+        cursor.execute(COMPLAINT_SLA_FUNCTIONS)
+        self.create_triggers(cursor, 'complaints', 'trg_complaints_sla', """
+            CREATE TRIGGER trg_complaints_resolved_at BEFORE INSERT OR UPDATE OF status ON complaints
+            FOR EACH ROW EXECUTE FUNCTION complaints_resolved_at();
+            CREATE TRIGGER trg_complaints_sla AFTER INSERT OR UPDATE OR DELETE ON complaints
+            FOR EACH ROW EXECUTE FUNCTION complaints_sla_track();
+        """, rebuilds="complaint_events, complaint_sla and its buckets")
+
+    def backfill_complaint_events(self):
+        # complaints from before the triggers: a 'created' event, and resolved_at where it was never set
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            INSERT INTO complaint_events (complaint_id, event_type, to_status, created_at)
+            SELECT complaint_id, 'created', status, COALESCE(created_at, CURRENT_TIMESTAMP) FROM complaints c
+            WHERE NOT EXISTS (SELECT 1 FROM complaint_events e
+                              WHERE e.complaint_id = c.complaint_id AND e.event_type = 'created')
+        """)
+        cursor.execute("""
+            UPDATE complaints SET resolved_at = COALESCE(updated_at, created_at)
+            WHERE status IN ('resolved', 'closed') AND resolved_at IS NULL
+        """)
+        cursor.close()
+
+    def rebuild_derived(self):
+        # fills every trigger-maintained table from its source, e.g. after create_tables first installed the
+        # triggers on a database with data (python database.py --rebuild). Each source is locked against
+        # writes while its tables are rebuilt, so nothing written meanwhile is counted twice or missed.
+        cursor = self.connection.cursor()
+        steps = [('bills', self.rebuild_ledger), ('bills', self.rebuild_collections),
+                 ('complaints', self.backfill_complaint_events), ('complaints', self.rebuild_complaint_sla),
+                 ('visitors', self.rebuild_visitor_rollups), ('visitors', self.rebuild_visitor_profiles)]
+        for table, rebuild in steps:
+            with self.transaction():
+                cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+                rebuild()
+        cursor.close()
+
+    def rebuild_complaint_sla(self):
+        # recomputes complaint_sla and its buckets, e.g. after the targets change
+        cursor = self.connection.cursor()
+        with self.transaction():
+            cursor.execute("TRUNCATE complaint_sla, complaint_sla_buckets")
+            cursor.execute("""
+                INSERT INTO complaint_sla
+                SELECT c.complaint_id, c.category, c.priority, c.created_at, r.first_response_at, c.resolved_at,
+                       EXTRACT(EPOCH FROM r.first_response_at - c.created_at) / 60,
+                       EXTRACT(EPOCH FROM c.resolved_at - c.created_at) / 60,
+                       COALESCE(r.first_response_at - c.created_at > t.response_hours * INTERVAL '1 hour', FALSE),
+                       COALESCE(c.resolved_at - c.created_at > t.resolve_hours * INTERVAL '1 hour', FALSE)
+                FROM complaints c
+                LEFT JOIN complaint_sla_targets t ON t.priority = c.priority
+                CROSS JOIN LATERAL (
+                    SELECT COALESCE(
+                        (SELECT MIN(e.created_at) FROM complaint_events e
+                         WHERE e.complaint_id = c.complaint_id AND e.event_type <> 'created'),
+                        CASE WHEN c.status <> 'open' OR COALESCE(c.admin_response, '') <> ''
+                             THEN COALESCE(LEAST(c.updated_at, c.resolved_at), c.created_at) END
+                    ) AS first_response_at
+                ) r
+                WHERE c.created_at IS NOT NULL
+            """)
+            cursor.execute("""
+                INSERT INTO complaint_sla_buckets (category, priority, metric, bucket, breached, complaints)
+                SELECT s.category, s.priority, m.metric, complaint_sla_bucket(m.minutes), m.breached, COUNT(*)
+                FROM complaint_sla s
+                CROSS JOIN LATERAL (VALUES ('response', s.response_minutes, s.response_breached),
+                                           ('resolve', s.resolve_minutes, s.resolve_breached)) AS m (metric, minutes, breached)
+                WHERE m.minutes IS NOT NULL
+                GROUP BY 1, 2, 3, 4, 5
+            """)
+        cursor.close()
+
+    def rebuild_collections(self):
+        # recreates collection_daily from the bills table (a bill's payments all count on its last payment date)
+        cursor = self.connection.cursor()
+        with self.transaction():
+            cursor.execute("TRUNCATE collection_daily")
+            cursor.execute("INSERT INTO collection_daily (day, bill_type, block, billed, bill_count, collected) "
+                           "SELECT day, bill_type, block, SUM(billed), SUM(bills), SUM(collected) FROM ("
+                           + BILLED_ROWS.format(sign=1, table="bills") + " UNION ALL "
+                           + COLLECTED_ROWS.format(sign=1, table="bills")
+                           + ") c (day, bill_type, block, billed, bills, collected) GROUP BY day, bill_type, block")
+        cursor.close()
+
+    def rebuild_ledger(self):
+        # recreates ledger_entries and flat_balances from the bills table
+        cursor = self.connection.cursor()
+        with self.transaction():
+            cursor.execute("TRUNCATE ledger_entries, flat_balances")
+            cursor.execute("""
+                INSERT INTO ledger_entries (flat_number, entry_type, amount, bill_id, description, created_at)
+                SELECT flat_number, 'charge', amount, bill_id, bill_type, COALESCE(created_at, due_date)
+                FROM bills
+                UNION ALL
+                SELECT flat_number, 'payment', -amount_paid, bill_id, bill_type || ' paid',
+                       COALESCE(paid_at, payment_date, created_at, due_date)
+                FROM bills WHERE amount_paid <> 0
+                ORDER BY 6
+            """)
+            cursor.execute("""
+                INSERT INTO flat_balances (flat_number, pending_amount, overdue_amount, paid_amount, bill_count)
+                SELECT flat_number,
+                       COALESCE(SUM(amount - amount_paid) FILTER (WHERE payment_status = 'pending'), 0),
+                       COALESCE(SUM(amount - amount_paid) FILTER (WHERE payment_status = 'overdue'), 0),
+                       COALESCE(SUM(amount_paid), 0),
+                       COUNT(*)
+                FROM bills GROUP BY flat_number
+                ON CONFLICT (flat_number) DO UPDATE SET
+                    pending_amount = EXCLUDED.pending_amount, overdue_amount = EXCLUDED.overdue_amount,
+                    paid_amount = EXCLUDED.paid_amount, bill_count = EXCLUDED.bill_count
+            """)
+        cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        # groups statements into one transaction on the (normally autocommit) connection
+        if not self.connection.autocommit:
+            yield  # already inside a transaction; the outer block commits
+            return
+        self.connection.autocommit = False
+        try:
+            yield
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.connection.autocommit = True
+
     def create_default_admin(self):
         cursor = self.connection.cursor()
         
@@ -267,7 +1351,8 @@ class Database:
         cursor.close()
         return {'username': username, 'initial_password': initial_password, 'user_id': user_id}
     
-    def get_society_stats(self):
+    def get_society_stats(self, breakdowns=True):
+        # breakdowns=False skips the per-status groupings (the admin dashboard reads them from analytics_store)
         cursor = self.connection.cursor()
         stats = {}
         cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'owner'")
@@ -282,10 +1367,11 @@ class Database:
         stats['open_complaints'] = cursor.fetchone()[0]
         cursor.execute("SELECT COUNT(*) FROM visitors WHERE status = 'in'")
         stats['current_visitors'] = cursor.fetchone()[0]
-        cursor.execute("SELECT payment_status, COUNT(*) FROM bills GROUP BY payment_status")
-        stats['bill_stats'] = [{'payment_status': r[0], 'count': r[1]} for r in cursor.fetchall()]
-        cursor.execute("SELECT status, COUNT(*) FROM complaints GROUP BY status")
-        stats['complaint_stats'] = [{'status': r[0], 'count': r[1]} for r in cursor.fetchall()]
+        if breakdowns:
+            cursor.execute("SELECT payment_status, COUNT(*) FROM bills GROUP BY payment_status")
+            stats['bill_stats'] = [{'payment_status': r[0], 'count': r[1]} for r in cursor.fetchall()]
+            cursor.execute("SELECT status, COUNT(*) FROM complaints GROUP BY status")
+            stats['complaint_stats'] = [{'status': r[0], 'count': r[1]} for r in cursor.fetchall()]
         cursor.close()
         return stats
     
@@ -316,13 +1402,61 @@ class Database:
         
         return bills
     
-    def pay_bill(self, bill_id, payment_method):
+    def pay_bill(self, bill_id, payment_method, amount=None, idempotency_key=None, created_by=None, gateway_ref=None):
+        # records one payment (the outstanding amount when amount is None, capped at it otherwise);
+        # a repeated idempotency_key returns the first payment with 'duplicate': True
+        idempotency_key = idempotency_key or f"{payment_method}:{bill_id}:{secrets.token_hex(8)}"
         cursor = self.connection.cursor()
-        
-        cursor.execute("UPDATE bills SET payment_status = 'paid', payment_date = CURRENT_DATE, payment_method = %s WHERE bill_id = %s", (payment_method, bill_id))
-        
+        cursor.execute("""
+            WITH bill AS (
+                SELECT bill_id, flat_number, amount - amount_paid AS due
+                FROM bills WHERE bill_id = %(bill_id)s AND payment_status <> 'paid'
+                FOR UPDATE
+            ),
+            payment AS (
+                INSERT INTO payments (bill_id, flat_number, amount, payment_method, idempotency_key, gateway_ref, created_by)
+                SELECT bill_id, flat_number, LEAST(COALESCE(%(amount)s, due), due), %(method)s, %(key)s, %(ref)s, %(created_by)s
+                FROM bill WHERE LEAST(COALESCE(%(amount)s, due), due) > 0
+                ON CONFLICT (idempotency_key) DO NOTHING
+                RETURNING payment_id, bill_id, amount
+            ),
+            paid AS (
+                UPDATE bills b SET
+                    amount_paid = b.amount_paid + p.amount,
+                    payment_status = CASE WHEN b.amount_paid + p.amount >= b.amount THEN 'paid' ELSE b.payment_status END,
+                    payment_date = CURRENT_DATE, payment_method = %(method)s,
+                    paid_at = CASE WHEN b.amount_paid + p.amount >= b.amount THEN CURRENT_TIMESTAMP ELSE b.paid_at END
+                FROM payment p WHERE b.bill_id = p.bill_id
+                RETURNING b.payment_status
+            )
+            SELECT p.payment_id, p.amount, paid.payment_status FROM payment p, paid
+        """, {'bill_id': bill_id, 'amount': amount, 'method': payment_method, 'key': idempotency_key,
+              'ref': gateway_ref, 'created_by': created_by})
+        row = cursor.fetchone()
+        duplicate = False
+        if row is None:
+            cursor.execute("""
+                SELECT p.payment_id, p.amount, b.payment_status FROM payments p JOIN bills b ON b.bill_id = p.bill_id
+                WHERE p.idempotency_key = %s
+            """, (idempotency_key,))
+            row = cursor.fetchone()
+            duplicate = row is not None
         cursor.close()
-        return True
+        if row is None:
+            return None  # no such bill, or nothing left to pay
+        return {'payment_id': row[0], 'bill_id': bill_id, 'amount': row[1], 'payment_status': row[2],
+                'duplicate': duplicate}
+
+    def get_bill_payments(self, bill_id):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT payment_id, amount, payment_method, gateway_ref, created_at
+            FROM payments WHERE bill_id = %s ORDER BY payment_id
+        """, (bill_id,))
+        payments = [{'payment_id': r[0], 'amount': r[1], 'payment_method': r[2], 'gateway_ref': r[3],
+                     'created_at': r[4]} for r in cursor.fetchall()]
+        cursor.close()
+        return payments
     
     def get_user_complaints(self, user_id):
         cursor = self.connection.cursor()
@@ -349,6 +1483,46 @@ class Database:
         
         return complaints
     
+    def search_complaints(self, query=None, status=None, category=None, priority=None, flat_number=None,
+                          limit=20, offset=0):
+        # ranked full-text matches (title over description over response), newest first without a query;
+        # returns (complaints, has_more). Highlights are only computed for the page returned.
+        query = (query or "").strip() or None
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            WITH page AS (
+                SELECT complaint_id, user_id, flat_number, title, description, category, priority,
+                       status, created_at, resolved_at, admin_response, updated_at,
+                       CASE WHEN %(q)s::text IS NULL THEN NULL
+                            ELSE ts_rank_cd(search_vector, websearch_to_tsquery('english', %(q)s)) END AS rank
+                FROM complaints
+                WHERE (%(q)s::text IS NULL OR search_vector @@ websearch_to_tsquery('english', %(q)s))
+                  AND (%(status)s::varchar IS NULL OR status = %(status)s)
+                  AND (%(category)s::varchar IS NULL OR category = %(category)s)
+                  AND (%(priority)s::varchar IS NULL OR priority = %(priority)s)
+                  AND (%(flat)s::varchar IS NULL OR flat_number ILIKE '%%' || %(flat)s || '%%')
+                ORDER BY rank DESC NULLS LAST, created_at DESC, complaint_id DESC
+                LIMIT %(limit)s OFFSET %(offset)s
+            )
+            SELECT page.*,
+                   CASE WHEN %(q)s::text IS NULL THEN NULL
+                        ELSE ts_headline('english', description, websearch_to_tsquery('english', %(q)s),
+                                         'StartSel=**, StopSel=**, MaxWords=35, MinWords=15, MaxFragments=2') END,
+                   CASE WHEN %(q)s::text IS NULL THEN NULL
+                        ELSE ts_headline('english', title, websearch_to_tsquery('english', %(q)s),
+                                         'StartSel=**, StopSel=**, HighlightAll=true') END
+            FROM page
+            ORDER BY rank DESC NULLS LAST, created_at DESC, complaint_id DESC
+        """, {'q': query, 'status': status, 'category': category, 'priority': priority,
+              'flat': flat_number, 'limit': limit + 1, 'offset': offset})
+        complaints = [{'complaint_id': r[0], 'user_id': r[1], 'flat_number': r[2], 'title': r[3],
+                       'description': r[4], 'category': r[5], 'priority': r[6], 'status': r[7],
+                       'created_at': r[8], 'resolved_at': r[9], 'admin_response': r[10], 'updated_at': r[11],
+                       'rank': r[12], 'snippet': r[13], 'title_highlight': r[14]}
+                      for r in cursor.fetchall()]
+        cursor.close()
+        return complaints[:limit], len(complaints) > limit
+
     def create_complaint(self, user_id, flat_number, title, description, category, priority):
         cursor = self.connection.cursor()
         
@@ -363,35 +1537,41 @@ class Database:
         return complaint_id
     
     def get_unread_notifications(self, user_id):
-        # get notifications user hasn't read yet
+        # notifications addressed to this user that they haven't read yet
         cursor = self.connection.cursor()
-        
-        # fetch all notifications
-        cursor.execute("SELECT * FROM notifications ORDER BY created_at DESC")
-        all_notifications = cursor.fetchall()
-        
-        # get list of already read notifications
-        cursor.execute("SELECT notification_id FROM notification_reads WHERE user_id = %s", (user_id,))
-        read_notifications = cursor.fetchall()
-        read_ids = [row[0] for row in read_notifications]
-        
+        cursor.execute(f"""
+            SELECT n.notification_id, n.title, n.message, n.created_by, n.created_at, n.type
+            FROM users u
+            JOIN notifications n ON {NOTIFICATION_AUDIENCE}
+            WHERE u.user_id = %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM notification_reads r
+                  WHERE r.notification_id = n.notification_id AND r.user_id = u.user_id
+              )
+            ORDER BY n.created_at DESC
+        """, (user_id,))
+        unread = [{'notification_id': r[0], 'title': r[1], 'message': r[2], 'created_by': r[3],
+                   'created_at': r[4], 'type': r[5] or 'general'} for r in cursor.fetchall()]
         cursor.close()
-        
-        # filter out the read ones
-        unread = []
-        for notif in all_notifications:
-            if notif[0] not in read_ids:
-                unread.append({
-                    'notification_id': notif[0],
-                    'title': notif[1],
-                    'message': notif[2],
-                    'created_by': notif[3],
-                    'created_at': notif[4],
-                    'type': notif[5] if len(notif) > 5 else 'general'
-                })
-        
         return unread
-    
+
+    def get_notifications_for_user(self, user_id, limit=20):
+        # latest notifications addressed to this user, with their read receipt
+        cursor = self.connection.cursor()
+        cursor.execute(f"""
+            SELECT n.notification_id, n.title, n.message, n.created_at, r.read_at
+            FROM users u
+            JOIN notifications n ON {NOTIFICATION_AUDIENCE}
+            LEFT JOIN notification_reads r ON r.notification_id = n.notification_id AND r.user_id = u.user_id
+            WHERE u.user_id = %s
+            ORDER BY n.created_at DESC
+            LIMIT %s
+        """, (user_id, limit))
+        notifications = [{'notification_id': r[0], 'title': r[1], 'message': r[2], 'created_at': r[3],
+                          'read_at': r[4]} for r in cursor.fetchall()]
+        cursor.close()
+        return notifications
+
     def mark_notification_read(self, notification_id, user_id):
         cursor = self.connection.cursor()
         
@@ -399,16 +1579,387 @@ class Database:
         
         cursor.close()
         return True
-    
+
+    def create_notification(self, title, message, created_by, priority='normal', audience='all', audience_value=None):
+        # one row whatever the audience size; returns (notification_id, number of users it reaches)
+        if audience == 'all':
+            audience_value = None
+        elif not audience_value:
+            raise ValueError(f"A {audience} notification needs a {audience} value")
+        cursor = self.connection.cursor()
+        cursor.execute(f"""
+            WITH n AS (
+                INSERT INTO notifications (title, message, created_by, priority, audience, audience_value)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING notification_id, audience, audience_value
+            )
+            SELECT n.notification_id, (SELECT COUNT(*) FROM users u WHERE {NOTIFICATION_AUDIENCE}) FROM n
+        """, (title, message, created_by, priority, audience, audience_value))
+        notification_id, recipients = cursor.fetchone()
+        cursor.close()
+        return notification_id, recipients
+
     def create_notification_for_flat(self, flat_number, title, message, created_by, priority='normal'):
+        # only the owner and tenant of that flat see it
+        return self.create_notification(title, message, created_by, priority, 'flat', flat_number)
+
+    def get_unread_notification_count(self, user_id):
         cursor = self.connection.cursor()
-        cursor.execute("INSERT INTO notifications (title, message, created_by) VALUES (%s, %s, %s) RETURNING notification_id", (title, message, created_by))
-        
-        notification_id = cursor.fetchone()[0]
+        cursor.execute(f"""
+            SELECT COUNT(*)
+            FROM users u
+            JOIN notifications n ON {NOTIFICATION_AUDIENCE}
+            WHERE u.user_id = %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM notification_reads r
+                  WHERE r.notification_id = n.notification_id AND r.user_id = u.user_id
+              )
+        """, (user_id,))
+        count = cursor.fetchone()[0]
         cursor.close()
-        
-        return notification_id, 1
+        return count
+
+    def cast_vote(self, poll_id, option_id, user_id):
+        # vote and counter update in one statement; False if already voted or option not in this poll
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            WITH vote AS (
+                INSERT INTO votes (poll_id, option_id, user_id)
+                SELECT %s, option_id, %s FROM poll_options WHERE option_id = %s AND poll_id = %s
+                ON CONFLICT (poll_id, user_id) DO NOTHING
+                RETURNING option_id
+            )
+            UPDATE poll_options SET vote_count = COALESCE(vote_count, 0) + 1
+            WHERE option_id IN (SELECT option_id FROM vote)
+            RETURNING option_id
+        """, (poll_id, user_id, option_id, poll_id))
+        voted = cursor.fetchone() is not None
+        cursor.close()
+        return voted
+
+    def get_poll_options(self, poll_ids):
+        # options of several polls in one query, keyed by poll_id, in ballot order (results sort by votes themselves)
+        if not poll_ids:
+            return {}
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT poll_id, option_id, option_text, COALESCE(vote_count, 0)
+            FROM poll_options
+            WHERE poll_id = ANY(%s)
+            ORDER BY poll_id, option_id
+        """, (list(poll_ids),))
+        options = {}
+        for row in cursor.fetchall():
+            options.setdefault(row[0], []).append({'option_id': row[1], 'option_text': row[2], 'vote_count': row[3]})
+        cursor.close()
+        return options
+
+    def get_user_votes(self, user_id, poll_ids):
+        # {poll_id: option_text} for the polls this user voted in
+        if not poll_ids:
+            return {}
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT v.poll_id, po.option_text
+            FROM votes v
+            JOIN poll_options po ON v.option_id = po.option_id
+            WHERE v.user_id = %s AND v.poll_id = ANY(%s)
+        """, (user_id, list(poll_ids)))
+        votes = dict(cursor.fetchall())
+        cursor.close()
+        return votes
+
+    def get_flat_bill_totals(self, flat_number):
+        # one row of flat_balances, kept current by the bills triggers
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT balance, pending_amount, overdue_amount, paid_amount, bill_count
+            FROM flat_balances WHERE flat_number = %s
+        """, (flat_number,))
+        row = cursor.fetchone() or (0, 0, 0, 0, 0)
+        cursor.close()
+        return {'balance': row[0], 'pending': row[1], 'overdue': row[2], 'paid': row[3], 'bill_count': row[4]}
+
+    def get_user_bills_page(self, flat_number, status=None, bill_type=None, limit=20, offset=0):
+        # newest first; returns (bills, has_more)
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT bill_id, flat_number, bill_type, amount, due_date, payment_status, created_at,
+                   payment_date, payment_method, amount_paid
+            FROM bills
+            WHERE flat_number = %s
+              AND (%s::varchar IS NULL OR payment_status = %s)
+              AND (%s::varchar IS NULL OR bill_type = %s)
+            ORDER BY created_at DESC, bill_id DESC
+            LIMIT %s OFFSET %s
+        """, (flat_number, status, status, bill_type, bill_type, limit + 1, offset))
+        bills = [{'bill_id': r[0], 'flat_number': r[1], 'bill_type': r[2], 'amount': r[3], 'due_date': r[4],
+                  'payment_status': r[5], 'created_at': r[6], 'payment_date': r[7], 'payment_method': r[8],
+                  'amount_paid': r[9]}
+                 for r in cursor.fetchall()]
+        cursor.close()
+        return bills[:limit], len(bills) > limit
+
+    def get_ledger_page(self, flat_number, limit=20, offset=0):
+        # newest first, with the balance after each entry worked back from the current balance
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT e.entry_id, e.entry_type, e.amount, e.bill_id, e.description, e.created_at,
+                   COALESCE(b.balance, 0) - COALESCE(SUM(e.amount) OVER (
+                       ORDER BY e.entry_id DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0)
+            FROM ledger_entries e
+            LEFT JOIN flat_balances b ON b.flat_number = e.flat_number
+            WHERE e.flat_number = %s
+            ORDER BY e.entry_id DESC
+            LIMIT %s OFFSET %s
+        """, (flat_number, limit + 1, offset))
+        entries = [{'entry_id': r[0], 'entry_type': r[1], 'amount': r[2], 'bill_id': r[3], 'description': r[4],
+                    'created_at': r[5], 'balance_after': r[6]} for r in cursor.fetchall()]
+        cursor.close()
+        return entries[:limit], len(entries) > limit
+
+    def get_collection_trends(self, grain='month', by=None, since=None):
+        # billed vs collected per week/month from collection_daily, optionally per bill type or block
+        if grain not in ('week', 'month'):
+            raise ValueError("grain must be 'week' or 'month'")
+        group = {None: "'All'", 'bill_type': "bill_type", 'block': "block"}[by]
+        cursor = self.connection.cursor()
+        cursor.execute(f"""
+            SELECT date_trunc(%s, day)::date AS period, {group} AS grp,
+                   SUM(billed), SUM(collected), SUM(bill_count)
+            FROM collection_daily
+            WHERE day >= COALESCE(%s, '-infinity'::date) AND day <= CURRENT_DATE
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+        """, (grain, since))
+        trends = [{'period': r[0], 'group': r[1], 'billed': r[2], 'collected': r[3], 'bills': r[4],
+                   'collection_rate': float(r[3] / r[2] * 100) if r[2] else None} for r in cursor.fetchall()]
+        cursor.close()
+        return trends
+
+    def get_bill(self, bill_id):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT bill_id, flat_number, bill_type, amount, due_date, payment_status, payment_date, payment_method,
+                   amount_paid
+            FROM bills WHERE bill_id = %s
+        """, (bill_id,))
+        b = cursor.fetchone()
+        cursor.close()
+        if not b:
+            return None
+        return {'bill_id': b[0], 'flat_number': b[1], 'bill_type': b[2], 'amount': b[3], 'due_date': b[4],
+                'payment_status': b[5], 'payment_date': b[6], 'payment_method': b[7], 'amount_paid': b[8]}
 
+    def create_api_token(self, user_id, days_valid=30):
+        token = secrets.token_urlsafe(32)
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        cursor = self.connection.cursor()
+        cursor.execute("INSERT INTO api_tokens (token_hash, user_id, expires_at) VALUES (%s, %s, %s)",
+                       (token_hash, user_id, datetime.now() + timedelta(days=days_valid)))
+        cursor.close()
+        return token
+
+    def get_user_by_api_token(self, token):
+        # looks the token up and stamps last_used_at in the same statement
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE api_tokens t SET last_used_at = CURRENT_TIMESTAMP
+            FROM users u
+            WHERE t.token_hash = %s AND u.user_id = t.user_id
+              AND (t.expires_at IS NULL OR t.expires_at > CURRENT_TIMESTAMP)
+            RETURNING u.user_id, u.username, u.role, u.flat_number, u.name
+        """, (token_hash,))
+        u = cursor.fetchone()
+        cursor.close()
+        if not u:
+            return None
+        return {'user_id': u[0], 'username': u[1], 'role': u[2], 'flat_number': u[3], 'name': u[4]}
+
+    def revoke_api_token(self, token):
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM api_tokens WHERE token_hash = %s", (token_hash,))
+        affected_rows = cursor.rowcount
+        cursor.close()
+        return affected_rows > 0
+
+    def request_visitor_approval(self, flat_number, visitor_name, visitor_phone=None, purpose=None,
+                                 vehicle_number=None, requested_by=None, visitor_photo=None):
+        # the trigger notifies the flat's open sessions when this commits
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            INSERT INTO visitor_approvals (flat_number, visitor_name, visitor_phone, purpose, vehicle_number,
+                                           requested_by, visitor_photo)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING approval_id
+        """, (flat_number, visitor_name, visitor_phone or None, purpose or None, vehicle_number or None,
+              requested_by, visitor_photo))
+        approval_id = cursor.fetchone()[0]
+        cursor.close()
+        return approval_id
+
+    def decide_visitor_approval(self, approval_id, approve, decided_by, flat_number=None):
+        """Approves (logging the entry) or denies a pending request; flat_number limits it to that flat.
+
+        Returns the decided request as a dict, or None if it was already decided or cancelled.
+        """
+        with self.transaction():
+            cursor = self.connection.cursor()
+            cursor.execute("""
+                SELECT approval_id, flat_number, visitor_name, visitor_phone, purpose, vehicle_number, requested_by,
+                       visitor_photo
+                FROM visitor_approvals
+                WHERE approval_id = %s AND status = 'pending' AND (%s::varchar IS NULL OR flat_number = %s)
+                FOR UPDATE
+            """, (approval_id, flat_number, flat_number))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.close()
+                return None
+            approval = {'approval_id': row[0], 'flat_number': row[1], 'visitor_name': row[2], 'visitor_phone': row[3],
+                        'purpose': row[4], 'vehicle_number': row[5], 'status': 'approved' if approve else 'denied',
+                        'visitor_id': None}
+            if approve:
+                approval['visitor_id'] = self.log_visitor_with_photo(
+                    row[1], row[2], visitor_phone=row[3], purpose=row[4], vehicle_number=row[5],
+                    logged_by=row[6], visitor_photo=row[7])
+            # one status change, so the gate gets one notification, with the visitor_id in it
+            cursor.execute("""
+                UPDATE visitor_approvals SET status = %s, decided_by = %s, decided_at = CURRENT_TIMESTAMP,
+                                             visitor_id = %s
+                WHERE approval_id = %s
+            """, (approval['status'], decided_by, approval['visitor_id'], approval_id))
+            cursor.close()
+        return approval
+
+    def cancel_visitor_approval(self, approval_id):
+        # the gate withdraws a request nobody answered
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE visitor_approvals SET status = 'cancelled', decided_at = CURRENT_TIMESTAMP
+            WHERE approval_id = %s AND status = 'pending'
+        """, (approval_id,))
+        affected_rows = cursor.rowcount
+        cursor.close()
+        return affected_rows > 0
+
+    def get_visitor_approvals(self, flat_number=None, approval_ids=None, pending_only=True):
+        # without a live relay (see realtime.py) the screens fall back to this
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT approval_id, flat_number, visitor_name, purpose, status, visitor_id, requested_at, decided_at
+            FROM visitor_approvals
+            WHERE (%s::varchar IS NULL OR flat_number = %s)
+              AND (%s::int[] IS NULL OR approval_id = ANY(%s))
+              AND (NOT %s OR status = 'pending')
+            ORDER BY approval_id
+        """, (flat_number, flat_number, approval_ids, approval_ids, pending_only))
+        approvals = [{'approval_id': r[0], 'flat_number': r[1], 'visitor_name': r[2], 'purpose': r[3], 'status': r[4],
+                      'visitor_id': r[5], 'requested_at': r[6], 'decided_at': r[7]} for r in cursor.fetchall()]
+        cursor.close()
+        return approvals
+
+    @staticmethod
+    def pass_code_hash(code):
+        # case, spaces and dashes don't matter, so "abcd efgh" and a scanned "ABCD-EFGH" are the same code
+        normalized = ''.join(c for c in (code or '').upper() if c.isalnum())
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def create_visitor_pass(self, flat_number, created_by, visitor_name, valid_from, valid_until, visitor_phone=None,
+                            purpose=None, vehicle_number=None, max_uses=1):
+        """Creates a guest pass; returns (pass_id, code). The code is only available here."""
+        cursor = self.connection.cursor()
+        try:
+            while True:
+                code = ''.join(secrets.choice(PASS_CODE_ALPHABET) for _ in range(PASS_CODE_LENGTH))
+                cursor.execute("""
+                    INSERT INTO visitor_passes (code_hash, flat_number, created_by, visitor_name, visitor_phone,
+                                                purpose, vehicle_number, valid_from, valid_until, max_uses)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (code_hash) DO NOTHING
+                    RETURNING pass_id
+                """, (self.pass_code_hash(code), flat_number, created_by, visitor_name, visitor_phone or None,
+                      purpose or None, vehicle_number or None, valid_from, valid_until, max_uses))
+                row = cursor.fetchone()
+                if row:  # else the code was taken; draw another
+                    return row[0], f"{code[:4]}-{code[4:]}"
+        finally:
+            cursor.close()
+
+    def get_visitor_passes(self, flat_number, limit=20):
+        # newest first, with whether each can still be used
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT pass_id, visitor_name, visitor_phone, purpose, vehicle_number, valid_from, valid_until,
+                   max_uses, uses, revoked_at, last_used_at, created_at,
+                   revoked_at IS NULL AND uses < max_uses AND valid_until > CURRENT_TIMESTAMP
+            FROM visitor_passes
+            WHERE flat_number = %s
+            ORDER BY valid_until DESC, pass_id DESC
+            LIMIT %s
+        """, (flat_number, limit))
+        passes = [{'pass_id': r[0], 'visitor_name': r[1], 'visitor_phone': r[2], 'purpose': r[3],
+                   'vehicle_number': r[4], 'valid_from': r[5], 'valid_until': r[6], 'max_uses': r[7], 'uses': r[8],
+                   'revoked_at': r[9], 'last_used_at': r[10], 'created_at': r[11], 'active': r[12]}
+                  for r in cursor.fetchall()]
+        cursor.close()
+        return passes
+
+    def revoke_visitor_pass(self, pass_id, flat_number):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE visitor_passes SET revoked_at = CURRENT_TIMESTAMP
+            WHERE pass_id = %s AND flat_number = %s AND revoked_at IS NULL
+        """, (pass_id, flat_number))
+        affected_rows = cursor.rowcount
+        cursor.close()
+        return affected_rows > 0
+
+    def use_visitor_pass(self, code, logged_by=None, visitor_photo=None):
+        """Checks a guest pass code at the gate and logs the visitor's entry.
+
+        The code is looked up by its hash and a use is taken in one UPDATE, so two gates can't both
+        admit a single-use pass. Returns the pass as a dict with the new visitor_id; raises ValueError
+        with the reason when the code is unknown, revoked, used up or outside its time window.
+        """
+        code_hash = self.pass_code_hash(code)
+        with self.transaction():
+            cursor = self.connection.cursor()
+            cursor.execute("""
+                UPDATE visitor_passes SET uses = uses + 1, last_used_at = CURRENT_TIMESTAMP
+                WHERE code_hash = %s AND revoked_at IS NULL AND uses < max_uses
+                  AND CURRENT_TIMESTAMP BETWEEN valid_from AND valid_until
+                RETURNING pass_id, flat_number, visitor_name, visitor_phone, purpose, vehicle_number, uses, max_uses,
+                          valid_until
+            """, (code_hash,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("""
+                    SELECT revoked_at, uses >= max_uses, valid_from > CURRENT_TIMESTAMP, valid_from
+                    FROM visitor_passes WHERE code_hash = %s
+                """, (code_hash,))
+                reason = cursor.fetchone()
+                cursor.close()
+                if reason is None:
+                    raise ValueError("Unknown pass code")
+                if reason[0]:
+                    raise ValueError("This pass was cancelled by the resident")
+                if reason[1]:
+                    raise ValueError("This pass has already been used")
+                if reason[2]:
+                    raise ValueError(f"This pass is valid from {reason[3]:%d %b %Y %H:%M}")
+                raise ValueError("This pass has expired")
+            cursor.close()
+            guest_pass = {'pass_id': row[0], 'flat_number': row[1], 'visitor_name': row[2], 'visitor_phone': row[3],
+                          'purpose': row[4], 'vehicle_number': row[5], 'uses': row[6], 'max_uses': row[7],
+                          'valid_until': row[8]}
+            guest_pass['visitor_id'] = self.log_visitor_with_photo(
+                guest_pass['flat_number'], guest_pass['visitor_name'], visitor_phone=guest_pass['visitor_phone'],
+                purpose=guest_pass['purpose'] or "Guest pass", vehicle_number=guest_pass['vehicle_number'],
+                logged_by=logged_by, visitor_photo=visitor_photo)
+        return guest_pass
 
     def delete_bill(self, bill_id):
         cursor = self.connection.cursor()
@@ -448,26 +1999,420 @@ class Database:
         cursor.close()
         return True
 
-    def delete_visitor(self, visitor_id):
+    def delete_visitor(self, visitor_id, entry_time=None):
+        match, params = visitor_match(visitor_id, entry_time)
         cursor = self.connection.cursor()
-        cursor.execute("DELETE FROM visitors WHERE visitor_id = %s", (visitor_id,))
+        cursor.execute(f"DELETE FROM visitors WHERE {match}", params)
         affected_rows = cursor.rowcount
         cursor.close()
         return affected_rows > 0
 
     def log_visitor_with_photo(self, flat_number, visitor_name, visitor_phone=None, 
                               purpose=None, vehicle_number=None, logged_by=None, visitor_photo=None):
-        cursor = self.connection.cursor()
-        cursor.execute("INSERT INTO visitors (flat_number, visitor_name, visitor_phone, purpose, vehicle_number, logged_by, visitor_photo) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING visitor_id", (flat_number, visitor_name, visitor_phone, purpose, vehicle_number, logged_by, visitor_photo))
-        
-        visitor_id = cursor.fetchone()[0]
-        cursor.close()
-        
-        message = f"Visitor {visitor_name} arrived at Flat {flat_number}"
-        self.create_notification_for_flat(flat_number, "New Visitor", message, logged_by if logged_by else 1)
+        with self.transaction():
+            cursor = self.connection.cursor()
+            # without a new photo, a known phone number reuses the photo on its profile
+            cursor.execute(f"""
+                INSERT INTO visitors (flat_number, visitor_name, visitor_phone, purpose, vehicle_number, logged_by, visitor_photo)
+                VALUES (%(flat)s, %(name)s, %(phone)s, %(purpose)s, %(vehicle)s, %(logged_by)s, COALESCE(%(photo)s, (
+                    SELECT visitor_photo FROM visitor_profiles
+                    WHERE phone_key = {VISITOR_PROFILE_KEY.format(phone="%(phone)s")}
+                )))
+                RETURNING visitor_id, entry_time
+            """, {'flat': flat_number, 'name': visitor_name, 'phone': visitor_phone, 'purpose': purpose,
+                  'vehicle': vehicle_number, 'logged_by': logged_by, 'photo': visitor_photo})
+            
+            visitor_id, entry_time = cursor.fetchone()
+            cursor.close()
+            
+            # the notification and photo resize are done by the background worker
+            self.enqueue_job('visitor_notification', {'visitor_id': visitor_id, 'flat_number': flat_number,
+                                                      'visitor_name': visitor_name, 'logged_by': logged_by or 1},
+                             dedupe_key=f"visitor_notification:{visitor_id}")
+            if visitor_photo:
+                self.enqueue_job('photo_processing', {'visitor_id': visitor_id, 'entry_time': entry_time.isoformat()},
+                                 dedupe_key=f"photo_processing:{visitor_id}")
         
         return visitor_id
 
+    def checkout_visitor(self, visitor_id, entry_time=None):
+        # without entry_time, idx_visitors_in_id keeps the probe of each month to its visitors still inside
+        match, params = visitor_match(visitor_id, entry_time)
+        cursor = self.connection.cursor()
+        cursor.execute(f"""
+            UPDATE visitors SET status = 'out', exit_time = CURRENT_TIMESTAMP
+            WHERE {match} AND status = 'in'
+            RETURNING exit_time
+        """, params)
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def get_allotted_flat_numbers(self):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT DISTINCT flat_number FROM users WHERE flat_number IS NOT NULL AND role IN ('owner', 'tenant') ORDER BY flat_number")
+        flats = [f[0] for f in cursor.fetchall()]
+        cursor.close()
+        return flats
+
+    def sync_visitor_batch(self, entries, checkouts, logged_by):
+        """Applies a batch of offline kiosk entries and checkouts.
+
+        entries: dicts with client_ref, flat_number, visitor_name, visitor_phone, purpose,
+        vehicle_number, visitor_photo, entry_time. checkouts: dicts with op_id, client_ref or
+        visitor_id, exit_time. Safe to re-send: known client_refs are skipped and a visitor
+        already checked out on the server keeps the server's exit (reported as a conflict).
+        """
+        cursor = self.connection.cursor()
+        result = {'visitor_ids': {}, 'inserted': 0, 'checked_out': [], 'conflicts': [], 'missing': []}
+
+        if entries:
+            inserted = psycopg2.extras.execute_values(cursor, """
+                INSERT INTO visitors (client_ref, flat_number, visitor_name, visitor_phone, purpose,
+                                      vehicle_number, visitor_photo, entry_time, logged_by)
+                VALUES %s
+                ON CONFLICT (client_ref, entry_time) DO NOTHING
+                RETURNING visitor_id, flat_number, visitor_name
+            """, [(e['client_ref'], e['flat_number'], e['visitor_name'], e.get('visitor_phone'), e.get('purpose'),
+                   e.get('vehicle_number'), e.get('visitor_photo'), e['entry_time'], logged_by) for e in entries],
+                fetch=True)
+            result['inserted'] = len(inserted)
+
+            # same notification jobs log_visitor_with_photo enqueues, one multi-row insert for the batch
+            if inserted:
+                psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO jobs (job_type, payload, dedupe_key) VALUES %s
+                    ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+                """, [('visitor_notification',
+                       psycopg2.extras.Json({'visitor_id': vid, 'flat_number': flat, 'visitor_name': name,
+                                             'logged_by': logged_by}),
+                       f"visitor_notification:{vid}") for vid, flat, name in inserted])
+
+            cursor.execute("SELECT client_ref, visitor_id FROM visitors WHERE client_ref = ANY(%s)",
+                           ([e['client_ref'] for e in entries],))
+            result['visitor_ids'] = dict(cursor.fetchall())
+
+        if checkouts:
+            rows = psycopg2.extras.execute_values(cursor, """
+                WITH c (op_id, client_ref, visitor_id, exit_time) AS (VALUES %s),
+                target AS (
+                    SELECT c.op_id, c.exit_time, v.visitor_id, v.status, v.entry_time
+                    FROM c JOIN visitors v ON v.client_ref = c.client_ref OR v.visitor_id = c.visitor_id
+                ),
+                updated AS (
+                    UPDATE visitors v SET status = 'out', exit_time = GREATEST(t.exit_time, v.entry_time)
+                    FROM target t
+                    WHERE v.visitor_id = t.visitor_id AND v.status = 'in'
+                    RETURNING v.visitor_id
+                )
+                SELECT t.op_id, t.visitor_id IN (SELECT visitor_id FROM updated) FROM target t
+            """, [(c['op_id'], c.get('client_ref'), c.get('visitor_id'), c['exit_time']) for c in checkouts],
+                template="(%s, %s::varchar, %s::integer, %s::timestamp)", fetch=True)
+            found = dict(rows)
+            result['checked_out'] = [op for op, applied in found.items() if applied]
+            result['conflicts'] = [op for op, applied in found.items() if not applied]
+            result['missing'] = [c['op_id'] for c in checkouts if c['op_id'] not in found]
+
+        cursor.close()
+        return result
+
+    def enqueue_job(self, job_type, payload=None, run_at=None, dedupe_key=None, max_attempts=5):
+        # returns None when a job with the same dedupe_key is already queued or running
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            INSERT INTO jobs (job_type, payload, run_at, dedupe_key, max_attempts)
+            VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s, %s)
+            ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING job_id
+        """, (job_type, psycopg2.extras.Json(payload or {}), run_at, dedupe_key, max_attempts))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def claim_job(self, worker_name):
+        # one job per claim, so locked_at is when it started and a long job never makes a queued-up one look stale;
+        # SKIP LOCKED lets several workers pull from the queue without blocking each other
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE jobs SET status = 'running', locked_by = %s, locked_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+            WHERE job_id = (
+                SELECT job_id FROM jobs
+                WHERE status = 'queued' AND run_at <= CURRENT_TIMESTAMP
+                ORDER BY run_at, job_id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING job_id, job_type, payload, attempts, max_attempts
+        """, (worker_name,))
+        j = cursor.fetchone()
+        cursor.close()
+        if j is None:
+            return None
+        return {'job_id': j[0], 'job_type': j[1], 'payload': j[2], 'attempts': j[3], 'max_attempts': j[4]}
+
+    def complete_job(self, job_id, worker_name):
+        # False when the job was requeued as stale and another worker owns it now
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE job_id = %s AND locked_by = %s
+        """, (job_id, worker_name))
+        completed = cursor.rowcount > 0
+        cursor.close()
+        return completed
+
+    def fail_job(self, job_id, worker_name, error, retry_in_seconds):
+        # back to the queue with a delay, or failed for good once attempts are used up;
+        # None when the job is no longer ours
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE jobs SET
+                status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                run_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                finished_at = CASE WHEN attempts >= max_attempts THEN CURRENT_TIMESTAMP END,
+                last_error = %s, locked_by = NULL, locked_at = NULL
+            WHERE job_id = %s AND locked_by = %s
+            RETURNING status
+        """, (retry_in_seconds, error[:2000], job_id, worker_name))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def requeue_stale_jobs(self, older_than_seconds=900):
+        # jobs left 'running' by a worker that died
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE jobs SET status = 'queued', locked_by = NULL, locked_at = NULL,
+                            last_error = 'worker stopped while running the job'
+            WHERE status = 'running' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        """, (older_than_seconds,))
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def purge_finished_jobs(self, keep_days=7):
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM jobs WHERE status = 'done' AND finished_at < CURRENT_TIMESTAMP - make_interval(days => %s)", (keep_days,))
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def retry_job(self, job_id):
+        # False when it isn't failed any more or a job with its dedupe_key is already queued or running
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE jobs SET status = 'queued', attempts = 0, run_at = CURRENT_TIMESTAMP, finished_at = NULL
+            WHERE job_id = %s AND status = 'failed'
+              AND NOT EXISTS (SELECT 1 FROM jobs j WHERE j.dedupe_key = jobs.dedupe_key
+                              AND j.status IN ('queued', 'running'))
+        """, (job_id,))
+        retried = cursor.rowcount > 0
+        cursor.close()
+        return retried
+
+    def ensure_scheduled_job(self, name, job_type, interval_seconds, first_run_at, payload=None):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            INSERT INTO scheduled_jobs (name, job_type, payload, interval_seconds, next_run_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (name) DO NOTHING
+        """, (name, job_type, psycopg2.extras.Json(payload or {}), interval_seconds, first_run_at))
+        cursor.close()
+
+    def enqueue_due_scheduled_jobs(self):
+        # advances each due schedule past now (keeping its time of day) and enqueues one job per run
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            WITH due AS (
+                UPDATE scheduled_jobs SET
+                    last_enqueued_at = CURRENT_TIMESTAMP,
+                    next_run_at = next_run_at + make_interval(secs => interval_seconds *
+                        (floor(extract(epoch FROM CURRENT_TIMESTAMP - next_run_at) / interval_seconds) + 1))
+                WHERE enabled AND next_run_at <= CURRENT_TIMESTAMP
+                RETURNING name, job_type, payload
+            )
+            INSERT INTO jobs (job_type, payload, dedupe_key)
+            SELECT job_type, payload, 'schedule:' || name FROM due
+            ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING job_type
+        """)
+        enqueued = [r[0] for r in cursor.fetchall()]
+        cursor.close()
+        return enqueued
+
+    def get_job_overview(self):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT job_type,
+                   COUNT(*) FILTER (WHERE status = 'queued'),
+                   COUNT(*) FILTER (WHERE status = 'running'),
+                   COUNT(*) FILTER (WHERE status = 'done'),
+                   COUNT(*) FILTER (WHERE status = 'failed'),
+                   MIN(run_at) FILTER (WHERE status = 'queued'),
+                   MAX(finished_at) FILTER (WHERE status = 'done')
+            FROM jobs GROUP BY job_type ORDER BY job_type
+        """)
+        by_type = [{'job_type': r[0], 'queued': r[1], 'running': r[2], 'done': r[3], 'failed': r[4],
+                    'oldest_queued': r[5], 'last_done': r[6]} for r in cursor.fetchall()]
+        cursor.execute("SELECT name, job_type, interval_seconds, next_run_at, last_enqueued_at, enabled FROM scheduled_jobs ORDER BY name")
+        schedules = [{'name': r[0], 'job_type': r[1], 'interval_seconds': r[2], 'next_run_at': r[3],
+                      'last_enqueued_at': r[4], 'enabled': r[5]} for r in cursor.fetchall()]
+        cursor.close()
+        return {'by_type': by_type, 'schedules': schedules}
+
+    def get_recent_jobs(self, status=None, limit=50):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT job_id, job_type, status, attempts, max_attempts, run_at, created_at, finished_at, last_error, payload
+            FROM jobs
+            WHERE %s IS NULL OR status = %s
+            ORDER BY job_id DESC
+            LIMIT %s
+        """, (status, status, limit))
+        jobs = [{'job_id': r[0], 'job_type': r[1], 'status': r[2], 'attempts': r[3], 'max_attempts': r[4],
+                 'run_at': r[5], 'created_at': r[6], 'finished_at': r[7], 'last_error': r[8], 'payload': r[9]}
+                for r in cursor.fetchall()]
+        cursor.close()
+        return jobs
+
+    def mark_overdue_bills_batch(self, batch_size=5000):
+        # one bounded batch so the sweep never holds locks on the whole bills table
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE bills SET payment_status = 'overdue'
+            WHERE bill_id IN (
+                SELECT bill_id FROM bills
+                WHERE payment_status = 'pending' AND due_date < CURRENT_DATE
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (batch_size,))
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def auto_checkout_visitors_batch(self, max_stay_hours=VISITOR_MAX_STAY_HOURS, batch_size=5000):
+        # closes one bounded batch of visitors nobody checked out; exit_time stays NULL because the real
+        # exit is unknown, so dwell-time figures only count actual checkouts
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            UPDATE visitors SET status = 'out', auto_checked_out_at = CURRENT_TIMESTAMP
+            WHERE visitor_id IN (
+                SELECT visitor_id FROM visitors
+                WHERE status = 'in' AND entry_time < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+                ORDER BY entry_time
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (max_stay_hours, batch_size))
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def get_visitor_overstay_summary(self, days=7):
+        # what the admin is warned about: overstaying now, and auto-checked out recently
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE status = 'in' AND entry_time < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'),
+                   (SELECT COUNT(*) FROM visitors
+                    WHERE auto_checked_out_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 day')
+            FROM visitors WHERE status = 'in'
+        """, (VISITOR_OVERSTAY_HOURS, days))
+        row = cursor.fetchone()
+        cursor.close()
+        return {'overstaying': row[0], 'auto_checked_out': row[1]}
+
+    def notify_expiring_leases(self, days_ahead=30):
+        # one notice per lease end date, to that flat; lease_notice_sent_for stops repeats on later runs
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            WITH due AS (
+                UPDATE tenants SET lease_notice_sent_for = lease_end_date
+                WHERE lease_end_date IS NOT NULL
+                  AND lease_end_date <= CURRENT_DATE + %s
+                  AND lease_notice_sent_for IS DISTINCT FROM lease_end_date
+                RETURNING flat_number, lease_end_date
+            )
+            INSERT INTO notifications (title, message, created_by, audience, audience_value)
+            SELECT 'Lease Expiry',
+                   CASE WHEN lease_end_date < CURRENT_DATE
+                        THEN 'The lease for Flat ' || flat_number || ' expired on ' || to_char(lease_end_date, 'DD-MM-YYYY')
+                        ELSE 'The lease for Flat ' || flat_number || ' ends on ' || to_char(lease_end_date, 'DD-MM-YYYY')
+                   END,
+                   (SELECT user_id FROM users WHERE role = 'admin' ORDER BY user_id LIMIT 1),
+                   'flat', flat_number
+            FROM due
+        """, (days_ahead,))
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def get_visitor_photo(self, visitor_id, entry_time=None):
+        match, params = visitor_match(visitor_id, entry_time)
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT visitor_photo FROM visitors WHERE {match}", params)
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def update_visitor_photo(self, visitor_id, visitor_photo, entry_time=None):
+        match, params = visitor_match(visitor_id, entry_time)
+        cursor = self.connection.cursor()
+        cursor.execute(f"UPDATE visitors SET visitor_photo = %s WHERE {match}", [visitor_photo] + params)
+        # the profile keeps the shrunk photo too when it was taken from this visit
+        cursor.execute("""
+            UPDATE visitor_profiles SET visitor_photo = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE photo_visitor_id = %s
+        """, (visitor_photo, visitor_id))
+        cursor.close()
+
+    def get_visitor_profile_photo(self, phone_key):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT visitor_photo FROM visitor_profiles WHERE phone_key = %s", (phone_key,))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    def get_visitor_profiles(self, since=None):
+        # profiles changed after since (all of them without), for visitor_registry.py; photos stay in the database
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT phone_key, visitor_name, visitor_phone, purpose, vehicle_number, flat_number,
+                   visitor_photo IS NOT NULL, visits, last_seen, updated_at
+            FROM visitor_profiles
+            WHERE %s::timestamp IS NULL OR updated_at > %s
+        """, (since, since))
+        profiles = [{'phone_key': r[0], 'visitor_name': r[1], 'visitor_phone': r[2], 'purpose': r[3],
+                     'vehicle_number': r[4], 'flat_number': r[5], 'has_photo': r[6], 'visits': r[7],
+                     'last_seen': r[8], 'updated_at': r[9]} for r in cursor.fetchall()]
+        cursor.close()
+        return profiles
+
+    def log_known_visitor(self, phone_key, flat_number, logged_by=None, purpose=None):
+        """Logs a repeat visitor from their profile (name, phone, vehicle and photo) in one INSERT.
+
+        Returns (visitor_id, visitor_name), or None when there is no profile for phone_key.
+        """
+        with self.transaction():
+            cursor = self.connection.cursor()
+            cursor.execute("""
+                INSERT INTO visitors (flat_number, visitor_name, visitor_phone, purpose, vehicle_number, logged_by,
+                                      visitor_photo)
+                SELECT %s, visitor_name, visitor_phone, COALESCE(NULLIF(%s, ''), purpose), vehicle_number, %s,
+                       visitor_photo
+                FROM visitor_profiles WHERE phone_key = %s
+                RETURNING visitor_id, visitor_name
+            """, (flat_number, purpose, logged_by, phone_key))
+            row = cursor.fetchone()
+            cursor.close()
+            if row is None:
+                return None
+            # the stored photo came from an earlier visit, which already queued it for shrinking
+            self.enqueue_job('visitor_notification', {'visitor_id': row[0], 'flat_number': flat_number,
+                                                      'visitor_name': row[1], 'logged_by': logged_by or 1},
+                             dedupe_key=f"visitor_notification:{row[0]}")
+        return row[0], row[1]
+
     def get_visitors_for_flat(self, flat_number, limit=10):
         cursor = self.connection.cursor()
         cursor.execute("SELECT * FROM visitors WHERE flat_number = %s ORDER BY entry_time DESC LIMIT %s", (flat_number, limit))
@@ -494,46 +2439,82 @@ class Database:
         
         return visitors
 
-    def get_all_visitors(self, status_filter=None, limit=50):
-        # get all visitor records
-        cursor = self.connection.cursor()
-        
-        # filter by status if needed
-        if status_filter and status_filter != 'all':
-            cursor.execute("""
-                SELECT * FROM visitors 
-                WHERE status = %s 
-                ORDER BY entry_time DESC 
-                LIMIT %s
-            """, (status_filter, limit))
+    def search_visitors(self, term=None, flat_number=None, status=None, start=None, end=None, limit=100):
+        # fuzzy match on name, phone digits or plate, best match first, then newest; start/end are
+        # inclusive dates compared as a half-open range on entry_time, so the index can be used and
+        # only the partitions of those months are searched
+        term = (term or "").strip()
+        digits = re.sub(r"[^0-9]", "", term)
+        plate = re.sub(r"[^A-Za-z0-9]", "", term).upper()
+        params = {'name': term.lower(), 'digits': digits if len(digits) >= 3 else None,
+                  'plate': plate if len(plate) >= 3 else None, 'flat': flat_number, 'status': status,
+                  'start': start, 'end': end + timedelta(days=1) if end else None, 'limit': limit}
+        if term:
+            # only the keys the term can match are OR-ed, so every branch can use its index
+            matches = ["%(name)s <%% lower(visitor_name)"]
+            scores = ["word_similarity(%(name)s, lower(visitor_name))"]
+            if params['digits']:
+                matches.append(f"{VISITOR_PHONE_KEY} LIKE '%%' || %(digits)s || '%%'")
+                scores.append(f"CASE WHEN {VISITOR_PHONE_KEY} LIKE '%%' || %(digits)s || '%%' THEN 1 ELSE 0 END")
+            if params['plate']:
+                matches.append(f"{VISITOR_PLATE_KEY} LIKE '%%' || %(plate)s || '%%'")
+                scores.append(f"word_similarity(%(plate)s, {VISITOR_PLATE_KEY})")
+            score = f"GREATEST({', '.join(scores)})"
+            match = f"AND ({' OR '.join(matches)})"
+            order = "score DESC, entry_time DESC"
         else:
-            cursor.execute("""
-                SELECT * FROM visitors 
-                ORDER BY entry_time DESC 
-                LIMIT %s
-            """, (limit,))
-        
-        visitors_data = cursor.fetchall()
+            score, match, order = "NULL::real", "", "entry_time DESC"
+        cursor = self.connection.cursor()
+        # resident name of the flat is joined in instead of looked up per row
+        cursor.execute(f"""
+            SELECT v.visitor_id, v.flat_number, v.visitor_name, v.visitor_phone, v.purpose, v.entry_time,
+                   v.exit_time, v.vehicle_number, v.logged_by, v.status, v.visitor_photo, r.name, v.score,
+                   v.auto_checked_out_at
+            FROM (
+                SELECT visitors.*, {score} AS score
+                FROM visitors
+                WHERE (%(flat)s::varchar IS NULL OR flat_number = %(flat)s)
+                  AND (%(status)s::varchar IS NULL OR status = %(status)s)
+                  AND (%(start)s::timestamp IS NULL OR entry_time >= %(start)s)
+                  AND (%(end)s::timestamp IS NULL OR entry_time < %(end)s)
+                  {match}
+                ORDER BY {order}
+                LIMIT %(limit)s
+            ) v
+            LEFT JOIN LATERAL (
+                SELECT name FROM users
+                WHERE flat_number = v.flat_number AND role IN ('owner', 'tenant')
+                LIMIT 1
+            ) r ON TRUE
+            ORDER BY {order}
+        """, params)
+        visitors = [{'visitor_id': r[0], 'flat_number': r[1], 'visitor_name': r[2], 'visitor_phone': r[3],
+                     'purpose': r[4], 'entry_time': r[5], 'exit_time': r[6], 'vehicle_number': r[7],
+                     'logged_by': r[8], 'status': r[9] or 'in', 'visitor_photo': r[10], 'flat_owner_name': r[11],
+                     'score': r[12], 'auto_checked_out_at': r[13]} for r in cursor.fetchall()]
+        cursor.close()
+        return visitors
+
+    def get_all_visitors(self, status_filter=None, limit=50, since=None, until=None):
+        # newest visitor records; since/until (dates, until inclusive) bound entry_time, so only the
+        # partitions of those months are read
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT visitor_id, flat_number, visitor_name, visitor_phone, purpose, entry_time, exit_time,
+                   vehicle_number, logged_by, status, visitor_photo
+            FROM visitors
+            WHERE (%(status)s::varchar IS NULL OR status = %(status)s)
+              AND (%(since)s::timestamp IS NULL OR entry_time >= %(since)s)
+              AND (%(until)s::timestamp IS NULL OR entry_time < %(until)s)
+            ORDER BY entry_time DESC
+            LIMIT %(limit)s
+        """, {'status': status_filter if status_filter and status_filter != 'all' else None,
+              'since': since, 'until': until + timedelta(days=1) if until else None, 'limit': limit})
+        visitors = [{'visitor_id': r[0], 'flat_number': r[1], 'visitor_name': r[2], 'visitor_phone': r[3],
+                     'purpose': r[4], 'entry_time': r[5], 'exit_time': r[6], 'vehicle_number': r[7],
+                     'logged_by': r[8], 'status': r[9] or 'in', 'visitor_photo': r[10], 'logged_by_name': None,
+                     'flat_owner_name': None} for r in cursor.fetchall()]
         cursor.close()
-        
-        visitors = []
-        for v in visitors_data:
-            visitors.append({
-                'visitor_id': v[0],
-                'flat_number': v[1],
-                'visitor_name': v[2],
-                'visitor_phone': v[3] if len(v) > 3 else None,
-                'purpose': v[4] if len(v) > 4 else None,
-                'entry_time': v[5] if len(v) > 5 else None,
-                'exit_time': v[6] if len(v) > 6 else None,
-                'vehicle_number': v[7] if len(v) > 7 else None,
-                'logged_by': v[8] if len(v) > 8 else None,
-                'status': v[9] if len(v) > 9 else 'in',
-                'visitor_photo': v[10] if len(v) > 10 else None,
-                'logged_by_name': None,
-                'flat_owner_name': None
-            })
-        
         return visitors
 
     def delete_notification(self, notification_id):
@@ -593,3 +2574,20 @@ class Database:
     def close_connection(self):
         if self.connection:
             self.connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or upgrade the tables and triggers")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="then fill the ledger, collection, complaint SLA and visitor rollups from their source tables")
+    args = parser.parse_args(argv)
+
+    db = Database()
+    if args.rebuild:
+        db.rebuild_derived()
+        print("Ledger, collections, complaint SLA, visitor rollups and profiles rebuilt")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Streaming exports of bills, payments, visitors and complaints to CSV or Parquet.
+
+Rows are read through a server-side (named) cursor with fetchmany, and each
+batch is written before the next one is fetched. Memory therefore stays flat
+however many rows match. Filters are a date range on each table's main date,
+a flat number and a status.
+
+    python exports.py bills --from 2025-01-01 --to 2025-03-31 --status overdue -o overdue.csv
+    python exports.py visitors --from 2025-01-01 --format parquet -o visitors_2025.parquet
+"""
+import argparse
+import csv
+import io
+import os
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+FETCH_SIZE = 5000
+
+# kind -> (table, columns, date column, status column)
+EXPORTS = {
+    'bills': ('bills', ['bill_id', 'flat_number', 'bill_type', 'amount', 'amount_paid', 'due_date', 'payment_status',
+                        'billing_period', 'payment_method', 'payment_date', 'created_at', 'paid_at'],
+              'due_date', 'payment_status'),
+    'payments': ('payments', ['payment_id', 'bill_id', 'flat_number', 'amount', 'payment_method', 'gateway_ref',
+                              'idempotency_key', 'created_by', 'created_at'],
+                 'created_at', None),
+    'visitors': ('visitors', ['visitor_id', 'flat_number', 'visitor_name', 'visitor_phone', 'purpose', 'entry_time',
+                              'exit_time', 'vehicle_number', 'status'],
+                 'entry_time', 'status'),
+    'complaints': ('complaints', ['complaint_id', 'flat_number', 'title', 'description', 'category', 'priority',
+                                  'status', 'created_at', 'resolved_at', 'admin_response'],
+                   'created_at', 'status'),
+}
+FORMATS = ('csv', 'parquet')
+
+
+def build_query(kind, start=None, end=None, flat_number=None, status=None):
+    """SELECT for one export; start/end are inclusive dates"""
+    table, columns, date_column, status_column = EXPORTS[kind]
+    conditions, params = [], []
+    if start:
+        conditions.append(f"{date_column} >= %s")
+        params.append(start)
+    if end:
+        # half-open on the next day, so timestamps on the end date are included
+        conditions.append(f"{date_column} < %s")
+        params.append(end + timedelta(days=1))
+    if flat_number:
+        conditions.append("flat_number = %s")
+        params.append(flat_number)
+    if status:
+        if status_column is None:
+            raise ValueError(f"{kind} have no status to filter on")
+        conditions.append(f"{status_column} = %s")
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY {columns[0]}", params
+
+
+def stream(db, query, params=None, fetch_size=FETCH_SIZE, name="export"):
+    """Yields lists of row tuples from a named cursor, fetch_size rows at a time"""
+    # named cursors only live inside a transaction
+    with db.transaction():
+        cursor = db.connection.cursor(name=f"{name}_{uuid.uuid4().hex[:8]}")
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+def iter_batches(db, kind, fetch_size=FETCH_SIZE, **filters):
+    query, params = build_query(kind, **filters)
+    return stream(db, query, params, fetch_size, name=f"export_{kind}")
+
+
+def write_csv(batches, columns, out):
+    """Writes batches to a text stream as they arrive; returns the row count"""
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    count = 0
+    for rows in batches:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def arrow_type(column):
+    """Parquet column type from the export's column naming; fixed up front so NULL-only batches still match"""
+    import pyarrow as pa
+
+    if column.endswith('_id') or column == 'created_by':
+        return pa.int64()
+    if column in ('amount', 'amount_paid'):
+        return pa.decimal128(10, 2)
+    if column.endswith('_date') or column == 'billing_period':
+        return pa.date32()
+    if column.endswith('_at') or column.endswith('_time'):
+        return pa.timestamp('us')
+    return pa.string()
+
+
+def write_parquet(batches, columns, out):
+    """Writes each batch as a Parquet row group; out is a path or a binary stream"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(c, arrow_type(c)) for c in columns])
+    count = 0
+    with pq.ParquetWriter(out, schema) as writer:
+        for rows in batches:
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array([r[i] for r in rows], type=f.type) for i, f in enumerate(schema)], schema=schema))
+            count += len(rows)
+    return count
+
+
+def export(db, kind, out, fmt='csv', fetch_size=FETCH_SIZE, **filters):
+    """Streams one export into out (a path, or a binary stream); returns the row count"""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    columns = EXPORTS[kind][1]
+    batches = iter_batches(db, kind, fetch_size, **filters)
+    if fmt == 'parquet':
+        return write_parquet(batches, columns, out)
+    if isinstance(out, str):
+        with open(out, 'w', newline='', encoding='utf-8') as f:
+            return write_csv(batches, columns, f)
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    try:
+        return write_csv(batches, columns, text)
+    finally:
+        text.detach()  # leave the caller's stream open
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Export bills, payments, visitors or complaints")
+    parser.add_argument("kind", choices=sorted(EXPORTS))
+    parser.add_argument("--from", dest="start", type=parse_date, help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--to", dest="end", type=parse_date, help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--flat", dest="flat_number")
+    parser.add_argument("--status")
+    parser.add_argument("--format", dest="fmt", choices=FORMATS)
+    parser.add_argument("-o", "--output", help="file to write (default <kind>_<date>.<format>)")
+    parser.add_argument("--fetch-size", type=int, default=FETCH_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.fmt or ('parquet' if args.output and args.output.endswith('.parquet') else 'csv')
+    output = args.output or f"{args.kind}_{date.today():%Y%m%d}.{fmt}"
+    db = Database()
+    started = time.perf_counter()
+    count = export(db, args.kind, output, fmt, args.fetch_size, start=args.start, end=args.end,
+                   flat_number=args.flat_number, status=args.status)
+    print(f"Exported {count} {args.kind} to {output} ({os.path.getsize(output) / 1e6:.1f} MB) "
+          f"in {time.perf_counter() - started:.2f}s")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
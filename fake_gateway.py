@@ -0,0 +1,161 @@
+"""Local stand-in for a payment gateway: sends signed payment webhooks to api.py.
+
+Simulates a month-end burst against a running API and worker:
+
+    uvicorn api:app --port 8000 &
+    python worker.py &
+    python fake_gateway.py --bills 2000 --concurrency 16 --batch 50
+
+Open bills are read from $DATABASE_URL. Each is paid in full, or in two parts
+for --partial of them. A share of the webhook requests is sent twice like a
+gateway retry (--retries), and some payments fail (--failures). At the end
+it waits until the worker has applied every event and reports the throughput
+and the final state of the bills.
+"""
+import argparse
+import json
+import random
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import payments
+
+METHODS = ["UPI", "Credit Card", "Debit Card", "Online Banking"]
+# only for a local API started with PAYMENT_WEBHOOK_SECRET=dev-webhook-secret
+DEV_WEBHOOK_SECRET = 'dev-webhook-secret'
+
+
+class FakeGateway:
+    def __init__(self, webhook_url, secret, timeout=30):
+        self.webhook_url = webhook_url
+        self.secret = secret
+        self.timeout = timeout
+
+    @staticmethod
+    def succeeded(bill_id, amount, method="UPI", idempotency_key=None):
+        ref = f"pay_{uuid.uuid4().hex[:16]}"
+        return {'event_id': f"evt_{uuid.uuid4().hex}", 'type': 'payment.succeeded', 'bill_id': bill_id,
+                'amount': str(amount), 'payment_method': method, 'gateway_ref': ref,
+                'idempotency_key': idempotency_key or f"gateway:{ref}"}
+
+    @staticmethod
+    def failed(bill_id, amount, reason="card declined"):
+        return {'event_id': f"evt_{uuid.uuid4().hex}", 'type': 'payment.failed', 'bill_id': bill_id,
+                'amount': str(amount), 'reason': reason}
+
+    def send(self, events):
+        """POSTs one signed batch; returns the API's {'accepted', 'duplicates'}"""
+        body = json.dumps({'events': events}).encode('utf-8')
+        request = urllib.request.Request(self.webhook_url, data=body, method="POST", headers={
+            'Content-Type': 'application/json',
+            'X-Gateway-Signature': payments.sign(body, self.secret),
+        })
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+
+def load_open_bills(db, limit):
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT bill_id, amount - amount_paid FROM bills
+        WHERE payment_status <> 'paid' ORDER BY due_date, bill_id LIMIT %s
+    """, (limit,))
+    bills = cursor.fetchall()
+    cursor.close()
+    return bills
+
+
+def build_events(bills, rng, partial, failures):
+    events = []
+    for bill_id, due in bills:
+        if rng.random() < failures:
+            events.append(FakeGateway.failed(bill_id, due))
+        if rng.random() < partial and due >= 2:
+            first = (due / 2).quantize(Decimal('0.01'))
+            events.append(FakeGateway.succeeded(bill_id, first, rng.choice(METHODS)))
+            events.append(FakeGateway.succeeded(bill_id, due - first, rng.choice(METHODS)))
+        else:
+            events.append(FakeGateway.succeeded(bill_id, due, rng.choice(METHODS)))
+    rng.shuffle(events)
+    return events
+
+
+def wait_until_applied(db, event_ids, timeout):
+    cursor = db.connection.cursor()
+    deadline = time.monotonic() + timeout
+    while True:
+        cursor.execute("""
+            SELECT status, COUNT(*), MAX(processed_at) FROM payment_events
+            WHERE event_id = ANY(%s) GROUP BY status
+        """, (event_ids,))
+        rows = {r[0]: (r[1], r[2]) for r in cursor.fetchall()}
+        if 'received' not in rows or time.monotonic() > deadline:
+            cursor.close()
+            return rows
+        time.sleep(0.5)
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Send signed payment webhooks like a gateway at month end")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/payments/webhook")
+    parser.add_argument("--secret", default=payments.webhook_secret(),
+                        help="webhook secret the API was started with (default $PAYMENT_WEBHOOK_SECRET)")
+    parser.add_argument("--dev-secret", action="store_true", help=f"sign with {DEV_WEBHOOK_SECRET!r}")
+    parser.add_argument("--bills", type=int, default=1000, help="open bills to pay")
+    parser.add_argument("--batch", type=int, default=50, help="events per webhook request")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel webhook requests")
+    parser.add_argument("--partial", type=float, default=0.1, help="share of bills paid in two parts")
+    parser.add_argument("--retries", type=float, default=0.2, help="share of requests delivered twice")
+    parser.add_argument("--failures", type=float, default=0.05, help="share of bills with a failed attempt first")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for the worker")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+    secret = DEV_WEBHOOK_SECRET if args.dev_secret else args.secret
+    if not secret:
+        raise SystemExit("Set PAYMENT_WEBHOOK_SECRET (as for the API), or pass --secret or --dev-secret")
+
+    rng = random.Random(args.seed)
+    db = Database()
+    bills = load_open_bills(db, args.bills)
+    if not bills:
+        raise SystemExit("No open bills to pay")
+    events = build_events(bills, rng, args.partial, args.failures)
+    batches = [events[i:i + args.batch] for i in range(0, len(events), args.batch)]
+    deliveries = batches + [b for b in batches if rng.random() < args.retries]
+    rng.shuffle(deliveries)
+
+    gateway = FakeGateway(args.url, secret)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(gateway.send, deliveries))
+    sent = time.perf_counter() - started
+    accepted = sum(r['accepted'] for r in results)
+    print(f"Delivered {len(deliveries)} requests ({len(events)} events, {len(deliveries) - len(batches)} retries) "
+          f"in {sent:.2f}s: {accepted} accepted, {sum(r['duplicates'] for r in results)} duplicates dropped "
+          f"({len(deliveries) / sent:.0f} req/s)")
+
+    rows = wait_until_applied(db, [e['event_id'] for e in events], args.timeout)
+    elapsed = time.perf_counter() - started
+    for status, (count, _) in sorted(rows.items()):
+        print(f"  {status:<10} {count:>8}")
+    print(f"All events processed {elapsed:.2f}s after the first request" if 'received' not in rows
+          else f"Timed out with {rows['received'][0]} events still waiting; is worker.py running?")
+
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT COUNT(*) FILTER (WHERE payment_status = 'paid'), COUNT(*) FILTER (WHERE amount_paid > amount)
+        FROM bills WHERE bill_id = ANY(%s)
+    """, ([b[0] for b in bills],))
+    paid, overpaid = cursor.fetchone()
+    cursor.close()
+    print(f"{paid}/{len(bills)} bills paid, {overpaid} overpaid")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""Offline-first gate kiosk: a local SQLite journal synced to PostgreSQL in batches.
+
+The guard's entries and checkouts are written to the journal first (a local
+disk write, no network), and a sync loop uploads them in batches whenever
+the server is reachable. Uploads are idempotent: every entry carries a
+client_ref that the server keeps unique, so a batch re-sent after a dropped
+connection is not duplicated. A checkout for a visitor the server already
+marked as out keeps the server's exit time and is recorded as a conflict.
+
+    python kiosk.py status --journal gate1.db
+    python kiosk.py sync --journal gate1.db           # one pass
+    python kiosk.py run --journal gate1.db --every 10  # keep syncing
+
+The Streamlit front end for the guard is kiosk_app.py.
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import psycopg2
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    client_ref TEXT PRIMARY KEY,
+    flat_number TEXT NOT NULL,
+    visitor_name TEXT NOT NULL,
+    visitor_phone TEXT,
+    purpose TEXT,
+    vehicle_number TEXT,
+    visitor_photo TEXT,
+    entry_time TEXT NOT NULL,
+    visitor_id INTEGER,
+    synced_at TEXT
+);
+CREATE TABLE IF NOT EXISTS checkouts (
+    op_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_ref TEXT,
+    visitor_id INTEGER,
+    exit_time TEXT NOT NULL,
+    synced_at TEXT,
+    result TEXT
+);
+-- visitors that were already inside per the server, so they can be checked out offline
+CREATE TABLE IF NOT EXISTS server_visitors (
+    visitor_id INTEGER PRIMARY KEY,
+    flat_number TEXT,
+    visitor_name TEXT,
+    entry_time TEXT
+);
+CREATE TABLE IF NOT EXISTS flats (flat_number TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+CREATE INDEX IF NOT EXISTS idx_entries_unsynced ON entries(synced_at) WHERE synced_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_checkouts_unsynced ON checkouts(synced_at) WHERE synced_at IS NULL;
+"""
+
+
+def now_text():
+    return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+
+class KioskJournal:
+    """Local write-ahead queue of gate events; safe to share between threads"""
+
+    def __init__(self, path, kiosk_id=None):
+        self.path = path
+        self.kiosk_id = kiosk_id or os.path.splitext(os.path.basename(path))[0]
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(JOURNAL_SCHEMA)
+
+    def log_entry(self, flat_number, visitor_name, visitor_phone=None, purpose=None, vehicle_number=None,
+                  visitor_photo=None):
+        client_ref = f"{self.kiosk_id}-{uuid.uuid4().hex}"
+        with self.lock:
+            self.connection.execute("""
+                INSERT INTO entries (client_ref, flat_number, visitor_name, visitor_phone, purpose,
+                                     vehicle_number, visitor_photo, entry_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (client_ref, flat_number, visitor_name, visitor_phone or None, purpose or None,
+                  vehicle_number or None, visitor_photo, now_text()))
+        return client_ref
+
+    def checkout(self, client_ref=None, visitor_id=None):
+        if not client_ref and not visitor_id:
+            raise ValueError("checkout needs a client_ref or a visitor_id")
+        with self.lock:
+            self.connection.execute("INSERT INTO checkouts (client_ref, visitor_id, exit_time) VALUES (?, ?, ?)",
+                                    (client_ref, visitor_id, now_text()))
+
+    def current_visitors(self):
+        """Visitors inside as far as this kiosk knows: local entries plus the server snapshot"""
+        with self.lock:
+            rows = self.connection.execute("""
+                SELECT e.client_ref, e.visitor_id, e.flat_number, e.visitor_name, e.entry_time, e.synced_at IS NOT NULL
+                FROM entries e
+                WHERE NOT EXISTS (SELECT 1 FROM checkouts c
+                                  WHERE c.client_ref = e.client_ref
+                                     OR (e.visitor_id IS NOT NULL AND c.visitor_id = e.visitor_id))
+                UNION ALL
+                SELECT NULL, s.visitor_id, s.flat_number, s.visitor_name, s.entry_time, 1
+                FROM server_visitors s
+                WHERE NOT EXISTS (SELECT 1 FROM checkouts c WHERE c.visitor_id = s.visitor_id)
+                  AND NOT EXISTS (SELECT 1 FROM entries e WHERE e.visitor_id = s.visitor_id)
+                ORDER BY 5 DESC
+            """).fetchall()
+        return [{'client_ref': r[0], 'visitor_id': r[1], 'flat_number': r[2], 'visitor_name': r[3],
+                 'entry_time': r[4], 'synced': bool(r[5])} for r in rows]
+
+    def flat_numbers(self):
+        with self.lock:
+            return [r[0] for r in self.connection.execute("SELECT flat_number FROM flats ORDER BY flat_number")]
+
+    def status(self):
+        with self.lock:
+            pending_entries = self.connection.execute("SELECT COUNT(*) FROM entries WHERE synced_at IS NULL").fetchone()[0]
+            pending_checkouts = self.connection.execute("SELECT COUNT(*) FROM checkouts WHERE synced_at IS NULL").fetchone()[0]
+            conflicts = self.connection.execute("SELECT COUNT(*) FROM checkouts WHERE result = 'conflict'").fetchone()[0]
+            state = dict(self.connection.execute("SELECT key, value FROM sync_state").fetchall())
+        return {'pending_entries': pending_entries, 'pending_checkouts': pending_checkouts,
+                'conflicts': conflicts, 'last_sync': state.get('last_sync'), 'last_error': state.get('last_error')}
+
+    def pending(self, limit):
+        with self.lock:
+            entries = self.connection.execute("""
+                SELECT client_ref, flat_number, visitor_name, visitor_phone, purpose, vehicle_number,
+                       visitor_photo, entry_time
+                FROM entries WHERE synced_at IS NULL ORDER BY entry_time LIMIT ?
+            """, (limit,)).fetchall()
+            checkouts = self.connection.execute("""
+                SELECT op_id, client_ref, visitor_id, exit_time
+                FROM checkouts WHERE synced_at IS NULL ORDER BY op_id LIMIT ?
+            """, (limit,)).fetchall()
+        columns = ['client_ref', 'flat_number', 'visitor_name', 'visitor_phone', 'purpose', 'vehicle_number',
+                   'visitor_photo', 'entry_time']
+        return ([dict(zip(columns, e)) for e in entries],
+                [{'op_id': c[0], 'client_ref': c[1], 'visitor_id': c[2], 'exit_time': c[3]} for c in checkouts])
+
+    def mark_synced(self, result, checkouts):
+        synced_at = now_text()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("UPDATE entries SET synced_at = ?, visitor_id = ? WHERE client_ref = ?",
+                                        [(synced_at, vid, ref) for ref, vid in result['visitor_ids'].items()])
+            outcome = {op: 'applied' for op in result['checked_out']}
+            outcome.update({op: 'conflict' for op in result['conflicts']})
+            # a checkout of an entry that is still queued stays pending until the entry is uploaded
+            queued = {r[0] for r in self.connection.execute("SELECT client_ref FROM entries WHERE synced_at IS NULL")}
+            waiting = {c['op_id'] for c in checkouts if c['client_ref'] in queued}
+            outcome.update({op: 'missing' for op in result['missing'] if op not in waiting})
+            self.connection.executemany("UPDATE checkouts SET synced_at = ?, result = ? WHERE op_id = ?",
+                                        [(synced_at, res, op) for op, res in outcome.items()])
+            self.connection.execute("COMMIT")
+
+    def refresh_snapshot(self, visitors, flats):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM server_visitors")
+            self.connection.executemany("INSERT INTO server_visitors VALUES (?, ?, ?, ?)",
+                                        [(v['visitor_id'], v['flat_number'], v['visitor_name'], str(v['entry_time']))
+                                         for v in visitors])
+            if flats:
+                self.connection.execute("DELETE FROM flats")
+                self.connection.executemany("INSERT INTO flats VALUES (?)", [(f,) for f in flats])
+            self.connection.execute("COMMIT")
+
+    def set_state(self, **values):
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO sync_state VALUES (?, ?)",
+                                        [(k, v) for k, v in values.items()])
+
+    def close(self):
+        self.connection.close()
+
+
+def sync(journal, db, logged_by, batch_size=200):
+    """Uploads everything pending, one transaction per batch; returns totals"""
+    totals = {'entries': 0, 'inserted': 0, 'checked_out': 0, 'conflicts': 0, 'batches': 0}
+    while True:
+        entries, checkouts = journal.pending(batch_size)
+        if not entries and not checkouts:
+            break
+        with db.transaction():
+            result = db.sync_visitor_batch(entries, checkouts, logged_by)
+        journal.mark_synced(result, checkouts)
+        totals['batches'] += 1
+        totals['entries'] += len(entries)
+        totals['inserted'] += result['inserted']
+        totals['checked_out'] += len(result['checked_out'])
+        totals['conflicts'] += len(result['conflicts'])
+        if not entries and len(checkouts) == len(result['missing']):
+            break  # only checkouts waiting on entries that are not uploaded yet
+
+    journal.refresh_snapshot(db.get_all_visitors(status_filter='in', limit=1000), db.get_allotted_flat_numbers())
+    journal.set_state(last_sync=now_text(), last_error='')
+    return totals
+
+
+class SyncWorker(threading.Thread):
+    """Keeps syncing in the background; reconnects after network failures"""
+
+    def __init__(self, journal, logged_by, every=10.0, batch_size=200):
+        super().__init__(daemon=True)
+        self.journal = journal
+        self.logged_by = logged_by
+        self.every = every
+        self.batch_size = batch_size
+        self.db = None
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def sync_now(self):
+        self.wake.set()
+
+    def run_once(self):
+        from database import Database
+
+        try:
+            if self.db is None:
+                self.db = Database()
+            return sync(self.journal, self.db, self.logged_by, self.batch_size)
+        except psycopg2.Error as e:
+            # server unreachable or batch rejected: keep the queue, reconnect and retry later
+            self.journal.set_state(last_error=f"{now_text()} {str(e).strip()}")
+            if self.db is not None:
+                try:
+                    self.db.close_connection()
+                except Exception:
+                    pass
+            self.db = None
+            return None
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.run_once()
+            self.wake.wait(self.every)
+            self.wake.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline gate kiosk journal")
+    parser.add_argument("command", choices=["status", "sync", "run"])
+    parser.add_argument("--journal", default=os.getenv('KIOSK_JOURNAL', 'kiosk_journal.db'))
+    parser.add_argument("--logged-by", type=int, default=int(os.getenv('KIOSK_USER_ID', '1')),
+                        help="user_id recorded as logged_by for uploaded entries")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--every", type=float, default=10.0, help="seconds between syncs for 'run'")
+    args = parser.parse_args(argv)
+
+    journal = KioskJournal(args.journal)
+    if args.command == "status":
+        for key, value in journal.status().items():
+            print(f"{key}: {value}")
+    elif args.command == "sync":
+        worker = SyncWorker(journal, args.logged_by, batch_size=args.batch_size)
+        totals = worker.run_once()
+        print(totals if totals is not None else f"sync failed: {journal.status()['last_error']}")
+    else:
+        worker = SyncWorker(journal, args.logged_by, every=args.every, batch_size=args.batch_size)
+        worker.start()
+        try:
+            while True:
+                time.sleep(args.every)
+                print(journal.status())
+        except KeyboardInterrupt:
+            worker.stop()
+    journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Gate kiosk front end: logs visitors to the local journal and syncs in the background.
+
+    streamlit run kiosk_app.py
+
+KIOSK_JOURNAL sets the journal file (default kiosk_journal.db) and KIOSK_USER_ID
+the user recorded as logged_by on the server (default 1, the admin).
+"""
+import base64
+import os
+
+import streamlit as st
+
+from kiosk import KioskJournal, SyncWorker
+from utils import get_flat_numbers, format_datetime
+
+st.set_page_config(page_title="SocietySync Gate Kiosk", page_icon="🚪", layout="wide")
+
+
+@st.cache_resource
+def get_kiosk():
+    journal = KioskJournal(os.getenv('KIOSK_JOURNAL', 'kiosk_journal.db'))
+    worker = SyncWorker(journal, int(os.getenv('KIOSK_USER_ID', '1')),
+                        every=float(os.getenv('KIOSK_SYNC_EVERY', '10')))
+    worker.start()
+    return journal, worker
+
+
+def show_sync_status(journal, worker):
+    status = journal.status()
+    pending = status['pending_entries'] + status['pending_checkouts']
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        if pending:
+            st.warning(f"⏳ {pending} gate events waiting to sync")
+        else:
+            st.success("✅ All gate events synced")
+    with col2:
+        st.caption(f"Last sync: {status['last_sync'] or 'never'}")
+        if status['last_error']:
+            st.caption(f"⚠️ Server unreachable: {status['last_error'][:120]}")
+        if status['conflicts']:
+            st.caption(f"ℹ️ {status['conflicts']} checkouts were already recorded on the server")
+    with col3:
+        if st.button("🔄 Sync now", key="kiosk_sync_now"):
+            worker.sync_now()
+            st.rerun()
+
+
+def log_entry_form(journal):
+    st.subheader("➕ Log Visitor")
+    flats = journal.flat_numbers() or get_flat_numbers()
+    with st.form("kiosk_entry_form", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            flat_number = st.selectbox("Visiting Flat", flats, key="kiosk_flat")
+            visitor_name = st.text_input("Visitor Name", key="kiosk_visitor_name")
+            visitor_phone = st.text_input("Visitor Phone", key="kiosk_visitor_phone")
+        with col2:
+            purpose = st.text_input("Purpose of Visit", key="kiosk_purpose")
+            vehicle_number = st.text_input("Vehicle Number (Optional)", key="kiosk_vehicle")
+            camera_photo = st.camera_input("📸 Visitor Photo (Optional)", key="kiosk_camera")
+
+        if st.form_submit_button("Log Visitor"):
+            if visitor_name and flat_number:
+                photo = base64.b64encode(camera_photo.read()).decode() if camera_photo is not None else None
+                journal.log_entry(flat_number, visitor_name, visitor_phone, purpose, vehicle_number, photo)
+                st.success(f"✅ {visitor_name} logged for Flat {flat_number}")
+            else:
+                st.error("Please enter visitor name and select flat number")
+
+
+def current_visitors(journal):
+    st.subheader("👥 Inside Now")
+    visitors = journal.current_visitors()
+    if not visitors:
+        st.info("No visitors inside")
+        return
+    for visitor in visitors:
+        col1, col2, col3 = st.columns([3, 2, 1])
+        with col1:
+            st.write(f"**{visitor['visitor_name']}** → Flat {visitor['flat_number']}")
+        with col2:
+            st.caption(f"In since {format_datetime(visitor['entry_time'])}"
+                       f"{'' if visitor['synced'] else ' · not synced yet'}")
+        with col3:
+            key = visitor['client_ref'] or f"server_{visitor['visitor_id']}"
+            if st.button("Mark Exit", key=f"kiosk_exit_{key}"):
+                journal.checkout(client_ref=visitor['client_ref'], visitor_id=visitor['visitor_id'])
+                st.rerun()
+
+
+def main():
+    journal, worker = get_kiosk()
+    st.title("🚪 Gate Kiosk")
+    show_sync_status(journal, worker)
+    st.divider()
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        log_entry_form(journal)
+    with col2:
+        current_visitors(journal)
+
+
+main()
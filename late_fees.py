@@ -0,0 +1,169 @@
+"""Late fees and arrears aging, computed set-based in SQL.
+
+A late-fee policy applies to one bill type or, with no bill type, to all of
+them; the bill type specific policy wins. Once a bill is unpaid for longer
+than grace_days past its due date it carries a late fee of
+
+    flat_fee + (amount - amount_paid) * daily_rate_percent / 100 * days late
+
+capped by max_fee and by max_percent of the bill amount. The fee is a bill
+of its own (bill_type 'Late Fee') linked through parent_bill_id; each run
+recomputes every fee in one INSERT ... ON CONFLICT, so a fee grows while
+its bill stays unpaid and stops when it is paid.
+
+The aging report buckets outstanding amounts by days past due for every flat
+or block in one grouped query.
+
+    python late_fees.py apply                 # apply fees as of today
+    python late_fees.py aging --by block
+"""
+import argparse
+import time
+from datetime import date
+
+LATE_FEE_BILL_TYPE = "Late Fee"
+AGING_BUCKETS = ['current', 'days_0_30', 'days_31_60', 'days_61_90', 'days_90_plus']
+
+# fee per unpaid bill as of %(as_of)s; late-fee bills themselves never attract fees
+LATE_FEE_CHARGES = """
+    WITH late AS (
+        SELECT DISTINCT ON (b.bill_id)
+               b.bill_id, b.flat_number, b.amount, p.max_fee, p.max_percent,
+               p.flat_fee + (b.amount - b.amount_paid) * p.daily_rate_percent / 100 * (%(as_of)s::date - b.due_date) AS raw_fee
+        FROM bills b
+        JOIN late_fee_policies p ON p.is_active AND (p.bill_type IS NULL OR p.bill_type = b.bill_type)
+        WHERE b.payment_status <> 'paid'
+          AND b.parent_bill_id IS NULL
+          AND b.due_date + p.grace_days < %(as_of)s::date
+        ORDER BY b.bill_id, p.bill_type IS NULL, p.policy_id DESC
+    ),
+    fees AS (
+        SELECT bill_id, flat_number,
+               ROUND(LEAST(raw_fee, COALESCE(max_fee, raw_fee), COALESCE(amount * max_percent / 100, raw_fee)), 2) AS fee
+        FROM late
+    )
+"""
+
+
+def apply_late_fees(db, as_of=None, created_by=None):
+    """Creates or raises the late-fee bills in one statement; returns (created, updated, total)"""
+    params = {'as_of': as_of or date.today(), 'bill_type': LATE_FEE_BILL_TYPE, 'created_by': created_by}
+    cursor = db.connection.cursor()
+    cursor.execute(LATE_FEE_CHARGES + """,
+    written AS (
+        INSERT INTO bills (flat_number, bill_type, amount, due_date, created_by, parent_bill_id)
+        SELECT flat_number, %(bill_type)s, fee, %(as_of)s, %(created_by)s, bill_id
+        FROM fees WHERE fee > 0
+        ON CONFLICT (parent_bill_id) WHERE parent_bill_id IS NOT NULL
+        DO UPDATE SET amount = EXCLUDED.amount
+        WHERE bills.payment_status <> 'paid' AND bills.amount < EXCLUDED.amount
+        RETURNING (xmax = 0) AS created, amount
+    )
+    SELECT COUNT(*) FILTER (WHERE created), COUNT(*) FILTER (WHERE NOT created), COALESCE(SUM(amount), 0)
+    FROM written
+    """, params)
+    created, updated, total = cursor.fetchone()
+    cursor.close()
+    return created, updated, total
+
+
+def preview_late_fees(db, as_of=None):
+    """Late fees that are due now but not billed yet (or billed lower)"""
+    cursor = db.connection.cursor()
+    cursor.execute(LATE_FEE_CHARGES + """
+    SELECT COUNT(*), COALESCE(SUM(f.fee - COALESCE(lf.amount, 0)), 0)
+    FROM fees f
+    LEFT JOIN bills lf ON lf.parent_bill_id = f.bill_id
+    WHERE f.fee > COALESCE(lf.amount, 0) AND (lf.bill_id IS NULL OR lf.payment_status <> 'paid')
+    """, {'as_of': as_of or date.today()})
+    count, amount = cursor.fetchone()
+    cursor.close()
+    return count, amount
+
+
+def arrears_aging(db, by='flat', as_of=None, flat_number=None):
+    """Outstanding amounts per flat or block (first letter of the flat number), bucketed by days past due"""
+    key = "LEFT(flat_number, 1)" if by == 'block' else "flat_number"
+    cursor = db.connection.cursor()
+    cursor.execute(f"""
+        SELECT {key} AS grp,
+               COALESCE(SUM(amount - amount_paid) FILTER (WHERE due_date > %(as_of)s), 0),
+               COALESCE(SUM(amount - amount_paid) FILTER (WHERE %(as_of)s - due_date BETWEEN 0 AND 30), 0),
+               COALESCE(SUM(amount - amount_paid) FILTER (WHERE %(as_of)s - due_date BETWEEN 31 AND 60), 0),
+               COALESCE(SUM(amount - amount_paid) FILTER (WHERE %(as_of)s - due_date BETWEEN 61 AND 90), 0),
+               COALESCE(SUM(amount - amount_paid) FILTER (WHERE %(as_of)s - due_date > 90), 0),
+               SUM(amount - amount_paid), COUNT(*)
+        FROM bills
+        WHERE payment_status <> 'paid' AND (%(flat)s::varchar IS NULL OR flat_number = %(flat)s)
+        GROUP BY grp
+        ORDER BY SUM(amount - amount_paid) FILTER (WHERE %(as_of)s - due_date > 90) DESC NULLS LAST,
+                 SUM(amount - amount_paid) DESC
+    """, {'as_of': as_of or date.today(), 'flat': flat_number})
+    rows = [dict(zip([by] + AGING_BUCKETS + ['total', 'bills'], r)) for r in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+
+def get_late_fee_policies(db):
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT policy_id, bill_type, flat_fee, daily_rate_percent, grace_days, max_fee, max_percent, created_at
+        FROM late_fee_policies WHERE is_active
+        ORDER BY bill_type NULLS FIRST, policy_id
+    """)
+    policies = [{'policy_id': r[0], 'bill_type': r[1], 'flat_fee': r[2], 'daily_rate_percent': r[3],
+                 'grace_days': r[4], 'max_fee': r[5], 'max_percent': r[6], 'created_at': r[7]}
+                for r in cursor.fetchall()]
+    cursor.close()
+    return policies
+
+
+def add_late_fee_policy(db, bill_type, flat_fee, daily_rate_percent, grace_days, max_fee, max_percent, created_by):
+    if not flat_fee and not daily_rate_percent:
+        raise ValueError("A late-fee policy needs a flat fee or a daily rate")
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        INSERT INTO late_fee_policies (bill_type, flat_fee, daily_rate_percent, grace_days, max_fee, max_percent, created_by)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING policy_id
+    """, (bill_type, flat_fee, daily_rate_percent, grace_days, max_fee, max_percent, created_by))
+    policy_id = cursor.fetchone()[0]
+    cursor.close()
+    return policy_id
+
+
+def deactivate_late_fee_policy(db, policy_id):
+    cursor = db.connection.cursor()
+    cursor.execute("UPDATE late_fee_policies SET is_active = FALSE WHERE policy_id = %s", (policy_id,))
+    cursor.close()
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Apply late fees and report arrears aging")
+    parser.add_argument("command", choices=["apply", "aging"])
+    parser.add_argument("--as-of", type=date.fromisoformat, default=date.today(), help="YYYY-MM-DD (default: today)")
+    parser.add_argument("--by", choices=["flat", "block"], default="flat", help="aging report grouping")
+    parser.add_argument("--created-by", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=25, help="aging rows to print")
+    args = parser.parse_args(argv)
+
+    db = Database()
+    started = time.perf_counter()
+    if args.command == "apply":
+        created, updated, total = apply_late_fees(db, args.as_of, args.created_by)
+        print(f"{created} late fees created, {updated} raised ({float(total):,.2f}) "
+              f"in {time.perf_counter() - started:.2f}s")
+    else:
+        rows = arrears_aging(db, args.by, args.as_of)
+        print(f"{args.by:<8}{'current':>12}{'0-30':>12}{'31-60':>12}{'61-90':>12}{'90+':>12}{'total':>14}")
+        for row in rows[:args.limit]:
+            print(f"{row[args.by]:<8}" + "".join(f"{float(row[b]):>12,.0f}" for b in AGING_BUCKETS)
+                  + f"{float(row['total']):>14,.2f}")
+        print(f"{len(rows)} {args.by}s with arrears in {time.perf_counter() - started:.2f}s")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Headless concurrent-session load test for the Streamlit app.
+
+Each simulated session drives app.py through Streamlit's AppTest runner (no
+browser, no server): login, then a role-specific walk through the sidebar
+pages, casting a vote on the Polls page when one is open. Many sessions run
+concurrently against the database in $DATABASE_URL.
+
+    python load_test.py --sessions 200 --concurrency 50 --mix admin=1,owner=6,tenant=3
+
+Reports throughput, latency percentiles per step and database connection
+usage (connections opened by the app and pg_stat_activity samples).
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import psycopg2
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+ROLE_PAGES = {
+    'admin': ["🏠 Dashboard", "💰 Billing", "📢 Notifications", "🗳️ Polls"],
+    'owner': ["🏠 Dashboard", "💰 My Bills", "🔔 Notifications", "🗳️ Polls"],
+    'tenant': ["🏠 Dashboard", "💰 My Bills", "🔔 Notifications", "🗳️ Polls"],
+}
+
+
+class ConnectionCounter:
+    """Counts psycopg2.connect calls made by the app while the test runs"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.original = None
+
+    def __enter__(self):
+        self.original = psycopg2.connect
+
+        def counting_connect(*args, **kwargs):
+            with self.lock:
+                self.opened += 1
+            return self.original(*args, **kwargs)
+
+        psycopg2.connect = counting_connect
+        return self
+
+    def __exit__(self, *exc):
+        psycopg2.connect = self.original
+
+
+class ActivitySampler(threading.Thread):
+    """Samples pg_stat_activity for the test database on its own connection"""
+
+    def __init__(self, db_url, interval=0.5):
+        super().__init__(daemon=True)
+        self.connection = psycopg2.connect(db_url)
+        self.connection.autocommit = True
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        cursor = self.connection.cursor()
+        while not self.stopped.is_set():
+            cursor.execute("""
+                SELECT COUNT(*), COUNT(*) FILTER (WHERE state = 'active')
+                FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()
+            """)
+            self.samples.append(cursor.fetchone())
+            self.stopped.wait(self.interval)
+        cursor.close()
+        self.connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        totals = [s[0] for s in self.samples]
+        active = [s[1] for s in self.samples]
+        return {'samples': len(self.samples), 'peak_connections': max(totals),
+                'mean_connections': round(statistics.mean(totals), 1),
+                'peak_active': max(active), 'mean_active': round(statistics.mean(active), 1)}
+
+
+def find_button(at, label=None, key_prefix=None):
+    for button in at.button:
+        if label is not None and button.label == label:
+            return button
+        if key_prefix is not None and button.key and button.key.startswith(key_prefix):
+            return button
+    return None
+
+
+class SimulatedSession:
+    def __init__(self, role, username, password, timeout):
+        self.role = role
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.timings = []   # (step, seconds)
+        self.errors = []
+
+    def step(self, name, action):
+        started = time.perf_counter()
+        try:
+            at = action()
+        except Exception as e:
+            self.errors.append(f"{name}: {e}")
+            return None
+        self.timings.append((name, time.perf_counter() - started))
+        if at is not None and len(at.exception) > 0:
+            self.errors.append(f"{name}: {at.exception[0].value}")
+        return at
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+        if self.step("open", at.run) is None:
+            return self
+
+        def login():
+            at.text_input(key="login_username").input(self.username)
+            at.text_input(key="login_password").input(self.password)
+            return find_button(at, label="🚀 Login").click().run()
+
+        if self.step("login", login) is None or not at.session_state["logged_in"]:
+            self.errors.append("login: not logged in")
+            return self
+
+        for page in ROLE_PAGES[self.role]:
+            def navigate(page=page):
+                radio = next(r for r in at.sidebar.radio if r.label == "Navigation")
+                return radio.set_value(page).run()
+
+            if self.step(f"page {page}", navigate) is None:
+                continue
+
+            if page == "🗳️ Polls" and self.role != 'admin':
+                vote = find_button(at, key_prefix="vote_")
+                if vote is not None:
+                    self.step("vote", lambda: vote.click().run())
+        return self
+
+
+def load_credentials(db_url, password, limit):
+    connection = psycopg2.connect(db_url)
+    cursor = connection.cursor()
+    credentials = {'admin': [("admin", "admin123")]}
+    for role in ('owner', 'tenant'):
+        cursor.execute("SELECT username FROM users WHERE role = %s ORDER BY user_id LIMIT %s", (role, limit))
+        credentials[role] = [(row[0], password) for row in cursor.fetchall()]
+    cursor.close()
+    connection.close()
+    return credentials
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        role, _, weight = part.partition("=")
+        mix[role.strip()] = float(weight or 1)
+    return mix
+
+
+def summarise(sessions, elapsed, connections_opened, activity):
+    by_step = defaultdict(list)
+    for session in sessions:
+        for name, seconds in session.timings:
+            by_step[name].append(seconds)
+    all_timings = [s for values in by_step.values() for s in values]
+
+    def pct(values, p):
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 1)
+
+    def latency(values):
+        return {'count': len(values), 'p50_ms': pct(values, 50), 'p90_ms': pct(values, 90),
+                'p95_ms': pct(values, 95), 'p99_ms': pct(values, 99), 'max_ms': round(max(values) * 1000, 1)}
+
+    errors = [e for s in sessions for e in s.errors]
+    return {
+        'sessions': len(sessions),
+        'failed_sessions': sum(1 for s in sessions if s.errors),
+        'elapsed_s': round(elapsed, 2),
+        'sessions_per_s': round(len(sessions) / elapsed, 2) if elapsed else 0,
+        'requests_per_s': round(len(all_timings) / elapsed, 2) if elapsed else 0,
+        'latency': latency(all_timings) if all_timings else {},
+        'steps': {name: latency(values) for name, values in sorted(by_step.items())},
+        'db': dict(activity, connections_opened=connections_opened,
+                   connections_per_session=round(connections_opened / max(len(sessions), 1), 1)),
+        'sample_errors': errors[:10],
+    }
+
+
+def print_report(report):
+    print(f"\nSessions: {report['sessions']} ({report['failed_sessions']} with errors) in {report['elapsed_s']}s")
+    print(f"Throughput: {report['sessions_per_s']} sessions/s, {report['requests_per_s']} script runs/s")
+    print(f"\n{'step':<28}{'count':>7}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, lat in list(report['steps'].items()) + [("ALL", report['latency'])]:
+        if lat:
+            print(f"{name:<28}{lat['count']:>7}{lat['p50_ms']:>10}{lat['p90_ms']:>10}"
+                  f"{lat['p95_ms']:>10}{lat['p99_ms']:>10}{lat['max_ms']:>10}")
+    print("\nDatabase:")
+    for key, value in report['db'].items():
+        print(f"  {key}: {value}")
+    for error in report['sample_errors']:
+        print(f"  error: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent headless sessions against app.py")
+    parser.add_argument("--sessions", type=int, default=100, help="total simulated sessions")
+    parser.add_argument("--concurrency", type=int, default=20, help="sessions running at the same time")
+    parser.add_argument("--mix", default="admin=1,owner=6,tenant=3", help="role weights")
+    parser.add_argument("--password", default="password123", help="password of generated residents")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which sessions are started")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per script run timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    db_url = os.getenv('DATABASE_URL')
+    if not db_url:
+        raise SystemExit("DATABASE_URL is not set")
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    credentials = load_credentials(db_url, args.password, limit=max(args.sessions, 1))
+    roles = [r for r in mix if credentials.get(r)]
+    if not roles:
+        raise SystemExit("No users found for the requested roles; run data_generator.py first")
+
+    plan = []
+    for _ in range(args.sessions):
+        role = rng.choices(roles, [mix[r] for r in roles])[0]
+        username, password = rng.choice(credentials[role])
+        plan.append(SimulatedSession(role, username, password, args.timeout))
+
+    sampler = ActivitySampler(db_url)
+    sampler.start()
+    started = time.perf_counter()
+    finished = []
+    with ConnectionCounter() as counter, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = []
+        for session in plan:
+            if args.ramp_up and args.sessions > 1:
+                time.sleep(args.ramp_up / args.sessions)
+            futures.append(pool.submit(session.run))
+        for done, future in enumerate(as_completed(futures), 1):
+            finished.append(future.result())
+            if done % max(1, args.sessions // 10) == 0:
+                print(f"  {done}/{args.sessions} sessions finished")
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+
+    report = summarise(finished, elapsed, counter.opened, sampler.summary())
+    report['config'] = vars(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
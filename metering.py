@@ -0,0 +1,265 @@
+"""Utility metering: meter readings, CSV ingest and a vectorized tariff engine.
+
+Readings are cumulative meter values per flat, utility and date. A month's
+consumption is the last reading in the month minus the last reading before
+it. Common-area meters are stored under the flat number COMMON (whole
+society) or COMMON-<block> (e.g. COMMON-A). Their cost is shared equally
+between the billed flats they serve.
+
+The tariff engine works on all meters at once with NumPy/pandas: slab
+charges, a fixed charge and the common-area share are computed as array
+operations, and the bills are written with one batched insert in one
+transaction. Bills carry billing_period like the recurring bills, so
+re-running a month never bills twice.
+
+Readings with anomalies are left out of billing and listed in the
+validation report: negative deltas, missing opening or closing readings,
+unknown flats and statistical outliers.
+
+    python metering.py ingest readings.csv
+    python metering.py report --period 2025-07
+    python metering.py bill --period 2025-07
+"""
+import argparse
+import io
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import psycopg2.extras
+
+from billing_engine import month_start
+
+# slabs: (upper limit of the slab in units or None for the rest, rate per unit)
+TARIFFS = {
+    'electricity': {
+        'bill_type': 'Electricity',
+        'fixed_charge': 120.0,
+        'slabs': [(100, 3.50), (300, 5.20), (None, 7.80)],
+        'common_rate': 6.50,
+        'due_day': 15,
+    },
+    'water': {
+        'bill_type': 'Water',
+        'fixed_charge': 80.0,
+        'slabs': [(10, 12.0), (25, 18.0), (None, 30.0)],
+        'common_rate': 15.0,
+        'due_day': 15,
+    },
+}
+UTILITIES = tuple(TARIFFS)
+COMMON_PREFIX = "COMMON"
+OUTLIER_Z = 4.0
+CSV_COLUMNS = ['flat_number', 'utility', 'reading_date', 'reading']
+
+
+def ingest_csv(db, source):
+    """Loads a CSV (flat_number, utility, reading_date, reading) via COPY; returns (rows, rejected)"""
+    df = pd.read_csv(source, dtype={'flat_number': str, 'utility': str})
+    missing = [c for c in CSV_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+
+    df = df[CSV_COLUMNS].copy()
+    df['flat_number'] = df['flat_number'].str.strip().str.upper()
+    df['utility'] = df['utility'].str.strip().str.lower()
+    df['reading_date'] = pd.to_datetime(df['reading_date'], errors='coerce').dt.date
+    df['reading'] = pd.to_numeric(df['reading'], errors='coerce')
+    valid = df['utility'].isin(UTILITIES) & df['reading_date'].notna() & df['reading'].notna() & \
+        df['flat_number'].str.len().between(1, 10) & (df['reading'] >= 0)
+    rejected = df[~valid]
+    # the last row wins when a file repeats a meter and date
+    df = df[valid].drop_duplicates(['flat_number', 'utility', 'reading_date'], keep='last')
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    with db.transaction():
+        cursor = db.connection.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE meter_readings_load (
+                flat_number VARCHAR(10), utility VARCHAR(20), reading_date DATE, reading NUMERIC(12,2)
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert("COPY meter_readings_load FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute("""
+            INSERT INTO meter_readings (flat_number, utility, reading_date, reading)
+            SELECT flat_number, utility, reading_date, reading FROM meter_readings_load
+            ON CONFLICT (flat_number, utility, reading_date) DO UPDATE SET reading = EXCLUDED.reading
+        """)
+        cursor.close()
+    return len(df), rejected
+
+
+def load_period_readings(db, period):
+    """Opening and closing reading of every meter seen in the month or the three months before"""
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        WITH closing AS (
+            SELECT DISTINCT ON (flat_number, utility) flat_number, utility, reading, reading_date
+            FROM meter_readings
+            WHERE reading_date >= %(start)s AND reading_date < %(start)s::date + INTERVAL '1 month'
+            ORDER BY flat_number, utility, reading_date DESC
+        ),
+        opening AS (
+            SELECT DISTINCT ON (flat_number, utility) flat_number, utility, reading, reading_date
+            FROM meter_readings
+            WHERE reading_date < %(start)s AND reading_date >= %(start)s::date - INTERVAL '3 months'
+            ORDER BY flat_number, utility, reading_date DESC
+        )
+        SELECT COALESCE(c.flat_number, o.flat_number), COALESCE(c.utility, o.utility),
+               o.reading, o.reading_date, c.reading, c.reading_date
+        FROM closing c
+        FULL JOIN opening o ON o.flat_number = c.flat_number AND o.utility = c.utility
+    """, {'start': period})
+    df = pd.DataFrame(cursor.fetchall(), columns=['flat_number', 'utility', 'opening', 'opening_date',
+                                                  'closing', 'closing_date'])
+    cursor.execute("SELECT flat_number FROM owners UNION SELECT flat_number FROM tenants")
+    flats = {r[0] for r in cursor.fetchall()}
+    cursor.close()
+    df['opening'] = df['opening'].astype(float)
+    df['closing'] = df['closing'].astype(float)
+    return df, flats
+
+
+def slab_charges(units, slabs):
+    """Energy charge for an array of units; each slab is filled before the next one"""
+    lower = np.array([0.0] + [limit for limit, _ in slabs[:-1]])
+    upper = np.array([limit if limit is not None else np.inf for limit, _ in slabs])
+    rates = np.array([rate for _, rate in slabs])
+    # units falling into each slab: shape (meters, slabs)
+    in_slab = np.clip(units[:, None] - lower[None, :], 0, upper - lower)
+    return in_slab @ rates
+
+
+def validate(df, flats):
+    """Adds an 'issue' column (None when the meter can be billed)"""
+    df = df.copy()
+    df['is_common'] = df['flat_number'].str.startswith(COMMON_PREFIX)
+    df['units'] = df['closing'] - df['opening']
+
+    issue = pd.Series(None, index=df.index, dtype=object)
+    issue[df['closing'].isna()] = 'missing closing reading'
+    issue[issue.isna() & df['opening'].isna()] = 'missing opening reading'
+    issue[issue.isna() & (df['units'] < 0)] = 'negative consumption'
+    issue[issue.isna() & ~df['is_common'] & ~df['flat_number'].isin(flats)] = 'unknown or vacant flat'
+
+    # outliers: far above the rest of the same utility (log scale, so a few big flats are not flagged)
+    ok = issue.isna() & ~df['is_common']
+    log_units = np.log1p(df['units'].where(ok).clip(lower=0))
+    stats = log_units.groupby(df['utility']).agg(['mean', 'std'])
+    mean = df['utility'].map(stats['mean'])
+    std = df['utility'].map(stats['std']).replace(0, np.nan)
+    z = (log_units - mean) / std
+    issue[ok & (z > OUTLIER_Z)] = 'unusually high consumption'
+
+    df['issue'] = issue
+    return df
+
+
+def compute_charges(df, flats):
+    """Bill amount per (flat, utility) for the meters without issues, plus the report rows"""
+    df = validate(df, flats)
+    billable = df[df['issue'].isna()]
+    meters = billable[~billable['is_common']].copy()
+    common = billable[billable['is_common']]
+
+    frames = []
+    for utility, tariff in TARIFFS.items():
+        part = meters[meters['utility'] == utility].copy()
+        if part.empty:
+            continue
+        units = part['units'].to_numpy(dtype=float)
+        part['energy'] = slab_charges(units, tariff['slabs'])
+        part['fixed'] = tariff['fixed_charge']
+
+        # common-area cost shared equally by the billed flats each common meter serves
+        part['block'] = part['flat_number'].str[0]
+        part['common_share'] = 0.0
+        for _, meter in common[common['utility'] == utility].iterrows():
+            scope = meter['flat_number'][len(COMMON_PREFIX) + 1:]
+            served = part['block'] == scope if scope else np.ones(len(part), dtype=bool)
+            if served.any():
+                part.loc[served, 'common_share'] += meter['units'] * tariff['common_rate'] / served.sum()
+
+        part['amount'] = (part['energy'] + part['fixed'] + part['common_share']).round(2)
+        part['bill_type'] = tariff['bill_type']
+        part['due_day'] = tariff['due_day']
+        frames.append(part)
+
+    charges = pd.concat(frames) if frames else pd.DataFrame(
+        columns=['flat_number', 'utility', 'units', 'energy', 'fixed', 'common_share', 'amount', 'bill_type', 'due_day'])
+    report = df[df['issue'].notna()][['flat_number', 'utility', 'opening', 'opening_date', 'closing',
+                                      'closing_date', 'units', 'issue']]
+    return charges, report
+
+
+def preview_period(db, period):
+    period = month_start(period)
+    df, flats = load_period_readings(db, period)
+    return compute_charges(df, flats)
+
+
+def bill_period(db, period, created_by):
+    """Writes the metered bills of a month in one transaction; returns (bills created, charges, report)"""
+    period = month_start(period)
+    charges, report = preview_period(db, period)
+    if charges.empty:
+        return 0, charges, report
+
+    rows = list(zip(charges['flat_number'], charges['bill_type'], charges['amount'].astype(float),
+                    [period.replace(day=int(d)) for d in charges['due_day']],
+                    [created_by] * len(charges), [period] * len(charges)))
+    with db.transaction():
+        cursor = db.connection.cursor()
+        inserted = psycopg2.extras.execute_values(cursor, """
+            INSERT INTO bills (flat_number, bill_type, amount, due_date, created_by, billing_period)
+            VALUES %s
+            ON CONFLICT (flat_number, bill_type, billing_period) WHERE billing_period IS NOT NULL DO NOTHING
+            RETURNING bill_id
+        """, rows, page_size=5000, fetch=True)
+        cursor.close()
+    return len(inserted), charges, report
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Meter readings and metered utility bills")
+    parser.add_argument("command", choices=["ingest", "report", "bill"])
+    parser.add_argument("csv", nargs="?", help="readings file for 'ingest'")
+    parser.add_argument("--period", default=date.today().strftime("%Y-%m"), help="YYYY-MM (default: this month)")
+    parser.add_argument("--created-by", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    db = Database()
+    started = time.perf_counter()
+    if args.command == "ingest":
+        if not args.csv:
+            raise SystemExit("ingest needs a CSV file")
+        loaded, rejected = ingest_csv(db, args.csv)
+        print(f"Loaded {loaded} readings, rejected {len(rejected)} in {time.perf_counter() - started:.2f}s")
+        if len(rejected):
+            print(rejected.head(20).to_string(index=False))
+    else:
+        if args.command == "bill":
+            created, charges, report = bill_period(db, args.period, args.created_by)
+        else:
+            created, (charges, report) = None, preview_period(db, args.period)
+        elapsed = time.perf_counter() - started
+        if not charges.empty:
+            print(charges.groupby('bill_type').agg(meters=('amount', 'size'), units=('units', 'sum'),
+                                                   amount=('amount', 'sum')).to_string())
+        print(f"{len(report)} meters need attention")
+        if len(report):
+            print(report.groupby('issue').size().to_string())
+        if created is not None:
+            print(f"Created {created} bills in {elapsed:.2f}s")
+        else:
+            print(f"Computed in {elapsed:.2f}s")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
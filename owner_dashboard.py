@@ -3,9 +3,12 @@ import pandas as pd
 from datetime import datetime, date
 from utils import (
     format_currency, format_date, format_datetime, create_data_table,
-    get_status_color, create_notification_display, create_poll_display
+    get_status_color, create_notification_display, create_poll_display, payment_idempotency_key,
+    create_guest_pass_section
 )
 
+BILLS_PAGE_SIZE = 20
+
 class OwnerDashboard:
     def __init__(self, db):
         self.db = db
@@ -92,8 +95,7 @@ class OwnerDashboard:
         
         # get unread notifications count
         user_id = st.session_state.user['user_id']
-        unread_notifs = self.db.get_unread_notifications(user_id)
-        stats['unread_notifications'] = len(unread_notifs)
+        stats['unread_notifications'] = self.db.get_unread_notification_count(user_id)
         
         # check active polls
         cursor.execute("SELECT COUNT(*) FROM polls WHERE is_active = TRUE")
@@ -104,8 +106,7 @@ class OwnerDashboard:
     
     def get_recent_bills(self, flat_number, limit=5):
         """Get recent bills for the flat"""
-        # Use the simplified database method
-        return self.db.get_user_bills(flat_number)[:limit]
+        return self.db.get_user_bills_page(flat_number, limit=limit)[0]
     
     def get_recent_complaints(self, user_id, limit=5):
         """Get recent complaints by the user"""
@@ -137,41 +138,41 @@ class OwnerDashboard:
         from utils import check_overdue_bills
         check_overdue_bills(self.db)
         
-        # Get all bills for the flat
-        bills = self.db.get_user_bills(user['flat_number'])
+        # Balance and totals are one row of flat_balances, kept current by triggers on bills
+        totals = self.db.get_flat_bill_totals(user['flat_number'])
         
-        if bills:
-            # Summary metrics
-            total_pending = sum(float(bill['amount']) for bill in bills if bill['payment_status'] == 'pending')
-            total_overdue = sum(float(bill['amount']) for bill in bills if bill['payment_status'] == 'overdue')
-            total_paid = sum(float(bill['amount']) for bill in bills if bill['payment_status'] == 'paid')
-            
-            col1, col2, col3 = st.columns(3)
+        if totals['bill_count']:
+            col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                st.metric("Pending Amount", format_currency(total_pending))
+                st.metric("Balance Due", format_currency(totals['balance']))
             
             with col2:
-                st.metric("Overdue Amount", format_currency(total_overdue))
+                st.metric("Pending Amount", format_currency(totals['pending']))
             
             with col3:
-                st.metric("Paid Amount", format_currency(total_paid))
+                st.metric("Overdue Amount", format_currency(totals['overdue']))
+            
+            with col4:
+                st.metric("Paid Amount", format_currency(totals['paid']))
             
             st.divider()
             
             # Filter options
-            col1, col2 = st.columns(2)
+            col1, col2, col3 = st.columns([2, 2, 1])
             with col1:
                 status_filter = st.selectbox("Filter by Status", ["all", "pending", "paid", "overdue"])
             with col2:
-                bill_type_filter = st.selectbox("Filter by Type", ["all", "Maintenance", "Electricity", "Water", "Parking", "Security", "Other"])
+                bill_type_filter = st.selectbox("Filter by Type", ["all", "Maintenance", "Electricity", "Water", "Parking", "Security", "Late Fee", "Other"])
+            with col3:
+                page = st.number_input("Page", min_value=1, value=1, key="bills_page")
             
-            # Apply filters
-            filtered_bills = bills
-            if status_filter != "all":
-                filtered_bills = [bill for bill in filtered_bills if bill['payment_status'] == status_filter]
-            if bill_type_filter != "all":
-                filtered_bills = [bill for bill in filtered_bills if bill['bill_type'] == bill_type_filter]
+            filtered_bills, has_more = self.db.get_user_bills_page(
+                user['flat_number'],
+                status=None if status_filter == "all" else status_filter,
+                bill_type=None if bill_type_filter == "all" else bill_type_filter,
+                limit=BILLS_PAGE_SIZE, offset=(page - 1) * BILLS_PAGE_SIZE
+            )
             
             # Display bills
             if filtered_bills:
@@ -192,25 +193,61 @@ class OwnerDashboard:
                         with col2:
                             if bill['payment_status'] in ['pending', 'overdue']:
                                 st.subheader("💳 Pay Now")
+                                outstanding = float(bill['amount'] - bill['amount_paid'])
+                                if bill['amount_paid']:
+                                    st.caption(f"Paid so far: {format_currency(bill['amount_paid'])}")
                                 
-                                payment_method = st.selectbox(
-                                    "Payment Method",
-                                    ["Online Banking", "UPI", "Credit Card", "Debit Card", "Cash"],
-                                    key=f"payment_method_{bill['bill_id']}"
-                                )
+                                # fully paid but not yet marked paid: there is nothing to enter
+                                if outstanding <= 0:
+                                    st.info("Nothing left to pay on this bill.")
+                                else:
+                                    payment_method = st.selectbox(
+                                        "Payment Method",
+                                        ["Online Banking", "UPI", "Credit Card", "Debit Card", "Cash"],
+                                        key=f"payment_method_{bill['bill_id']}"
+                                    )
+                                    pay_amount = st.number_input(
+                                        "Amount", min_value=0.01, max_value=outstanding, value=outstanding,
+                                        key=f"payment_amount_{bill['bill_id']}"
+                                    )
                                 
-                                if st.button("Pay Bill", key=f"pay_{bill['bill_id']}"):
-                                    try:
-                                        self.db.pay_bill(bill['bill_id'], payment_method)
-                                        st.success("Payment successful!")
-                                        st.rerun()
-                                    except Exception as e:
-                                        st.error(f"Payment failed: {e}")
+                                    if st.button("Pay Bill", key=f"pay_{bill['bill_id']}"):
+                                        try:
+                                            payment = self.db.pay_bill(bill['bill_id'], payment_method, pay_amount,
+                                                                       payment_idempotency_key(bill), user['user_id'])
+                                            if payment and payment['duplicate']:
+                                                st.info("This payment was already recorded.")
+                                            elif payment:
+                                                st.success("Payment successful!")
+                                            st.rerun()
+                                        except Exception as e:
+                                            st.error(f"Payment failed: {e}")
+                if has_more:
+                    st.caption(f"Showing page {page}. Older bills are on the next page.")
             else:
                 st.info("No bills found with the selected filters")
+            
+            self.show_account_statement(user['flat_number'])
         else:
             st.info("No bills found for your flat")
     
+    def show_account_statement(self, flat_number):
+        """Paginated ledger of charges, payments and adjustments"""
+        with st.expander("📒 Account Statement"):
+            page = st.number_input("Statement Page", min_value=1, value=1, key="ledger_page")
+            entries, has_more = self.db.get_ledger_page(flat_number, limit=BILLS_PAGE_SIZE,
+                                                        offset=(page - 1) * BILLS_PAGE_SIZE)
+            if entries:
+                st.dataframe(pd.DataFrame([{
+                    'Date': format_datetime(e['created_at']), 'Type': e['entry_type'].title(),
+                    'Description': e['description'], 'Amount': format_currency(e['amount']),
+                    'Balance': format_currency(e['balance_after'])
+                } for e in entries]), use_container_width=True, hide_index=True)
+                if has_more:
+                    st.caption("Older entries are on the next page.")
+            else:
+                st.info("No entries on this page")
+    
     def show_complaints(self):
         """Show complaints management"""
         user = st.session_state.user
@@ -355,24 +392,8 @@ class OwnerDashboard:
             create_notification_display(unread_notifications, self.db, user['user_id'])
             st.divider()
         
-        # Get all notifications (read and unread) - Simple query
-        cursor = self.db.connection.cursor()
-        cursor.execute("SELECT * FROM notifications ORDER BY created_at DESC LIMIT 20", ())
-        notifs_data = cursor.fetchall()
-        
-        # Check read status for each notification
-        all_notifications = []
-        for n in notifs_data:
-            cursor.execute("SELECT read_at FROM notification_reads WHERE notification_id = %s AND user_id = %s", (n[0], user['user_id']))
-            read_result = cursor.fetchone()
-            all_notifications.append({
-                'notification_id': n[0],
-                'title': n[1],
-                'message': n[2],
-                'created_at': n[3],
-                'read_at': read_result[0] if read_result else None
-            })
-        cursor.close()
+        # Get the latest notifications for this user with their read receipt in one query
+        all_notifications = self.db.get_notifications_for_user(user['user_id'], limit=20)
         
         if all_notifications:
             st.subheader("📜 All Notifications")
@@ -430,9 +451,12 @@ class OwnerDashboard:
             st.subheader("🗳️ Active Polls")
             create_poll_display(active_polls, self.db, user['user_id'])
         
-        # get closed polls
-        cursor.execute("SELECT * FROM polls WHERE status = 'closed' ORDER BY created_at DESC LIMIT 10")
-        closed_polls = cursor.fetchall()
+        # get closed polls with their options and the user's votes in two batched queries
+        cursor.execute("SELECT poll_id, title, description, end_date FROM polls WHERE status = 'closed' ORDER BY created_at DESC LIMIT 10")
+        closed_polls = [{'poll_id': p[0], 'title': p[1], 'description': p[2], 'end_date': p[3]} for p in cursor.fetchall()]
+        poll_ids = [p['poll_id'] for p in closed_polls]
+        options_by_poll = self.db.get_poll_options(poll_ids)
+        user_votes = self.db.get_user_votes(user['user_id'], poll_ids)
         
         if closed_polls:
             st.subheader("📊 Recent Poll Results")
@@ -442,15 +466,8 @@ class OwnerDashboard:
                     st.write(poll['description'])
                     st.write(f"**End Date:** {format_date(poll['end_date'])}")
                     
-                    # Get results
-                    cursor.execute("""
-                        SELECT option_text, vote_count 
-                        FROM poll_options 
-                        WHERE poll_id = %s
-                        ORDER BY vote_count DESC
-                    """, (poll['poll_id'],))
-                    
-                    results = cursor.fetchall()
+                    results = sorted(((o['option_text'], o['vote_count']) for o in options_by_poll.get(poll['poll_id'], [])),
+                                 key=lambda r: r[1], reverse=True)
                     if results:
                         total_votes = sum(r[1] for r in results)
                         
@@ -462,17 +479,8 @@ class OwnerDashboard:
                         
                         st.write(f"**Total Votes:** {total_votes}")
                         
-                        # Check if user voted
-                        cursor.execute("""
-                            SELECT po.option_text 
-                            FROM votes v
-                            JOIN poll_options po ON v.option_id = po.option_id
-                            WHERE v.poll_id = %s AND v.user_id = %s
-                        """, (poll['poll_id'], user['user_id']))
-                        
-                        user_vote = cursor.fetchone()
-                        if user_vote:
-                            st.info(f"✅ You voted for: {user_vote['option_text']}")
+                        if poll['poll_id'] in user_votes:
+                            st.info(f"✅ You voted for: {user_votes[poll['poll_id']]}")
         
         if not active_polls and not closed_polls:
             st.info("No polls available")
@@ -500,6 +508,9 @@ class OwnerDashboard:
             </div>
         """, unsafe_allow_html=True)
         
+        create_guest_pass_section(self.db, user)
+        st.markdown("---")
+        
         # Get visitors for this flat
         visitors = self.db.get_visitors_for_flat(user['flat_number'], limit=20)
         
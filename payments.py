@@ -0,0 +1,199 @@
+"""Payment gateway callbacks: signed webhook events, stored first and applied in batches.
+
+The webhook (POST /api/payments/webhook in api.py) only verifies the
+signature and inserts the events into payment_events, so a month-end burst
+of confirmations never waits on bill row locks. The worker's
+'payment_events' job then applies them a batch at a time. Each batch takes
+the bill locks in bill_id order, writes all payments with one insert and
+all bill updates with one UPDATE ... FROM VALUES.
+
+Events are JSON objects:
+
+    {"event_id": "evt_123", "type": "payment.succeeded", "bill_id": 42,
+     "amount": 1500.00, "payment_method": "UPI", "gateway_ref": "pay_abc",
+     "idempotency_key": "checkout-42-1"}
+
+Gateways retry, so event_id and idempotency_key are both deduplicated: a
+repeated event is dropped on receipt and a repeated payment is ignored when
+applied. A payment larger than what is still due is capped at the due
+amount; nothing is recorded for a bill that is already settled.
+
+The signature is a hex HMAC-SHA256 of the raw body under
+PAYMENT_WEBHOOK_SECRET, sent as X-Gateway-Signature. Without that
+variable no webhook is accepted. fake_gateway.py sends such events for
+local testing.
+"""
+import hashlib
+import hmac
+import os
+from decimal import Decimal, InvalidOperation
+
+import psycopg2.extras
+
+EVENT_BATCH_SIZE = 500
+EVENT_TYPES = ('payment.succeeded', 'payment.failed')
+
+
+def webhook_secret():
+    """PAYMENT_WEBHOOK_SECRET, or None when it isn't set (then every webhook is rejected)"""
+    return os.getenv('PAYMENT_WEBHOOK_SECRET') or None
+
+
+def sign(body, secret):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature, secret=None):
+    secret = secret or webhook_secret()
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign(body, secret), signature.strip().lower())
+
+
+def store_events(db, events):
+    """Inserts new events; returns (accepted, duplicates)"""
+    rows = []
+    for event in events:
+        if not isinstance(event, dict) or not event.get('event_id'):
+            raise ValueError("every event needs an event_id")
+        rows.append((str(event['event_id']), psycopg2.extras.Json(event)))
+    if not rows:
+        return 0, 0
+    cursor = db.connection.cursor()
+    inserted = psycopg2.extras.execute_values(cursor, """
+        INSERT INTO payment_events (event_id, payload) VALUES %s
+        ON CONFLICT (event_id) DO NOTHING
+        RETURNING event_seq
+    """, rows, fetch=True)
+    cursor.close()
+    return len(inserted), len(rows) - len(inserted)
+
+
+def parse_payment(payload):
+    """(bill_id, amount, method, gateway_ref, idempotency_key) of a payment.succeeded event"""
+    try:
+        bill_id = int(payload['bill_id'])
+        amount = Decimal(str(payload['amount'])).quantize(Decimal('0.01'))
+    except (KeyError, TypeError, ValueError, InvalidOperation):
+        raise ValueError("bill_id and amount are required")
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    key = payload.get('idempotency_key') or f"gateway:{payload.get('gateway_ref') or payload['event_id']}"
+    return bill_id, amount, payload.get('payment_method') or 'Online', payload.get('gateway_ref'), str(key)[:100]
+
+
+def process_payment_events(db, batch_size=EVENT_BATCH_SIZE):
+    """Applies one batch of received events in one transaction; returns {status: count}"""
+    counts = {'applied': 0, 'ignored': 0, 'rejected': 0}
+    with db.transaction():
+        cursor = db.connection.cursor()
+        cursor.execute("""
+            SELECT event_seq, payload FROM payment_events
+            WHERE status = 'received'
+            ORDER BY event_seq
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (batch_size,))
+        events = cursor.fetchall()
+        if not events:
+            cursor.close()
+            return counts
+
+        outcome = {}  # event_seq -> (status, error)
+        payments = []  # (event_seq, bill_id, amount, method, gateway_ref, key)
+        for seq, payload in events:
+            if payload.get('type') not in EVENT_TYPES:
+                outcome[seq] = ('rejected', f"unknown event type {payload.get('type')!r}")
+            elif payload['type'] == 'payment.failed':
+                outcome[seq] = ('ignored', payload.get('reason') or 'payment failed at the gateway')
+            else:
+                try:
+                    payments.append((seq,) + parse_payment(payload))
+                except ValueError as e:
+                    outcome[seq] = ('rejected', str(e))
+
+        if payments:
+            # bill locks in a fixed order, so concurrent batches cannot deadlock; once they are held no
+            # other payment for these bills can commit, so the duplicate check below is final
+            cursor.execute("""
+                SELECT bill_id, flat_number, amount - amount_paid FROM bills
+                WHERE bill_id = ANY(%s) AND payment_status <> 'paid'
+                ORDER BY bill_id
+                FOR UPDATE
+            """, (sorted({p[1] for p in payments}),))
+            open_bills = {r[0]: [r[1], r[2]] for r in cursor.fetchall()}
+            cursor.execute("SELECT idempotency_key FROM payments WHERE idempotency_key = ANY(%s)",
+                           ([p[5] for p in payments],))
+            seen = {r[0] for r in cursor.fetchall()}
+
+            rows = []
+            for seq, bill_id, amount, method, gateway_ref, key in payments:
+                bill = open_bills.get(bill_id)
+                if key in seen:
+                    outcome[seq] = ('ignored', 'duplicate payment')
+                elif bill is None or bill[1] <= 0:
+                    outcome[seq] = ('ignored', 'bill not found or already settled')
+                else:
+                    applied = min(amount, bill[1])
+                    bill[1] -= applied
+                    seen.add(key)
+                    rows.append((bill_id, bill[0], applied, method, key, gateway_ref))
+                    outcome[seq] = ('applied', None if applied == amount else f"capped at {applied}")
+
+            if rows:
+                psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO payments (bill_id, flat_number, amount, payment_method, idempotency_key, gateway_ref)
+                    VALUES %s
+                """, rows, page_size=batch_size)
+                totals = {}
+                for bill_id, _, applied, method, _, _ in rows:
+                    totals[bill_id] = (totals.get(bill_id, (0, None))[0] + applied, method)
+                psycopg2.extras.execute_values(cursor, """
+                    UPDATE bills b SET
+                        amount_paid = b.amount_paid + v.paid,
+                        payment_status = CASE WHEN b.amount_paid + v.paid >= b.amount THEN 'paid' ELSE b.payment_status END,
+                        paid_at = CASE WHEN b.amount_paid + v.paid >= b.amount THEN CURRENT_TIMESTAMP ELSE b.paid_at END,
+                        payment_date = CURRENT_DATE, payment_method = v.method
+                    FROM (VALUES %s) AS v(bill_id, paid, method)
+                    WHERE b.bill_id = v.bill_id
+                """, [(bill_id, paid, method) for bill_id, (paid, method) in sorted(totals.items())],
+                    template="(%s, %s::numeric, %s)", page_size=batch_size)
+
+        psycopg2.extras.execute_values(cursor, """
+            UPDATE payment_events e SET status = v.status, error = v.error, processed_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(event_seq, status, error)
+            WHERE e.event_seq = v.event_seq
+        """, [(seq, status, error) for seq, (status, error) in outcome.items()],
+            template="(%s::bigint, %s, %s)", page_size=batch_size)
+        cursor.close()
+
+    for status, _ in outcome.values():
+        counts[status] += 1
+    return counts
+
+
+def get_payment_event_stats(db):
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT status, COUNT(*), MAX(received_at) FROM payment_events
+        WHERE status = 'received' OR processed_at > CURRENT_TIMESTAMP - INTERVAL '1 day'
+        GROUP BY status
+    """)
+    stats = {r[0]: {'count': r[1], 'last_received': r[2]} for r in cursor.fetchall()}
+    cursor.close()
+    return stats
+
+
+def get_recent_payments(db, limit=20):
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT p.payment_id, p.bill_id, p.flat_number, b.bill_type, p.amount, p.payment_method, p.gateway_ref,
+               p.created_at, b.payment_status
+        FROM payments p JOIN bills b ON b.bill_id = p.bill_id
+        ORDER BY p.payment_id DESC LIMIT %s
+    """, (limit,))
+    payments = [{'payment_id': r[0], 'bill_id': r[1], 'flat_number': r[2], 'bill_type': r[3], 'amount': r[4],
+                 'payment_method': r[5], 'gateway_ref': r[6], 'created_at': r[7], 'payment_status': r[8]}
+                for r in cursor.fetchall()]
+    cursor.close()
+    return payments
@@ -0,0 +1,245 @@
+"""Per-page SQL statement budgets, to catch N+1 query regressions.
+
+Every dashboard page is rendered headlessly (Streamlit AppTest) against a
+small and a large synthetic dataset while all cursors count the statements
+they execute. A page fails when it issues more than its budget, or when its
+count grows with the amount of data.
+
+The datasets are written with data_generator.py --reset, so point this at a
+throw-away database only:
+
+    python query_budget.py --database-url postgresql://localhost/societysync_budget
+    python query_budget.py --database-url ... --only visitor --verbose
+"""
+import argparse
+import os
+import sys
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# (module, class, method, role, extra session_state, max statements per render)
+PAGES = [
+    ("admin_dashboard", "AdminDashboard", "show_dashboard", "admin", {}, 12),
+    ("admin_dashboard", "AdminDashboard", "add_user_form", "admin", {'user_role_select': 'tenant'}, 4),
+    ("admin_dashboard", "AdminDashboard", "view_users", "admin", {}, 4),
+    ("admin_dashboard", "AdminDashboard", "user_details", "admin", {}, 6),
+    ("admin_dashboard", "AdminDashboard", "view_bills", "admin", {}, 4),
+    ("admin_dashboard", "AdminDashboard", "payment_tracking", "admin", {}, 10),
+    ("admin_dashboard", "AdminDashboard", "recurring_billing", "admin", {}, 3),
+    ("admin_dashboard", "AdminDashboard", "meter_billing", "admin", {}, 2),
+    ("admin_dashboard", "AdminDashboard", "late_fees_and_arrears", "admin", {}, 3),
+    ("admin_dashboard", "AdminDashboard", "bank_reconciliation", "admin", {}, 0),
+    ("admin_dashboard", "AdminDashboard", "view_all_complaints", "admin", {}, 2),
+    ("admin_dashboard", "AdminDashboard", "complaint_analytics", "admin", {}, 6),
+    ("admin_dashboard", "AdminDashboard", "current_visitors", "admin", {}, 3),
+    ("admin_dashboard", "AdminDashboard", "visitor_history", "admin", {}, 3),
+    ("admin_dashboard", "AdminDashboard", "visitor_analytics", "admin", {}, 3),
+    ("admin_dashboard", "AdminDashboard", "notification_history", "admin", {}, 2),
+    ("admin_dashboard", "AdminDashboard", "active_polls", "admin", {}, 2),
+    ("admin_dashboard", "AdminDashboard", "poll_results", "admin", {}, 3),
+    ("admin_dashboard", "AdminDashboard", "background_jobs", "admin", {}, 3),
+    ("admin_dashboard", "AdminDashboard", "data_exports", "admin", {}, 0),
+    ("owner_dashboard", "OwnerDashboard", "show", "owner", {}, 10),
+    ("owner_dashboard", "OwnerDashboard", "show_bills", "owner", {}, 6),
+    ("owner_dashboard", "OwnerDashboard", "view_my_complaints", "owner", {}, 3),
+    ("owner_dashboard", "OwnerDashboard", "show_notifications", "owner", {}, 2),
+    ("owner_dashboard", "OwnerDashboard", "show_polls", "owner", {}, 6),
+    ("owner_dashboard", "OwnerDashboard", "show_visitors", "owner", {}, 4),
+    ("tenant_dashboard", "TenantDashboard", "show", "tenant", {}, 12),
+    ("tenant_dashboard", "TenantDashboard", "show_bills", "tenant", {}, 6),
+    ("tenant_dashboard", "TenantDashboard", "view_my_complaints", "tenant", {}, 3),
+    ("tenant_dashboard", "TenantDashboard", "show_notifications", "tenant", {}, 2),
+    ("tenant_dashboard", "TenantDashboard", "show_polls", "tenant", {}, 6),
+    ("tenant_dashboard", "TenantDashboard", "show_rental_agreement", "tenant", {}, 4),
+    ("tenant_dashboard", "TenantDashboard", "show_visitors", "tenant", {}, 4),
+]
+
+# data_generator.py arguments; "large" has roughly 20x the rows of "small" everywhere
+DATASETS = {
+    'small': ["--flats", "20", "--years", "1", "--visitors", "300", "--complaints", "40",
+              "--notifications", "15", "--polls", "4"],
+    'large': ["--flats", "400", "--years", "3", "--visitors", "20000", "--complaints", "2000",
+              "--notifications", "300", "--polls", "40"],
+}
+
+
+class StatementCounter:
+    """Process-wide statement count; AppTest runs scripts on their own thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.statements = []
+
+    def add(self, query):
+        with self.lock:
+            self.count += 1
+            self.statements.append(query.decode() if isinstance(query, bytes) else str(query))
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.statements = []
+
+
+counter = StatementCounter()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        counter.add(query)
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        counter.add(query)
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        counter.add(sql)
+        return super().copy_expert(sql, file, size)
+
+
+class counting_connections:
+    """Makes every psycopg2.connect() in the app hand out CountingCursors"""
+
+    def __enter__(self):
+        self.original = psycopg2.connect
+
+        def connect(*args, **kwargs):
+            kwargs.setdefault('cursor_factory', CountingCursor)
+            return self.original(*args, **kwargs)
+
+        psycopg2.connect = connect
+        return self
+
+    def __exit__(self, *exc):
+        psycopg2.connect = self.original
+
+
+def page_script():
+    """Body of the AppTest script; it only sees what is in session_state"""
+    import importlib
+    import sys
+    import streamlit as st
+
+    spec = st.session_state["_budget_page"]
+    if spec['root'] not in sys.path:
+        sys.path.insert(0, spec['root'])
+    from database import Database
+
+    module = importlib.import_module(spec['module'])
+    page = getattr(module, spec['cls'])(Database())
+    getattr(page, spec['method'])()
+
+
+def load_session_users(db_url):
+    """The first generated user of each role, shaped like AuthManager's session user"""
+    connection = psycopg2.connect(db_url)
+    cursor = connection.cursor()
+    users = {}
+    for role in ('admin', 'owner', 'tenant'):
+        cursor.execute("""
+            SELECT user_id, username, role, flat_number, name, email, phone
+            FROM users WHERE role = %s ORDER BY user_id LIMIT 1
+        """, (role,))
+        row = cursor.fetchone()
+        if row:
+            users[role] = {'user_id': row[0], 'username': row[1], 'role': row[2], 'flat_number': row[3],
+                           'name': row[4], 'email': row[5], 'phone': row[6], 'password_changed': True}
+    cursor.close()
+    connection.close()
+    return users
+
+
+def render(page, user, timeout):
+    """Renders one page and returns (statement count, statements, error)"""
+    from streamlit.testing.v1 import AppTest
+
+    module, cls, method, role, extra_state, _ = page
+    at = AppTest.from_function(page_script, default_timeout=timeout)
+    at.session_state["_budget_page"] = {'root': ROOT, 'module': module, 'cls': cls, 'method': method}
+    at.session_state["logged_in"] = True
+    at.session_state["user"] = user
+    for key, value in extra_state.items():
+        at.session_state[key] = value
+
+    counter.reset()
+    at.run()
+    error = at.exception[0].value if len(at.exception) > 0 else None
+    return counter.count, list(counter.statements), error
+
+
+def measure(dataset, db_url, pages, timeout):
+    import data_generator
+
+    print(f"\nSeeding '{dataset}' dataset")
+    data_generator.main(["--reset", "--seed", "7", "--photo-ratio", "0"] + DATASETS[dataset])
+    users = load_session_users(db_url)
+
+    counts = {}
+    for page in pages:
+        name = f"{page[1]}.{page[2]}"
+        user = users.get(page[3])
+        if user is None:
+            counts[name] = (None, [], f"no {page[3]} user in dataset")
+            continue
+        render(page, user, timeout)  # warm-up: imports and the one-off schema check
+        counts[name] = render(page, user, timeout)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check per-page SQL statement budgets on small and large data")
+    parser.add_argument("--database-url", default=os.getenv('BUDGET_DATABASE_URL'),
+                        help="throw-away database, reset by this script (default: $BUDGET_DATABASE_URL)")
+    parser.add_argument("--only", help="check pages whose name contains this text")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per page render timeout in seconds")
+    parser.add_argument("--verbose", action="store_true", help="print the statements of failing pages")
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        raise SystemExit("Pass --database-url (or set BUDGET_DATABASE_URL); its data will be replaced")
+    # the app and data_generator connect through $DATABASE_URL
+    os.environ['DATABASE_URL'] = args.database_url
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    pages = [p for p in PAGES if not args.only or args.only in f"{p[1]}.{p[2]}"]
+    with counting_connections():
+        small = measure('small', args.database_url, pages, args.timeout)
+        large = measure('large', args.database_url, pages, args.timeout)
+
+    failures = 0
+    print(f"\n{'page':<42}{'budget':>8}{'small':>8}{'large':>8}")
+    for page in pages:
+        name = f"{page[1]}.{page[2]}"
+        budget = page[5]
+        small_count, _, small_error = small[name]
+        large_count, statements, large_error = large[name]
+
+        problems = []
+        if small_error or large_error:
+            problems.append(f"error: {small_error or large_error}")
+        elif large_count > budget:
+            problems.append(f"over budget ({large_count} > {budget})")
+        if not problems and large_count > small_count:
+            problems.append(f"grows with data ({small_count} -> {large_count})")
+
+        print(f"{name:<42}{budget:>8}{str(small_count):>8}{str(large_count):>8}  "
+              f"{'FAIL ' + '; '.join(problems) if problems else 'ok'}")
+        if problems:
+            failures += 1
+            if args.verbose:
+                for statement in statements:
+                    print(f"      {' '.join(statement.split())[:160]}")
+
+    print(f"\n{len(pages) - failures}/{len(pages)} pages within budget")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
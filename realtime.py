@@ -0,0 +1,213 @@
+"""Visitor approvals pushed from the gate to the flat (and back) over PostgreSQL LISTEN/NOTIFY.
+
+The gate inserts a request into visitor_approvals and a trigger NOTIFYs
+'visitor_approvals' on commit. So does every decision (see
+Database.create_tables). Each app process runs one Relay thread. It holds a
+dedicated connection that LISTENs on the channel and keeps the pending
+requests per flat and the latest decisions in memory. The resident's banner
+and the gate's status panel are Streamlit fragments that re-read that memory
+every POLL_SECONDS, without touching the database. A request therefore
+reaches an open resident session within about a second of being made.
+
+Every event carries the database time it was sent. The relay records how
+long each one took to arrive (push) and, for requests, to first appear on a
+resident's screen (shown). Both medians are on the gate screen. To measure
+the push path alone:
+
+    python realtime.py --benchmark 200
+"""
+import argparse
+import json
+import os
+import select
+import statistics
+import threading
+import time
+from collections import deque
+
+import psycopg2
+
+CHANNEL = 'visitor_approvals'
+POLL_SECONDS = 1
+RECONNECT_SECONDS = 5
+# decisions are kept this long for the gate screens that are waiting on them
+DECISION_TTL = 15 * 60
+
+
+class Relay(threading.Thread):
+    def __init__(self, dsn=None):
+        super().__init__(name="visitor-approval-relay", daemon=True)
+        self.dsn = dsn or os.getenv('DATABASE_URL')
+        self.pending = {}    # flat_number -> {approval_id: event}
+        self.decisions = {}  # approval_id -> event
+        self.push_ms = deque(maxlen=500)
+        self.shown_ms = deque(maxlen=500)
+        self.shown = set()
+        self.connected = False
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception as e:  # any failure reconnects; the thread must not die while marked connected
+                self.last_error = str(e)
+            self.connected = False
+            self.stopped.wait(RECONNECT_SECONDS)
+
+    def listen(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {CHANNEL}")
+            # anything requested, or answered within DECISION_TTL, while we weren't listening
+            cursor.execute("""
+                SELECT approval_id, flat_number, status, visitor_name, purpose, visitor_id, requested_at
+                FROM visitor_approvals
+                WHERE status = 'pending' OR decided_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            """, (DECISION_TTL,))
+            received = time.time()
+            with self.lock:
+                self.pending = {}
+                for approval_id, flat_number, status, visitor_name, purpose, visitor_id, requested_at in cursor.fetchall():
+                    event = {'approval_id': approval_id, 'flat_number': flat_number, 'status': status,
+                             'visitor_name': visitor_name, 'purpose': purpose, 'visitor_id': visitor_id,
+                             'requested_at': str(requested_at), 'received_at': received}
+                    if status == 'pending':
+                        self.pending.setdefault(flat_number, {})[approval_id] = event
+                    else:
+                        self.decisions[approval_id] = event
+            cursor.close()
+            self.connected = True
+            while not self.stopped.is_set():
+                if select.select([conn], [], [], RECONNECT_SECONDS) == ([], [], []):
+                    self.expire()
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.handle(json.loads(conn.notifies.pop(0).payload))
+        finally:
+            conn.close()
+
+    def handle(self, event):
+        received = time.time()
+        event['received_at'] = received
+        with self.lock:
+            if event.get('sent_at'):
+                self.push_ms.append((received - event['sent_at']) * 1000)
+            flat = self.pending.setdefault(event['flat_number'], {})
+            if event['status'] == 'pending':
+                flat[event['approval_id']] = event
+            else:
+                flat.pop(event['approval_id'], None)
+                self.decisions[event['approval_id']] = event
+
+    def expire(self):
+        cutoff = time.time() - DECISION_TTL
+        with self.lock:
+            for approval_id in [a for a, e in self.decisions.items() if e['received_at'] < cutoff]:
+                del self.decisions[approval_id]
+                self.shown.discard(approval_id)
+
+    def pending_for(self, flat_number):
+        with self.lock:
+            return sorted(self.pending.get(flat_number, {}).values(), key=lambda e: e['approval_id'])
+
+    def decision(self, approval_id):
+        with self.lock:
+            return self.decisions.get(approval_id)
+
+    def mark_shown(self, event):
+        """Records request -> resident screen latency, once per request"""
+        with self.lock:
+            if event['approval_id'] in self.shown or not event.get('sent_at'):
+                return
+            self.shown.add(event['approval_id'])
+            self.shown_ms.append((time.time() - event['sent_at']) * 1000)
+
+    def stats(self):
+        with self.lock:
+            return {'connected': self.connected, 'events': len(self.push_ms),
+                    'push_median_ms': statistics.median(self.push_ms) if self.push_ms else None,
+                    'shown_median_ms': statistics.median(self.shown_ms) if self.shown_ms else None}
+
+    def stop(self):
+        self.stopped.set()
+
+
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def get_relay():
+    """The process-wide relay, started on first use"""
+    global _relay
+    with _relay_lock:
+        if _relay is None:
+            _relay = Relay()
+            _relay.start()
+        return _relay
+
+
+def benchmark(count, flat_number, dsn=None):
+    """Commit -> LISTEN delivery latency in ms for count requests; the test rows are removed again"""
+    dsn = dsn or os.getenv('DATABASE_URL')
+    listener = psycopg2.connect(dsn)
+    listener.autocommit = True
+    writer = psycopg2.connect(dsn)
+    writer.autocommit = True
+    listen_cursor = listener.cursor()
+    listen_cursor.execute(f"LISTEN {CHANNEL}")
+    cursor = writer.cursor()
+    latencies, ids = [], []
+    try:
+        for i in range(count):
+            started = time.perf_counter()
+            # inserted as already cancelled, so no resident is asked about them
+            cursor.execute("""
+                INSERT INTO visitor_approvals (flat_number, visitor_name, purpose, status)
+                VALUES (%s, %s, 'latency benchmark', 'cancelled') RETURNING approval_id
+            """, (flat_number, f"Benchmark {i}"))
+            approval_id = cursor.fetchone()[0]
+            ids.append(approval_id)
+            while True:
+                if select.select([listener], [], [], 5) == ([], [], []):
+                    raise RuntimeError("no notification within 5s; is the trigger installed?")
+                listener.poll()
+                if any(json.loads(n.payload)['approval_id'] == approval_id for n in listener.notifies):
+                    listener.notifies.clear()
+                    break
+                listener.notifies.clear()
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        if ids:
+            cursor.execute("DELETE FROM visitor_approvals WHERE approval_id = ANY(%s)", (ids,))
+        writer.close()
+        listener.close()
+    latencies.sort()
+    return {'count': len(latencies), 'median_ms': statistics.median(latencies),
+            'p95_ms': latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1],
+            'max_ms': latencies[-1]}
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Visitor approval push latency")
+    parser.add_argument("--benchmark", type=int, default=100, metavar="N", help="requests to time")
+    parser.add_argument("--flat", help="flat to file the test requests under (default: the first allotted flat)")
+    args = parser.parse_args(argv)
+
+    db = Database()  # makes sure the table and trigger exist
+    flat_number = args.flat or (db.get_allotted_flat_numbers() or ["A101"])[0]
+    db.close_connection()
+    result = benchmark(args.benchmark, flat_number)
+    print(f"{result['count']} requests: median {result['median_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, "
+          f"max {result['max_ms']:.1f} ms from INSERT to LISTEN delivery")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Bank statement reconciliation: match statement credits to open bills and pay them in bulk.
+
+The statement is streamed line by line (CSV with a header row; common bank
+column names are recognised). All open bills are loaded once into in-memory
+indexes by bill id, flat and amount. Each credit is then matched in this
+order:
+
+1. a bill reference in the narration (BILL 1234, INV-1234, #1234)
+2. a flat number in the narration, then within that flat
+   an open bill of exactly that amount (the oldest if several),
+   all open bills when the credit equals their total, or
+   the oldest bills first when the credit is less than the total
+3. otherwise the line is unmatched; a credit that fits exactly one open bill
+   society-wide is reported as ambiguous with that bill as a suggestion
+
+A credit naming several flats, or more than a flat owes, is ambiguous.
+Matches are applied in one transaction as payments with the idempotency key
+bank:<reference>:<bill_id>. Re-importing the same statement is therefore
+harmless.
+
+    python reconciliation.py statement.csv            # report only
+    python reconciliation.py statement.csv --apply
+"""
+import argparse
+import csv
+import hashlib
+import io
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+import psycopg2.extras
+
+COLUMN_ALIASES = {
+    'date': ('date', 'txn date', 'transaction date', 'value date', 'posting date'),
+    'description': ('description', 'narration', 'particulars', 'remarks', 'details'),
+    'reference': ('reference', 'ref no', 'ref no.', 'reference no', 'utr', 'chq/ref no', 'cheque/ref no', 'ref'),
+    'credit': ('credit', 'credit amount', 'deposit', 'deposits', 'amount'),
+}
+BILL_REF = re.compile(r"(?:\bBILL|\bINV(?:OICE)?|#)\s*(?:NO\.?)?\s*[-:#]?\s*(\d{1,9})\b", re.IGNORECASE)
+TOKEN = re.compile(r"[A-Z0-9]+")
+PAYMENT_METHOD = "Bank Transfer"
+
+
+def parse_amount(value):
+    cleaned = re.sub(r"[^\d.\-]", "", (value or "").replace(",", ""))
+    try:
+        return Decimal(cleaned).quantize(Decimal('0.01')) if cleaned else None
+    except InvalidOperation:
+        return None
+
+
+def statement_lines(source):
+    """Yields (line_no, date, description, reference, credit) for every credit line of a CSV statement"""
+    if isinstance(source, str):
+        source = open(source, newline='', encoding='utf-8-sig')
+    elif not isinstance(source, io.TextIOBase):
+        source = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+    with source:
+        reader = csv.reader(source)
+        header = [h.strip().lower() for h in next(reader, [])]
+        columns = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            columns[field] = next((header.index(a) for a in aliases if a in header), None)
+        if columns['credit'] is None or columns['description'] is None:
+            raise ValueError("The statement needs a description/narration and a credit/amount column")
+
+        def cell(row, field):
+            index = columns[field]
+            return row[index].strip() if index is not None and index < len(row) else ""
+
+        for line_no, row in enumerate(reader, start=2):
+            credit = parse_amount(cell(row, 'credit'))
+            if credit is None or credit <= 0:
+                continue  # debits and blank lines
+            yield line_no, cell(row, 'date'), cell(row, 'description'), cell(row, 'reference'), credit
+
+
+class OpenBills:
+    """Open bills indexed by id, flat and amount; due amounts shrink as credits are matched"""
+
+    def __init__(self, rows):
+        self.by_id = {}
+        self.by_flat = {}
+        self.by_amount = {}
+        for bill_id, flat_number, bill_type, due, due_date in rows:
+            bill = {'bill_id': bill_id, 'flat_number': flat_number, 'bill_type': bill_type, 'due': due,
+                    'due_date': due_date}
+            self.by_id[bill_id] = bill
+            self.by_flat.setdefault(flat_number, []).append(bill)
+            self.by_amount.setdefault(due, []).append(bill)
+        # narration tokens like "A-101" or "a101" -> A101
+        self.flat_keys = {re.sub(r"[^A-Z0-9]", "", f.upper()): f for f in self.by_flat}
+
+    @classmethod
+    def load(cls, db):
+        cursor = db.connection.cursor()
+        cursor.execute("""
+            SELECT bill_id, flat_number, bill_type, amount - amount_paid, due_date
+            FROM bills WHERE payment_status <> 'paid' AND amount > amount_paid
+            ORDER BY due_date, bill_id
+        """)
+        bills = cls(cursor.fetchall())
+        cursor.close()
+        return bills
+
+    def flats_in(self, text):
+        tokens = TOKEN.findall(text.upper())
+        # "A101" as well as "A-101" / "A 101", which tokenize as two
+        candidates = tokens + [a + b for a, b in zip(tokens, tokens[1:]) if b.isdigit()]
+        found = []
+        for token in candidates:
+            flat = self.flat_keys.get(token)
+            if flat and flat not in found:
+                found.append(flat)
+        return found
+
+    def open_for_flat(self, flat):
+        return [b for b in self.by_flat.get(flat, []) if b['due'] > 0]
+
+
+def match_line(bills, description, reference, credit):
+    """Returns (status, allocations [(bill, amount)], method or reason)"""
+    text = f"{description} {reference}"
+    for bill_ref in BILL_REF.findall(text):
+        bill = bills.by_id.get(int(bill_ref))
+        if bill and bill['due'] > 0:
+            if credit > bill['due']:
+                return 'ambiguous', [(bill, bill['due'])], f"more than bill #{bill['bill_id']} still owes"
+            return 'matched', [(bill, credit)], 'bill reference'
+
+    flats = bills.flats_in(text)
+    if len(flats) > 1:
+        return 'ambiguous', [], f"several flats mentioned ({', '.join(flats)})"
+    if flats:
+        open_bills = bills.open_for_flat(flats[0])
+        if not open_bills:
+            return 'unmatched', [], f"flat {flats[0]} has nothing to pay"
+        exact = [b for b in open_bills if b['due'] == credit]
+        if exact:
+            return 'matched', [(exact[0], credit)], 'flat and amount'
+        total = sum(b['due'] for b in open_bills)
+        if credit > total:
+            return 'ambiguous', [], f"more than flat {flats[0]} owes ({total})"
+        allocations, left = [], credit
+        for bill in open_bills:
+            if left <= 0:
+                break
+            part = min(left, bill['due'])
+            allocations.append((bill, part))
+            left -= part
+        return 'matched', allocations, 'all open bills of the flat' if credit == total else 'flat, oldest bills first'
+
+    candidates = [b for b in bills.by_amount.get(credit, []) if b['due'] == credit]
+    if len(candidates) == 1:
+        return 'ambiguous', [(candidates[0], credit)], "no flat or bill reference; one bill has this amount"
+    return 'unmatched', [], "no flat or bill reference"
+
+
+def line_key(date, description, reference, credit, occurrence=1):
+    """Import key of a statement line. Without a bank reference, identical lines on one day are told apart
+    by occurrence (1 for the first such line in the statement), so re-importing skips exactly the same lines"""
+    if reference:
+        return reference[:60]
+    text = f"{date}|{description}|{credit}" + (f"|{occurrence}" if occurrence > 1 else "")
+    return hashlib.sha1(text.encode()).hexdigest()[:20]
+
+
+def reconcile(db, source):
+    """Matches a statement against the open bills; returns the report (nothing is written)"""
+    bills = OpenBills.load(db)
+    report = {'matched': [], 'ambiguous': [], 'unmatched': [], 'lines': 0, 'credited': Decimal('0')}
+    seen = {}  # (date, description, credit) -> lines so far, for lines without a reference
+    for line_no, date, description, reference, credit in statement_lines(source):
+        report['lines'] += 1
+        occurrence = seen[(date, description, credit)] = seen.get((date, description, credit), 0) + 1
+        report['credited'] += credit
+        status, allocations, note = match_line(bills, description, reference, credit)
+        if status == 'matched':
+            for bill, amount in allocations:
+                bill['due'] -= amount  # later lines see what is left
+        report[status].append({
+            'line': line_no, 'date': date, 'description': description, 'reference': reference, 'credit': credit,
+            'note': note, 'key': line_key(date, description, reference, credit, occurrence),
+            'allocations': [{'bill_id': b['bill_id'], 'flat_number': b['flat_number'], 'bill_type': b['bill_type'],
+                             'amount': amount} for b, amount in allocations],
+        })
+    return report
+
+
+def apply_matches(db, report, created_by=None):
+    """Writes the matched allocations as payments in one transaction; returns {'payments', 'amount', 'skipped'}"""
+    allocations = [(a['bill_id'], a['amount'], f"bank:{m['key']}:{a['bill_id']}"[:100], m['reference'] or None)
+                   for m in report['matched'] for a in m['allocations']]
+    result = {'payments': 0, 'amount': Decimal('0'), 'skipped': 0}
+    if not allocations:
+        return result
+    with db.transaction():
+        cursor = db.connection.cursor()
+        # same order as payments.process_payment_events, so the two never deadlock
+        cursor.execute("""
+            SELECT bill_id, flat_number, amount - amount_paid FROM bills
+            WHERE bill_id = ANY(%s) AND payment_status <> 'paid'
+            ORDER BY bill_id
+            FOR UPDATE
+        """, (sorted({a[0] for a in allocations}),))
+        open_bills = {r[0]: [r[1], r[2]] for r in cursor.fetchall()}
+        cursor.execute("SELECT idempotency_key FROM payments WHERE idempotency_key = ANY(%s)",
+                       ([a[2] for a in allocations],))
+        seen = {r[0] for r in cursor.fetchall()}
+
+        rows = []
+        for bill_id, amount, key, reference in allocations:
+            bill = open_bills.get(bill_id)
+            if key in seen or bill is None or bill[1] <= 0:
+                result['skipped'] += 1  # already imported, or paid since the report was made
+                continue
+            applied = min(amount, bill[1])
+            bill[1] -= applied
+            seen.add(key)
+            rows.append((bill_id, bill[0], applied, PAYMENT_METHOD, key, reference, created_by))
+
+        if rows:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO payments (bill_id, flat_number, amount, payment_method, idempotency_key, gateway_ref,
+                                      created_by)
+                VALUES %s
+            """, rows, page_size=1000)
+            totals = {}
+            for row in rows:
+                totals[row[0]] = totals.get(row[0], 0) + row[2]
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE bills b SET
+                    amount_paid = b.amount_paid + v.paid,
+                    payment_status = CASE WHEN b.amount_paid + v.paid >= b.amount THEN 'paid' ELSE b.payment_status END,
+                    paid_at = CASE WHEN b.amount_paid + v.paid >= b.amount THEN CURRENT_TIMESTAMP ELSE b.paid_at END,
+                    payment_date = CURRENT_DATE, payment_method = v.method
+                FROM (VALUES %s) AS v(bill_id, paid, method)
+                WHERE b.bill_id = v.bill_id
+            """, [(bill_id, paid, PAYMENT_METHOD) for bill_id, paid in sorted(totals.items())],
+                template="(%s, %s::numeric, %s)", page_size=1000)
+        cursor.close()
+    result['payments'] = len(rows)
+    result['amount'] = sum((r[2] for r in rows), Decimal('0'))
+    return result
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Match a bank statement CSV to open bills")
+    parser.add_argument("statement", help="CSV statement with a header row")
+    parser.add_argument("--apply", action="store_true", help="record the matched payments")
+    parser.add_argument("--show", type=int, default=20, help="unmatched/ambiguous lines to list")
+    args = parser.parse_args(argv)
+
+    db = Database()
+    started = time.perf_counter()
+    report = reconcile(db, args.statement)
+    print(f"{report['lines']} credit lines ({report['credited']}) in {time.perf_counter() - started:.2f}s: "
+          f"{len(report['matched'])} matched, {len(report['ambiguous'])} ambiguous, "
+          f"{len(report['unmatched'])} unmatched")
+    for status in ('ambiguous', 'unmatched'):
+        for line in report[status][:args.show]:
+            print(f"  {status:<9} line {line['line']:>5} {line['credit']:>10} {line['description'][:50]:<50} "
+                  f"{line['note']}")
+    if args.apply:
+        result = apply_matches(db, report)
+        print(f"Recorded {result['payments']} payments ({result['amount']}) in {time.perf_counter() - started:.2f}s; "
+              f"{result['skipped']} already recorded or no longer due")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,10 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
-from datetime import datetime, date
+from datetime import datetime, date, time, timedelta
 import hashlib
+import uuid
+from realtime import POLL_SECONDS, get_relay
 
 def create_sidebar_navigation(user_role, auth_manager):
     """Create sidebar navigation based on user role"""
@@ -40,6 +42,8 @@ def create_sidebar_navigation(user_role, auth_manager):
             "🚶 Visitors",
             "📢 Notifications",
             "🗳️ Polls",
+            "⚙️ Background Jobs",
+            "📤 Exports",
             "👤 Profile"
         ]
     else:  # owner or tenant
@@ -224,8 +228,16 @@ def get_flats_with_occupants():
         db = Database()
         cursor = db.connection.cursor()
         
-        # Get all flats with their occupants - using basic join
-        cursor.execute("SELECT DISTINCT u.flat_number, u.name, u.role, u.user_id FROM users u WHERE u.flat_number IS NOT NULL AND u.role != 'admin' ORDER BY u.flat_number, u.role DESC")
+        # Get all flats with their occupants and the tenant's owner in one query
+        cursor.execute("""
+            SELECT DISTINCT u.flat_number, u.name, u.role, u.user_id, ou.name
+            FROM users u
+            LEFT JOIN tenants t ON u.role = 'tenant' AND t.user_id = u.user_id
+            LEFT JOIN owners o ON t.owner_id = o.owner_id
+            LEFT JOIN users ou ON o.user_id = ou.user_id
+            WHERE u.flat_number IS NOT NULL AND u.role != 'admin'
+            ORDER BY u.flat_number, u.role DESC
+        """)
         
         flats_data = cursor.fetchall()
         
@@ -245,13 +257,8 @@ def get_flats_with_occupants():
             else:
                 occupancy_type = 'Unknown'
             
-            # get owner name if tenant - basic join
-            owner_name = None
-            if role == 'tenant':
-                cursor.execute("SELECT u.name FROM tenants t JOIN owners o ON t.owner_id = o.owner_id JOIN users u ON o.user_id = u.user_id WHERE t.user_id = %s", (user_id,))
-                owner_result = cursor.fetchone()
-                if owner_result:
-                    owner_name = owner_result[0]
+            # owner name of a tenant comes from the join above
+            owner_name = flat_data[4]
             
             flat_data = (flat_number, name, role, occupancy_type, owner_name)
             flat_num = flat_data[0]
@@ -315,15 +322,9 @@ def get_flat_display_options():
         return {}
 
 def check_overdue_bills(db):
-    """Check and update overdue bills"""
+    """Queue an overdue sweep; the background worker updates the bills"""
     try:
-        cursor = db.connection.cursor()
-        cursor.execute("""
-            UPDATE bills 
-            SET payment_status = 'overdue' 
-            WHERE payment_status = 'pending' AND due_date < CURRENT_DATE
-        """)
-        cursor.close()
+        db.enqueue_job('overdue_sweep', dedupe_key='overdue_sweep')
     except Exception as e:
         st.error(f"Error checking overdue bills: {e}")
 
@@ -344,6 +345,104 @@ def create_notification_display(notifications, db, user_id):
                     st.success("Marked as read!")
                     st.rerun()
 
+@st.fragment(run_every=POLL_SECONDS)
+def visitor_approval_banner(db, user):
+    """Visitors at the gate waiting for this flat to let them in, pushed by realtime.Relay"""
+    relay = get_relay()
+    if relay.connected:
+        requests = relay.pending_for(user['flat_number'])
+    else:
+        requests = db.get_visitor_approvals(user['flat_number'])
+    for request in requests:
+        relay.mark_shown(request)
+        col1, col2, col3 = st.columns([4, 1, 1])
+        with col1:
+            purpose = f" ({request['purpose']})" if request.get('purpose') else ""
+            st.warning(f"🚪 **{request['visitor_name']}**{purpose} is at the gate for Flat {request['flat_number']}")
+        with col2:
+            approve = st.button("✅ Let in", key=f"approve_visitor_{request['approval_id']}", type="primary")
+        with col3:
+            deny = st.button("🚫 Deny", key=f"deny_visitor_{request['approval_id']}")
+        if approve or deny:
+            if db.decide_visitor_approval(request['approval_id'], approve, user['user_id'], user['flat_number']):
+                st.toast(f"{'Approved' if approve else 'Denied'}; the gate has been told")
+            else:
+                st.toast("Someone else already answered this request")
+
+def create_guest_pass_section(db, user):
+    """Guest passes for the user's flat: create one for an expected visitor, list and cancel them"""
+    st.subheader("🎫 Guest Passes")
+    st.caption("Give your visitor a pass code; the gate checks it and lets them in without calling you.")
+    
+    with st.form("guest_pass_form", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            visitor_name = st.text_input("Visitor Name", key="guest_pass_name")
+            visitor_phone = st.text_input("Visitor Phone (Optional)", key="guest_pass_phone")
+            purpose = st.text_input("Purpose (Optional)", key="guest_pass_purpose")
+            vehicle_number = st.text_input("Vehicle Number (Optional)", key="guest_pass_vehicle")
+        with col2:
+            visit_date = st.date_input("Visit Date", value=date.today(), min_value=date.today(), key="guest_pass_date")
+            valid_days = st.number_input("Valid for (days)", min_value=1, max_value=30, value=1, key="guest_pass_days")
+            max_uses = st.number_input("Entries allowed", min_value=1, max_value=50, value=1, key="guest_pass_uses",
+                                       help="More than one for e.g. a caterer coming and going during a function")
+        submit = st.form_submit_button("Create Pass")
+        if submit:
+            if not visitor_name.strip():
+                st.error("Please enter the visitor's name")
+            elif visitor_phone and not validate_phone(visitor_phone):
+                st.error("Please enter a valid 10-digit phone number")
+            else:
+                valid_from = datetime.combine(visit_date, time.min)
+                pass_id, code = db.create_visitor_pass(
+                    user['flat_number'], user['user_id'], visitor_name.strip(), max(valid_from, datetime.now()),
+                    valid_from + timedelta(days=int(valid_days)), visitor_phone=visitor_phone.strip(),
+                    purpose=purpose.strip(), vehicle_number=vehicle_number.strip(), max_uses=int(max_uses))
+                # only the hash is stored, so the code can't be shown again later
+                st.session_state.guest_pass_created = (pass_id, code, visitor_name.strip())
+    
+    if st.session_state.get('guest_pass_created'):
+        pass_id, code, visitor_name = st.session_state.guest_pass_created
+        st.success(f"Pass for {visitor_name}: **{code}**")
+        st.caption("Share this code now; it is not shown again. The gate can type it or scan it as a QR code.")
+        try:
+            import io
+            import qrcode
+            
+            image = qrcode.make(code)
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            st.image(buffer.getvalue(), caption=code, width=180)
+        except ImportError:
+            pass  # qrcode is optional; the code alone works at the gate
+    
+    passes = db.get_visitor_passes(user['flat_number'])
+    for guest_pass in passes:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            if guest_pass['revoked_at']:
+                state = "❌ Cancelled"
+            elif guest_pass['active'] and guest_pass['valid_from'] > datetime.now():
+                state = "🕒 Upcoming"
+            elif guest_pass['active']:
+                state = "🟢 Active"
+            elif guest_pass['uses'] >= guest_pass['max_uses']:
+                state = "✅ Used"
+            else:
+                state = "⌛ Expired"
+            st.write(f"{state} · **{guest_pass['visitor_name']}** · {format_datetime(guest_pass['valid_from'])} → "
+                     f"{format_datetime(guest_pass['valid_until'])} · {guest_pass['uses']}/{guest_pass['max_uses']} entries")
+        with col2:
+            if guest_pass['active'] and st.button("Cancel", key=f"revoke_pass_{guest_pass['pass_id']}"):
+                db.revoke_visitor_pass(guest_pass['pass_id'], user['flat_number'])
+                st.rerun()
+
+def payment_idempotency_key(bill):
+    """Same key for repeated clicks on one rendered bill; a new one once its paid amount changes"""
+    if 'payment_session' not in st.session_state:
+        st.session_state.payment_session = uuid.uuid4().hex
+    return f"ui:{st.session_state.payment_session}:{bill['bill_id']}:{bill.get('amount_paid') or 0}"
+
 def generate_unique_key(prefix, obj, index=None):
     """
     Generate a unique key for Streamlit elements
@@ -381,42 +480,32 @@ def create_poll_display(polls, db, user_id):
         st.info("No active polls")
         return
     
+    # Options and this user's votes for every poll in two queries
+    poll_ids = [poll['poll_id'] for poll in polls]
+    options_by_poll = db.get_poll_options(poll_ids)
+    user_votes = db.get_user_votes(user_id, poll_ids)
+    
     for poll in polls:
         st.subheader(f"🗳️ {poll['title']}")
         st.write(poll['description'])
         
-        # Check if user has already voted
-        cursor = db.connection.cursor()
-        cursor.execute("""
-            SELECT * FROM votes WHERE poll_id = %s AND user_id = %s
-        """, (poll['poll_id'], user_id))
-        
-        has_voted = cursor.fetchone() is not None
+        options = options_by_poll.get(poll['poll_id'], [])
+        has_voted = poll['poll_id'] in user_votes
         
         if has_voted:
             st.info("✅ You have already voted in this poll")
             
             # Show results
-            cursor.execute("""
-                SELECT option_text, vote_count 
-                FROM poll_options 
-                WHERE poll_id = %s
-                ORDER BY vote_count DESC
-            """, (poll['poll_id'],))
-            
-            results = cursor.fetchall()
-            if results and len(results) > 0:
-                results_df = pd.DataFrame(results, columns=['Option', 'Votes'])
+            if options:
+                ranked = sorted(options, key=lambda o: o['vote_count'], reverse=True)
+                results_df = pd.DataFrame([(o['option_text'], o['vote_count']) for o in ranked], columns=['Option', 'Votes'])
                 fig = create_bar_chart(results_df, 'Option', 'Votes', "Poll Results")
                 if fig:
                     st.plotly_chart(fig, use_container_width=True, theme="streamlit")
         else:
             # Show voting options
-            cursor.execute("SELECT option_id, option_text FROM poll_options WHERE poll_id = %s", (poll['poll_id'],))
-            
-            options = cursor.fetchall()
-            if options and len(options) > 0:
-                option_texts = [opt[1] for opt in options]
+            if options:
+                option_texts = [o['option_text'] for o in options]
                 selected_option = st.radio(
                     "Select your choice:",
                     option_texts,
@@ -425,18 +514,15 @@ def create_poll_display(polls, db, user_id):
                 
                 if st.button(f"Vote", key=f"vote_{poll['poll_id']}"):
                     # Find selected option_id
-                    selected_option_id = next(opt[0] for opt in options if opt[1] == selected_option)
+                    selected_option_id = next(o['option_id'] for o in options if o['option_text'] == selected_option)
                     
-                    # Record vote
-                    cursor.execute("INSERT INTO votes (poll_id, option_id, user_id) VALUES (%s, %s, %s)", (poll['poll_id'], selected_option_id, user_id))
-                    
-                    # Update vote count
-                    cursor.execute("UPDATE poll_options SET vote_count = vote_count + 1 WHERE option_id = %s", (selected_option_id,))
-                    
-                    st.success("Vote recorded successfully!")
+                    # Record vote and update the vote count
+                    if db.cast_vote(poll['poll_id'], selected_option_id, user_id):
+                        st.success("Vote recorded successfully!")
+                    else:
+                        st.warning("Your vote was already recorded")
                     st.rerun()
         
-        cursor.close()
         st.divider()
 
 
@@ -0,0 +1,89 @@
+"""Visitor traffic analytics from the rollup tables, never the raw visitors table.
+
+Statement-level triggers on visitors (see database.py) keep two rollups up
+to date as visitors are logged and checked out:
+
+    visitor_hourly        hour x block: visits, checkouts, total dwell seconds
+    visitor_flat_monthly  month x flat: the same per flat
+
+A visit counts in the hour and month it started. Dwell time is added once
+the visitor is checked out, and averages are over checked-out visits. Years
+of history are a few hundred thousand rollup rows at most.
+
+    python visitor_analytics.py --since 2025-01-01
+"""
+import argparse
+from datetime import datetime
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def traffic_heatmap(db, since=None, block=None):
+    """{(weekday 0=Mon, hour): {'visits', 'checkouts', 'dwell_seconds'}}"""
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT EXTRACT(ISODOW FROM hour)::int - 1, EXTRACT(HOUR FROM hour)::int,
+               SUM(visits), SUM(checkouts), SUM(dwell_seconds)
+        FROM visitor_hourly
+        WHERE hour >= COALESCE(%s, '-infinity'::timestamp) AND (%s IS NULL OR block = %s)
+        GROUP BY 1, 2
+    """, (since, block, block))
+    cells = {(r[0], r[1]): {'visits': r[2], 'checkouts': r[3], 'dwell_seconds': r[4]} for r in cursor.fetchall()}
+    cursor.close()
+    return cells
+
+
+def block_summary(db, since=None):
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT block, SUM(visits), SUM(checkouts), SUM(dwell_seconds), COUNT(DISTINCT hour::date)
+        FROM visitor_hourly
+        WHERE hour >= COALESCE(%s, '-infinity'::timestamp)
+        GROUP BY block ORDER BY block
+    """, (since,))
+    blocks = [{'block': r[0], 'visits': r[1], 'checkouts': r[2],
+               'avg_dwell_minutes': r[3] / r[2] / 60 if r[2] else None, 'active_days': r[4]}
+              for r in cursor.fetchall()]
+    cursor.close()
+    return blocks
+
+
+def flat_frequency(db, since=None, limit=20):
+    """Flats with the most visits, with their average dwell time"""
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT flat_number, SUM(visits), SUM(checkouts), SUM(dwell_seconds), COUNT(*)
+        FROM visitor_flat_monthly
+        WHERE month >= date_trunc('month', COALESCE(%s, '-infinity'::date))
+        GROUP BY flat_number
+        ORDER BY 2 DESC, flat_number
+        LIMIT %s
+    """, (since, limit))
+    flats = [{'flat_number': r[0], 'visits': r[1], 'checkouts': r[2],
+              'avg_dwell_minutes': r[3] / r[2] / 60 if r[2] else None, 'months': r[4],
+              'visits_per_month': r[1] / r[4]} for r in cursor.fetchall()]
+    cursor.close()
+    return flats
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Visitor traffic by weekday and hour")
+    parser.add_argument("--since", type=lambda v: datetime.strptime(v, "%Y-%m-%d").date())
+    parser.add_argument("--block")
+    args = parser.parse_args(argv)
+
+    db = Database()
+    cells = traffic_heatmap(db, args.since, args.block)
+    print("     " + "".join(f"{h:>6}" for h in range(24)))
+    for day, name in enumerate(WEEKDAYS):
+        print(f"{name:<5}" + "".join(f"{cells.get((day, h), {}).get('visits', 0):>6}" for h in range(24)))
+    for block in block_summary(db, args.since):
+        dwell = f"{block['avg_dwell_minutes']:.0f} min" if block['avg_dwell_minutes'] is not None else "-"
+        print(f"Block {block['block']}: {block['visits']} visits, average stay {dwell}")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
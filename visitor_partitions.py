@@ -0,0 +1,171 @@
+"""Monthly partitions of the visitors table: creation, retention and archival.
+
+visitors is range-partitioned on entry_time, one table per month
+(visitors_YYYY_MM) plus visitors_default for anything outside them. Queries
+bounded by entry_time (visitor history, get_all_visitors, exports) only read
+the months they cover. Database.ensure_visitor_partitions keeps the months
+up to VISITOR_PARTITION_MONTHS_AHEAD created. The daily worker job does that
+and, once it is configured, applies a retention policy (off by default):
+
+    VISITOR_RETENTION_MONTHS   months kept in visitors (default 0: keep everything)
+    VISITOR_RETENTION_ACTION   detach: older months become standalone tables, still queryable by name
+                               archive: they are also written to VISITOR_ARCHIVE_DIR as gzipped CSV and dropped
+
+Detaching or dropping a partition fires no delete triggers, so the visitor
+rollups and profiles keep the history. Rebuilding them from scratch only
+sees the months still attached. Databases made before partitioning
+(or from societysync_schema.sql) are converted once, under an exclusive lock:
+
+    python visitor_partitions.py --migrate
+    python visitor_partitions.py                 # list partitions
+    python visitor_partitions.py --apply --keep-months 24 --action archive
+"""
+import argparse
+import gzip
+import os
+from datetime import date
+
+RETENTION_MONTHS = int(os.getenv('VISITOR_RETENTION_MONTHS', '0'))
+RETENTION_ACTION = os.getenv('VISITOR_RETENTION_ACTION', 'detach')
+ARCHIVE_DIR = os.getenv('VISITOR_ARCHIVE_DIR', 'visitor_archive')
+ACTIONS = ('detach', 'archive')
+
+# copied across by --migrate, in the order of the original table
+COLUMNS = ['visitor_id', 'flat_number', 'visitor_name', 'visitor_phone', 'purpose', 'entry_time', 'exit_time',
+           'vehicle_number', 'logged_by', 'status', 'visitor_photo', 'client_ref', 'updated_at',
+           'auto_checked_out_at']
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_month(name):
+    """date of visitors_YYYY_MM, None for visitors_default"""
+    year, _, month = name[len("visitors_"):].partition("_")
+    return date(int(year), int(month), 1) if month else None
+
+
+def list_partitions(db):
+    """Attached and detached month tables, oldest first, with their estimated rows and size"""
+    cursor = db.connection.cursor()
+    cursor.execute("""
+        SELECT c.relname, i.inhrelid IS NOT NULL, GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'visitors'::regclass
+        WHERE c.relkind = 'r' AND c.relname ~ '^visitors_([0-9]{4}_[0-9]{2}|default)$' AND pg_table_is_visible(c.oid)
+        ORDER BY c.relname
+    """)
+    partitions = [{'name': r[0], 'month': partition_month(r[0]), 'attached': r[1], 'rows': r[2], 'bytes': r[3]}
+                  for r in cursor.fetchall()]
+    cursor.close()
+    return partitions
+
+
+def migrate(db):
+    """Converts an unpartitioned visitors table; returns the rows copied, or None if already partitioned.
+
+    One transaction: the old table is renamed and its rows are copied into the
+    new partitions, which have no indexes or triggers yet. Dropping the old table
+    frees the index and trigger names, create_tables then recreates them on the
+    new table, and the rollups and profiles are rebuilt from the same rows.
+    """
+    from database import VISITORS_TABLE
+
+    cursor = db.connection.cursor()
+    columns = ", ".join(COLUMNS)
+    with db.transaction():
+        cursor.execute("LOCK TABLE visitors IN ACCESS EXCLUSIVE MODE")
+        if db.visitors_partitioned():
+            return None
+        cursor.execute("SELECT MIN(entry_time) FROM visitors")
+        first = cursor.fetchone()[0]
+        cursor.execute("ALTER TABLE visitors RENAME TO visitors_unpartitioned")
+        cursor.execute("ALTER SEQUENCE visitors_visitor_id_seq OWNED BY NONE")
+        cursor.execute(VISITORS_TABLE)
+        db.ensure_visitor_partitions(start=first.date() if first else None)
+        cursor.execute(f"""
+            INSERT INTO visitors ({columns})
+            SELECT {columns.replace('entry_time', 'COALESCE(entry_time, CURRENT_TIMESTAMP)')}
+            FROM visitors_unpartitioned
+        """)
+        copied = cursor.rowcount
+        cursor.execute("DROP TABLE visitors_unpartitioned")
+        db.create_tables()
+        db.rebuild_visitor_rollups()
+        db.rebuild_visitor_profiles()
+    cursor.close()
+    return copied
+
+
+def archive_partition(db, name, archive_dir=ARCHIVE_DIR):
+    """Writes a detached month table to <archive_dir>/<name>.csv.gz, then drops it; returns the path"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    cursor = db.connection.cursor()
+    # the table is only dropped once the whole file is on disk
+    with gzip.open(path + ".part", "wb") as archive:
+        cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+    os.replace(path + ".part", path)
+    cursor.execute(f"DROP TABLE {name}")
+    cursor.close()
+    return path
+
+
+def apply_retention(db, keep_months=RETENTION_MONTHS, action=RETENTION_ACTION, archive_dir=ARCHIVE_DIR, today=None):
+    """Detaches the months older than keep_months; with action='archive' the detached months are archived.
+
+    Returns {'detached': [names], 'archived': [paths]}. Months detached by an
+    earlier run are archived too once the action is switched to 'archive'.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"retention action must be one of {', '.join(ACTIONS)}")
+    result = {'detached': [], 'archived': []}
+    if keep_months <= 0 or not db.visitors_partitioned():
+        return result
+    cutoff = add_months((today or date.today()).replace(day=1), -keep_months)
+    expired = [p for p in list_partitions(db) if p['month'] and p['month'] < cutoff]
+    cursor = db.connection.cursor()
+    for partition in expired:
+        if partition['attached']:
+            cursor.execute(f"ALTER TABLE visitors DETACH PARTITION {partition['name']}")
+            result['detached'].append(partition['name'])
+    cursor.close()
+    if action == 'archive':
+        result['archived'] = [archive_partition(db, p['name'], archive_dir) for p in expired]
+    return result
+
+
+def main(argv=None):
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Visitor partitions and retention")
+    parser.add_argument("--migrate", action="store_true", help="partition an existing unpartitioned visitors table")
+    parser.add_argument("--apply", action="store_true", help="create upcoming months and apply retention now")
+    parser.add_argument("--keep-months", type=int, default=RETENTION_MONTHS)
+    parser.add_argument("--action", choices=ACTIONS, default=RETENTION_ACTION)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args(argv)
+
+    db = Database()
+    if args.migrate:
+        copied = migrate(db)
+        print("visitors is already partitioned" if copied is None else f"{copied} visitors moved into monthly partitions")
+    if args.apply:
+        created = db.ensure_visitor_partitions()
+        result = apply_retention(db, args.keep_months, args.action, args.archive_dir)
+        print(f"{len(created)} partitions created, {len(result['detached'])} detached, "
+              f"{len(result['archived'])} archived")
+        for path in result['archived']:
+            print(f"  {path}")
+    if not db.visitors_partitioned():
+        print("visitors is not partitioned; run with --migrate")
+    for p in list_partitions(db):
+        print(f"{p['name']:<18} {'attached' if p['attached'] else 'detached':<9} "
+              f"{p['rows']:>10,} rows {p['bytes'] / 1e6:>9.1f} MB")
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""In-memory prefix index of frequent visitors for autofill at the gate.
+
+visitor_profiles holds one row per phone number (the last 10 digits). A
+trigger on visitors keeps it up to date, see Database.create_tables. This
+module keeps the sorted phone keys of every profile in memory, so
+lookup("98220") is two bisects instead of a query per keystroke. Photos stay
+in the database: the gate form fetches one only for the profile picked, and
+Database.log_known_visitor copies it into the new visit server-side.
+
+The index is loaded on first use, once per process. After that, profiles
+changed since the newest updated_at seen are pulled in, at most every
+REFRESH_SECONDS, so entries logged at other gates or kiosks show up within
+seconds.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import timedelta
+
+REFRESH_SECONDS = 5
+MIN_PREFIX = 3
+# a profile committed late can carry an updated_at older than the newest one already seen
+WATERMARK_OVERLAP = timedelta(seconds=30)
+
+
+def phone_key(phone):
+    """Profile key of a phone number: its last 10 digits (same as VISITOR_PROFILE_KEY in database.py)"""
+    return re.sub(r"[^0-9]", "", phone or "")[-10:]
+
+
+def prefix_key(text):
+    """Typed digits as a key prefix; a leading 0 or +91 is dropped"""
+    text = (text or "").strip()
+    digits = re.sub(r"[^0-9]", "", text)
+    if text.startswith("+91"):
+        digits = digits[2:]
+    return digits.lstrip("0")[-10:]
+
+
+class VisitorRegistry:
+    def __init__(self):
+        self.keys = []
+        self.profiles = {}
+        self.watermark = None
+        self.refreshed = 0
+        self.lock = threading.Lock()
+
+    def refresh(self, db, force=False):
+        """Pulls profiles changed since the last refresh; returns how many rows were read"""
+        if not force and self.refreshed and time.monotonic() - self.refreshed < REFRESH_SECONDS:
+            return 0
+        with self.lock:
+            changed = db.get_visitor_profiles(self.watermark - WATERMARK_OVERLAP if self.watermark else None)
+            for profile in changed:
+                if profile['phone_key'] not in self.profiles:
+                    insort(self.keys, profile['phone_key'])
+                self.profiles[profile['phone_key']] = profile
+                if self.watermark is None or profile['updated_at'] > self.watermark:
+                    self.watermark = profile['updated_at']
+            self.refreshed = time.monotonic()
+        return len(changed)
+
+    def lookup(self, text, limit=8):
+        """Profiles whose phone key starts with the typed digits, most frequent first"""
+        prefix = prefix_key(text)
+        if len(prefix) < MIN_PREFIX:
+            return []
+        with self.lock:
+            # keys are all digits, so every key with the prefix sorts before prefix + ":"
+            matches = [self.profiles[k] for k in self.keys[bisect_left(self.keys, prefix):bisect_right(self.keys, prefix + ":")]]
+        return sorted(matches, key=lambda p: (-p['visits'], p['visitor_name']))[:limit]
+
+    def get(self, key):
+        return self.profiles.get(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+_registry = VisitorRegistry()
+
+
+def get_registry(db):
+    """The process-wide registry, loaded on first use and refreshed if it is due"""
+    _registry.refresh(db)
+    return _registry
@@ -0,0 +1,275 @@
+"""Background job worker backed by the PostgreSQL jobs table.
+
+Request paths only enqueue work (Database.enqueue_job); this process runs it:
+
+    python worker.py                  # run until stopped (Ctrl+C / SIGTERM)
+    python worker.py --threads 4      # more jobs in parallel
+    python worker.py --once           # drain what is due now and exit
+
+Jobs are claimed with FOR UPDATE SKIP LOCKED, so any number of workers can
+share the queue. A failing job is retried with exponential backoff until
+max_attempts, then marked failed (and can be retried from the admin
+"⚙️ Background Jobs" page). Recurring jobs (overdue sweep, lease expiry,
+recurring billing, late fees, analytics sync, visitor auto-checkout, visitor
+partitions) come from the scheduled_jobs table, which is seeded by
+ensure_schedules().
+"""
+import argparse
+import base64
+import io
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from database import Database, VISITOR_MAX_STAY_HOURS
+
+OVERDUE_BATCH_SIZE = 5000
+PHOTO_MAX_SIDE = 640
+PHOTO_JPEG_QUALITY = 80
+MAX_BACKOFF_SECONDS = 3600
+
+
+# --- job handlers: handler(db, payload) -> short result text
+
+def overdue_sweep(db, payload):
+    batch_size = int(payload.get('batch_size', OVERDUE_BATCH_SIZE))
+    total = 0
+    while True:
+        count = db.mark_overdue_bills_batch(batch_size)
+        total += count
+        if count < batch_size:
+            return f"{total} bills marked overdue"
+
+
+def visitor_checkout_sweep(db, payload):
+    max_stay_hours = float(payload.get('max_stay_hours', VISITOR_MAX_STAY_HOURS))
+    batch_size = int(payload.get('batch_size', OVERDUE_BATCH_SIZE))
+    total = 0
+    while True:
+        count = db.auto_checkout_visitors_batch(max_stay_hours, batch_size)
+        total += count
+        if count < batch_size:
+            return f"{total} visitors checked out after {max_stay_hours:g}h"
+
+
+def visitor_partitions(db, payload):
+    import visitor_partitions as partitions
+
+    if not db.visitors_partitioned():
+        return "visitors is not partitioned; run visitor_partitions.py --migrate"
+    created = db.ensure_visitor_partitions()
+    result = partitions.apply_retention(db, int(payload.get('keep_months', partitions.RETENTION_MONTHS)),
+                                        payload.get('action', partitions.RETENTION_ACTION))
+    return (f"{len(created)} partitions created, {len(result['detached'])} detached, "
+            f"{len(result['archived'])} archived")
+
+
+def lease_expiry(db, payload):
+    count = db.notify_expiring_leases(int(payload.get('days_ahead', 30)))
+    return f"{count} lease notices sent"
+
+
+def monthly_billing(db, payload):
+    """Idempotent per period, so the daily run also picks up plans and tenants added mid-month"""
+    import billing_engine
+
+    period = payload.get('period') or datetime.now().date()
+    rows = billing_engine.generate_period(db, period, payload.get('created_by', 1))
+    return f"{sum(r['bills'] for r in rows)} bills created for {billing_engine.month_start(period)}"
+
+
+def late_fees(db, payload):
+    import late_fees as engine
+
+    created, updated, total = engine.apply_late_fees(db, created_by=payload.get('created_by', 1))
+    return f"{created} late fees created, {updated} raised"
+
+
+def payment_events(db, payload):
+    import payments
+
+    totals = {}
+    while True:
+        counts = payments.process_payment_events(db, int(payload.get('batch_size', payments.EVENT_BATCH_SIZE)))
+        for status, count in counts.items():
+            totals[status] = totals.get(status, 0) + count
+        if not any(counts.values()):
+            return ", ".join(f"{count} {status}" for status, count in totals.items())
+
+
+def analytics_sync(db, payload):
+    import analytics_store
+
+    copied = analytics_store.sync(db, full=bool(payload.get('full')))
+    return ", ".join(f"{count} {table}" for table, count in copied.items()) + " copied"
+
+
+def visitor_notification(db, payload):
+    message = f"Visitor {payload['visitor_name']} arrived at Flat {payload['flat_number']}"
+    db.create_notification_for_flat(payload['flat_number'], "New Visitor", message, payload.get('logged_by') or 1)
+    return "notified"
+
+
+def photo_processing(db, payload):
+    """Shrinks a stored visitor photo to a JPEG of at most PHOTO_MAX_SIDE pixels"""
+    from PIL import Image
+
+    # entry_time is missing from jobs queued before it was added to the payload
+    photo = db.get_visitor_photo(payload['visitor_id'], payload.get('entry_time'))
+    if not photo:
+        return "no photo"
+    original = base64.b64decode(photo)
+    image = Image.open(io.BytesIO(original))
+    image.thumbnail((PHOTO_MAX_SIDE, PHOTO_MAX_SIDE))
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=PHOTO_JPEG_QUALITY, optimize=True)
+    if output.tell() >= len(original):
+        return "already small"
+    db.update_visitor_photo(payload['visitor_id'], base64.b64encode(output.getvalue()).decode(),
+                            payload.get('entry_time'))
+    return f"{len(original)} -> {output.tell()} bytes"
+
+
+HANDLERS = {
+    'overdue_sweep': overdue_sweep,
+    'visitor_checkout_sweep': visitor_checkout_sweep,
+    'visitor_partitions': visitor_partitions,
+    'lease_expiry': lease_expiry,
+    'monthly_billing': monthly_billing,
+    'late_fees': late_fees,
+    'payment_events': payment_events,
+    'analytics_sync': analytics_sync,
+    'visitor_notification': visitor_notification,
+    'photo_processing': photo_processing,
+}
+
+# name, job_type, interval, first run (hour of day, None for right away)
+SCHEDULES = [
+    ("nightly_overdue_sweep", "overdue_sweep", 24 * 3600, 2),
+    ("daily_lease_expiry", "lease_expiry", 24 * 3600, 6),
+    ("daily_recurring_billing", "monthly_billing", 24 * 3600, 1),
+    ("daily_late_fees", "late_fees", 24 * 3600, 3),
+    ("daily_visitor_partitions", "visitor_partitions", 24 * 3600, 4),
+    # catches gateway events whose webhook arrived while a payment_events job was finishing
+    ("payment_events_sweep", "payment_events", 300, None),
+    ("analytics_sync", "analytics_sync", 900, None),
+    ("visitor_auto_checkout", "visitor_checkout_sweep", 900, None),
+]
+
+
+def ensure_schedules(db):
+    tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    for name, job_type, interval, hour in SCHEDULES:
+        first_run = datetime.now() if hour is None else tomorrow + timedelta(hours=hour)
+        db.ensure_scheduled_job(name, job_type, interval, first_run)
+
+
+def backoff_seconds(attempts):
+    return min(MAX_BACKOFF_SECONDS, 30 * 2 ** (attempts - 1))
+
+
+class Worker(threading.Thread):
+    def __init__(self, name, stopping, poll_interval=2.0, once=False):
+        super().__init__(name=name, daemon=True)
+        self.stopping = stopping
+        self.poll_interval = poll_interval
+        self.once = once
+        self.db = None
+
+    def run_job(self, job):
+        handler = HANDLERS.get(job['job_type'])
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"unknown job type {job['job_type']}")
+            result = handler(self.db, job['payload'] or {})
+            completed = self.db.complete_job(job['job_id'], self.name)
+            print(f"[{self.name}] job {job['job_id']} {job['job_type']}: {result} "
+                  f"({(time.perf_counter() - started) * 1000:.0f} ms)"
+                  + ("" if completed else ", but it was requeued as stale meanwhile"))
+        except Exception as e:
+            if self.db.connection.closed:
+                raise  # lost the database; the job is requeued as stale later
+            error = f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}"
+            status = self.db.fail_job(job['job_id'], self.name, error, backoff_seconds(job['attempts']))
+            print(f"[{self.name}] job {job['job_id']} {job['job_type']} {status or 'requeued as stale'}: {e}")
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                if self.db is None:
+                    self.db = Database()
+                job = self.db.claim_job(self.name)
+                if job is not None:
+                    self.run_job(job)
+                elif self.once:
+                    return
+                else:
+                    self.stopping.wait(self.poll_interval)
+            except Exception as e:
+                print(f"[{self.name}] database error, reconnecting: {e}")
+                self.db = None
+                self.stopping.wait(5)
+        if self.db is not None:
+            self.db.close_connection()
+
+
+def maintenance_loop(stopping, interval=30.0):
+    """Enqueues due scheduled jobs, rescues jobs of crashed workers and trims old rows"""
+    db = None
+    while not stopping.is_set():
+        try:
+            if db is None:
+                db = Database()
+                ensure_schedules(db)
+            for job_type in db.enqueue_due_scheduled_jobs():
+                print(f"[scheduler] enqueued {job_type}")
+            db.requeue_stale_jobs()
+            db.purge_finished_jobs()
+        except Exception as e:
+            print(f"[scheduler] database error, reconnecting: {e}")
+            db = None
+        stopping.wait(interval)
+    if db is not None:
+        db.close_connection()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run background jobs from the jobs table")
+    parser.add_argument("--threads", type=int, default=int(os.getenv('WORKER_THREADS', '2')))
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds to wait when the queue is empty")
+    parser.add_argument("--once", action="store_true", help="enqueue due schedules, drain the queue and exit")
+    args = parser.parse_args(argv)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    if args.once:
+        db = Database()
+        ensure_schedules(db)
+        db.enqueue_due_scheduled_jobs()
+        db.close_connection()
+    else:
+        threading.Thread(target=maintenance_loop, args=(stopping,), daemon=True).start()
+
+    workers = [Worker(f"{prefix}:{i}", stopping, args.poll_interval, args.once)
+               for i in range(args.threads)]
+    for worker in workers:
+        worker.start()
+    print(f"Worker {prefix} running {args.threads} threads ({', '.join(HANDLERS)})")
+    try:
+        while any(w.is_alive() for w in workers):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        stopping.set()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()